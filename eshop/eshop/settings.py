@@ -10,6 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import importlib.util
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'purchase.middleware.MetricsMiddleware',
+    'purchase.middleware.ReplicaMiddleware',
+    'purchase.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,9 +89,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Persistent connections, checked before reuse. Set CONN_MAX_AGE=0
+        # under ASGI, where each request may run in a new thread.
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Local SQLite copy of the default database, refreshed by
+# `manage.py refresh_replica`; tests read the test database instead
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('REPLICA_NAME', BASE_DIR / 'db.replica.sqlite3'),
+    'TEST': {'MIRROR': 'default'},
+}
+
+# Reads of safe requests go to the replica when enabled, see purchase/routers.py
+DATABASE_ROUTERS = ['purchase.routers.ReplicaRouter']
+REPLICA = {
+    'ENABLED': os.environ.get('REPLICA_ENABLED', '') == '1',
+    'ALIAS': 'replica',
+    'STICKY_SECONDS': 15,
+    'COOKIE': 'replica_pin',
+}
+
+# PRAGMAs of every SQLite connection, see purchase/db.py
+SQLITE = {
+    'PROFILE': os.environ.get('SQLITE_PROFILE', 'production'),
+    'PRAGMAS': {},
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -131,13 +164,97 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
 
 }
 
+# MessagePack requests and responses when msgpack is installed, see
+# purchase/renderers.py
+if importlib.util.find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('purchase.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('purchase.parsers.MessagePackParser')
+
 
 SPECTACULAR_SETTINGS = {
     'SCHEMA_PATH_PREFIX': r'^/purchase/',
 }
+
+# Order numbers are reserved in blocks and handed out from memory,
+# see purchase/order_numbers.py
+ORDER_NUMBER_ALLOCATOR = {
+    'BACKEND': 'purchase.order_numbers.BlockOrderNumberAllocator',
+    'OPTIONS': {
+        'block_size': 100,
+    },
+}
+
+# Request metrics exported at /metrics, see purchase/metrics.py. Every
+# worker process writes its metrics to DIRECTORY, which they must share.
+# Scrapers must connect from ALLOWED_IPS or send `Authorization: Bearer TOKEN`.
+METRICS = {
+    'DIRECTORY': os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'eshop-metrics')),
+    'FLUSH_INTERVAL': 1,
+    'ALLOWED_IPS': os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(','),
+    'TOKEN': os.environ.get('METRICS_TOKEN') or None,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Compressed response bodies, see purchase/compression.py
+    'compressed': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'compressed',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 500,
+        },
+    },
+    # Supplier list pages and generation, see purchase/cache.py. Local
+    # memory is per process: use a shared backend with several workers.
+    'suppliers': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'suppliers',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            # least recently used entries are evicted past MAX_ENTRIES
+            'MAX_ENTRIES': 1000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+SUPPLIER_CACHE = {
+    'ALIAS': 'suppliers',
+    # supplier representations kept in memory by each process
+    'MAX_ENTRIES': 10000,
+}
+
+# Orders of days older than AGE_DAYS are moved to the archive tables by
+# `manage.py archive_orders`, see purchase/archive.py
+ARCHIVE = {
+    'AGE_DAYS': 365,
+    'BATCH_SIZE': 1000,
+}
+
+# Responses compressed by CompressionMiddleware, see purchase/compression.py.
+# zstd and br need the zstandard and brotli packages.
+COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'CODECS': ['zstd', 'br', 'gzip'],
+    'LEVELS': {'zstd': 3, 'br': 4, 'gzip': 6},
+    'CACHE': 'compressed',
+}
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
 
-from purchase.views import UserViewSet, GroupViewSet
+from purchase.views import UserViewSet, GroupViewSet, metrics
 from purchase import urls as purchase_urls
 
 # Docs
@@ -17,6 +17,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('purchase/', include(purchase_urls)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+    path('metrics', metrics, name='metrics'),
     path('', include(router.urls)),
 ]
 
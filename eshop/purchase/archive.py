@@ -0,0 +1,100 @@
+"""
+Archival of old orders into cold tables.
+
+Orders, and their line items, are never deleted by the API, so `Order` and
+`LineItem`, which every list, filter and write goes through, would grow
+without bound. `archive_orders` moves the orders of days older than
+ARCHIVE['AGE_DAYS'] into `ArchivedOrder` and `ArchivedLineItem`, keeping
+their ids, order numbers, times and versions, so the hot tables and their
+indexes only hold recent orders.
+
+Orders are moved in batches of ARCHIVE['BATCH_SIZE'], one transaction
+each: the orders of a batch are locked, copied with their line items by
+bulk inserts and deleted from the hot tables. Interrupting the command
+leaves every order in exactly one of the two tables.
+
+Moving orders does not change the reporting rollups: they are left
+`unchanged()` while orders are deleted from the hot tables, and
+`purchase.reporting` counts the orders and the archived orders of each cell
+when it rebuilds them. A cell can hold both, e.g. after orders of an
+archived day are imported.
+
+Archived orders stay readable, not writable: retrieving an order by id
+falls back to the archive, and `?include_archived=true` adds them to order
+lists. They are not exported and not served by the async views.
+
+Settings:
+
+    ARCHIVE = {
+        'AGE_DAYS': 365,      # orders of older days are archived
+        'BATCH_SIZE': 1000,   # orders moved per transaction
+    }
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from purchase import reporting
+from purchase.models import ArchivedLineItem, ArchivedOrder, LineItem, Order
+
+ORDER_COLUMNS = ('id', 'supplier_id', 'order_time', 'order_number', 'version')
+LINE_ITEM_COLUMNS = ('id', 'item_name', 'quantity', 'price_without_tax', 'tax_name',
+                     'tax_amount', 'purchase_order_id')
+
+
+def get_setting(name, default):
+    return getattr(settings, 'ARCHIVE', {}).get(name, default)
+
+
+def cutoff_day(age_days=None, now=None):
+    """The first day whose orders stay in the hot tables."""
+    if age_days is None:
+        age_days = get_setting('AGE_DAYS', 365)
+    return reporting.day_of((now or timezone.now()) - timedelta(days=age_days))
+
+
+def archivable(day):
+    """Orders of the days before `day`."""
+    return Order.objects.filter(order_time__lt=reporting.day_range(day)[0])
+
+
+def archive_orders(day, batch_size=None, progress=None):
+    """
+    Move the orders of the days before `day`, with their line items, into
+    the archive. Returns the number of orders and line items moved.
+    """
+    batch_size = batch_size or get_setting('BATCH_SIZE', 1000)
+    orders = line_items = 0
+    while True:
+        with transaction.atomic(using=Order.objects.db):
+            # locked, so no line item is added to them before they are deleted
+            order_ids = list(archivable(day).select_for_update().order_by()
+                             .values_list('id', flat=True)[:batch_size])
+            if not order_ids:
+                break
+            moved = archive_batch(order_ids)
+        orders, line_items = orders + moved[0], line_items + moved[1]
+        if progress:
+            progress(orders, line_items)
+    return orders, line_items
+
+
+def archive_batch(order_ids):
+    """
+    Move the locked orders `order_ids` and their line items into the
+    archive. Returns the number of orders and line items moved.
+    """
+    archived_orders = [ArchivedOrder(**row) for row in
+                       Order.objects.filter(id__in=order_ids).values(*ORDER_COLUMNS)]
+    archived_line_items = [ArchivedLineItem(**row) for row in
+                           LineItem.objects.filter(purchase_order_id__in=order_ids)
+                           .values(*LINE_ITEM_COLUMNS)]
+    ArchivedOrder.objects.bulk_create(archived_orders)
+    ArchivedLineItem.objects.bulk_create(archived_line_items)
+
+    # The line items go with their orders, in one DELETE per batch of orders
+    with reporting.unchanged():
+        Order.objects.filter(id__in=[order.id for order in archived_orders]).delete()
+    return len(archived_orders), len(archived_line_items)
@@ -0,0 +1,237 @@
+"""
+Async-native read endpoints, for ASGI deployments.
+
+DRF views are synchronous: under an ASGI server each request to them holds
+a thread for its whole duration, waits on the database included. The views
+here serve the same list and retrieve responses as the DRF viewsets (same
+serializers, filters, keyset pagination, ETags, authentication and
+permissions) from `async def` handlers using the async ORM (`aiterator`,
+`aget`), so one worker overlaps many slow reads: a thread is only taken
+while a query runs, not while the response is built or sent.
+
+They are read-only and mounted under /purchase/async/; writes go through
+the DRF views. Under WSGI they work too, but every request then runs its
+own event loop and the DRF views are faster.
+
+The browsable API is not offered: its forms query the database
+synchronously. Session authentication is resolved with `request.auser()`;
+other authentication classes (e.g. Basic, whose password hashing is CPU
+bound anyway) run in a thread.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from django.views import View
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import exceptions, permissions, status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from purchase import cache as supplier_cache, etags, representations, search
+from purchase.filters import OrderFilter
+from purchase.models import Supplier, Order, LineItem
+from purchase.pagination import OrderCursorPagination, SupplierCursorPagination, LineItemCursorPagination
+from purchase.serializers import SupplierSerializer, OrderSerializer, LineItemSerializer
+
+
+class AsyncReadView(View):
+    """
+    List (no `pk`) and retrieve (`pk`) handler of a model, the async
+    counterpart of a DRF ReadOnlyModelViewSet.
+    """
+    queryset = None
+    serializer_class = None
+    pagination_class = None
+    filterset_class = None
+    renderer_classes = [renderer for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+                        if not issubclass(renderer, BrowsableAPIRenderer)]
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['get', 'head', 'options']
+    supplier_generation = None
+
+    async def get(self, request, pk=None):
+        request = Request(request, parser_context={'view': self})
+        try:
+            self.perform_content_negotiation(request)
+            await self.perform_authentication(request)
+            self.check_permissions(request)
+            # before reading anything, see purchase/cache.py
+            self.supplier_generation = supplier_cache.generation()
+            if pk is None:
+                response = await self.list(request)
+            else:
+                response = await self.retrieve(request, pk)
+        except Exception as exc:
+            response = self.handle_exception(request, exc)
+        return self.finalize_response(request, response)
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def get_serializer(self, request, *args, **kwargs):
+        return self.serializer_class(*args, context={
+            'request': request, 'format': None, 'view': self,
+            'supplier_generation': self.supplier_generation}, **kwargs)
+
+    def perform_content_negotiation(self, request):
+        renderers = [renderer() for renderer in self.renderer_classes]
+        try:
+            request.accepted_renderer, request.accepted_media_type = (
+                api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS().select_renderer(
+                    request, renderers))
+        except exceptions.NotAcceptable:
+            # rendered with the first renderer, as DRF does
+            request.accepted_renderer = renderers[0]
+            request.accepted_media_type = renderers[0].media_type
+            raise
+
+    async def perform_authentication(self, request):
+        user, auth = None, None
+        for authenticator in [authentication() for authentication in self.authentication_classes]:
+            if isinstance(authenticator, SessionAuthentication):
+                # CSRF is only enforced for unsafe methods, and these are reads
+                session_user = await request._request.auser()
+                if session_user.is_active:
+                    user = session_user
+            else:
+                result = await sync_to_async(authenticator.authenticate)(request)
+                if result is not None:
+                    user, auth = result
+            if user is not None:
+                break
+        request.user = user if user is not None else AnonymousUser()
+        request.auth = auth
+
+    def check_permissions(self, request):
+        for permission in [permission() for permission in self.permission_classes]:
+            if not permission.has_permission(request, self):
+                if not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+
+    async def filter_queryset(self, request, queryset):
+        return DjangoFilterBackend().filter_queryset(request, queryset, self)
+
+    async def get_object(self, request, pk):
+        queryset = await self.filter_queryset(request, self.get_queryset())
+        try:
+            return await queryset.aget(pk=pk)
+        except (queryset.model.DoesNotExist, TypeError, ValueError):
+            raise Http404
+
+    async def list(self, request):
+        queryset = await self.filter_queryset(request, self.get_queryset())
+        paginator = self.pagination_class()
+        page = await paginator.apaginate_queryset(queryset, request, view=self)
+        self.paginator = paginator
+        return paginator.get_paginated_response(
+            self.get_serializer(request, page, many=True).data)
+
+    async def retrieve(self, request, pk):
+        instance = await self.get_object(request, pk)
+        return Response(self.get_serializer(request, instance).data)
+
+    def handle_exception(self, request, exc):
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            header = self.authentication_classes[0]().authenticate_header(request)
+            if header:
+                exc.auth_header = header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+
+        response = api_settings.EXCEPTION_HANDLER(exc, {'view': self, 'request': request})
+        if response is None:
+            raise exc
+        return response
+
+    def finalize_response(self, request, response):
+        """Render like DRF, into a plain HttpResponse the handler does not render again."""
+        renderer = request.accepted_renderer
+        content = renderer.render(response.data, request.accepted_media_type,
+                                  {'view': self, 'request': request, 'response': response})
+        headers = {name: value for name, value in response.items() if name != 'Content-Type'}
+        headers['Allow'] = 'GET, HEAD, OPTIONS'
+        if len(self.renderer_classes) > 1:
+            headers['Vary'] = 'Accept'
+        rendered = HttpResponse(content, status=response.status_code, headers=headers)
+        if content:
+            rendered['Content-Type'] = (f'{renderer.media_type}; charset={renderer.charset}'
+                                        if renderer.charset else renderer.media_type)
+        else:
+            del rendered['Content-Type']
+        return rendered
+
+
+class AsyncSupplierView(AsyncReadView):
+    queryset = Supplier.objects.all()
+    serializer_class = SupplierSerializer
+    pagination_class = SupplierCursorPagination
+
+    async def list(self, request):
+        async def build():
+            return (await super(AsyncSupplierView, self).list(request)).data
+        return Response(await supplier_cache.acached_list(request.build_absolute_uri(), build))
+
+    async def retrieve(self, request, pk):
+        data = supplier_cache.get_by_id(int(pk)) if pk.isdigit() else None
+        if data is None:
+            return await super().retrieve(request, pk)
+        return Response(data)
+
+
+class AsyncOrderView(AsyncReadView):
+    """Orders, with the ETags and conditional GETs of OrderViewSet."""
+    queryset = Order.objects.for_serialization()
+    serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
+    filterset_class = OrderFilter
+
+    async def filter_queryset(self, request, queryset):
+        # warm the check made by the search filters
+        await search.ais_available(queryset.db)
+        return await super().filter_queryset(request, queryset)
+
+    async def retrieve(self, request, pk):
+        expected = etags.if_none_match(request)
+        if expected is not None and pk.isdigit():
+            queryset = await self.filter_queryset(request, Order.objects.all())
+            key = await queryset.filter(pk=pk).values_list(
+                *representations.etag_columns()).afirst()
+            if key is not None:
+                etag = etags.order_etag(request, key)
+                if etags.matches(expected, etag):
+                    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        instance = await self.get_object(request, pk)
+        return Response(self.get_serializer(request, instance).data,
+                        headers={'ETag': etags.order_etag(request, (
+                            instance.pk, instance.version, instance.supplier.version))})
+
+    async def list(self, request):
+        expected = etags.if_none_match(request)
+        if expected is not None:
+            paginator = self.pagination_class()
+            queryset = await self.filter_queryset(request, Order.objects.all())
+            keys = await paginator.apaginate_queryset(
+                queryset.values_list(*representations.etag_columns(), named=True),
+                request, view=self)
+            etag = etags.page_etag(request, [tuple(key) for key in keys], paginator.has_next)
+            if etags.matches(expected, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        response = await super().list(request)
+        response['ETag'] = etags.page_etag(
+            request, [(order.id, order.version, order.supplier.version)
+                      for order in self.paginator.page],
+            self.paginator.has_next)
+        return response
+
+
+class AsyncLineItemView(AsyncReadView):
+    queryset = LineItem.objects.all()
+    serializer_class = LineItemSerializer
+    pagination_class = LineItemCursorPagination
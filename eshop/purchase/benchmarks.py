@@ -0,0 +1,501 @@
+"""
+Micro-benchmarks of the serializers, filters and views on the order hot paths.
+
+Every benchmark is a setup function registered with `@benchmark(name)`: it
+receives a `Fixture` describing a generated dataset and returns the callable
+to time. `run_benchmarks` times each callable at every dataset size and also
+records the queries and memory of one extra call. Results are plain dicts so
+they can be saved as JSON and compared against a baseline with `compare`.
+
+`load_test` compares the sync (WSGI) and async (ASGI) read views under
+concurrent clients instead, see `python manage.py benchmark --load`.
+
+Run them with `python manage.py benchmark`.
+"""
+import asyncio
+import io
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import django
+from asgiref.sync import ThreadSensitiveContext, async_to_sync
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from purchase import cache as supplier_cache, representations
+from purchase.datagen import DatasetGenerator, DatasetOptions
+from purchase.filters import OrderFilter
+from purchase.models import Supplier, Order, LineItem
+from purchase.parsers import MessagePackParser
+from purchase.renderers import MessagePackRenderer, msgpack
+from purchase.serializers import OrderSerializer
+
+BENCHMARKS = {}
+
+PAGE_SIZE = 100
+
+# orders in the payloads of the codec benchmarks
+CODEC_ORDERS = 1000
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class Fixture:
+    """A generated dataset of `size` orders and sample inputs drawn from it."""
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.seed = seed
+
+    def generate(self):
+        DatasetGenerator(DatasetOptions(
+            suppliers=max(3, self.size // 20),
+            orders=self.size,
+            items_per_order=5,
+            items_distribution='poisson',
+            item_names=max(10, self.size // 4),
+            seed=self.seed,
+        )).generate()
+
+        self.order = Order.objects.for_serialization().get(
+            id=Order.objects.order_by('id').values_list('id', flat=True)[self.size // 2])
+        self.supplier_name = self.order.supplier.name
+        self.item_name = self.order.line_items.all()[0].item_name
+        self.client = APIClient()
+        self.client.force_login(User.objects.get_or_create(username='benchmark')[0])
+
+    def get(self, url):
+        response = self.client.get(url)
+        assert response.status_code == 200, f'GET {url}: {response.status_code}'
+        return response.content
+
+    async def aget(self, url):
+        client = AsyncClient()
+        client.cookies = self.client.cookies
+        response = await client.get(url)
+        assert response.status_code == 200, f'GET {url}: {response.status_code}'
+        return response.content
+
+    def cookie(self):
+        """The session cookie header of the logged in client."""
+        return '; '.join(f'{name}={morsel.value}' for name, morsel in self.client.cookies.items())
+
+    @staticmethod
+    def clear():
+        # line items first, so deleting orders does not cascade row by row
+        LineItem.objects.all().delete()
+        Order.objects.all().delete()
+        Supplier.objects.all().delete()
+
+    def payload(self):
+        """The API representation of a mid-table order, as a client sends it back."""
+        data = OrderSerializer(self.order).data
+        return {
+            'supplier': dict(data['supplier']),
+            'line_items': [{field: line_item[field] for field in (
+                'id', 'item_name', 'quantity', 'price_without_tax', 'tax_name', 'tax_amount')}
+                for line_item in data['line_items']],
+        }
+
+
+@contextmanager
+def rolled_back():
+    """Run writes in a transaction that is rolled back, so every call sees the same data."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@benchmark('serializer.to_representation')
+def serialize_page(fixture):
+    context = {'supplier_generation': supplier_cache.generation()}
+    orders = list(Order.objects.for_serialization()[:PAGE_SIZE])
+    return lambda: OrderSerializer(orders, many=True, context=context).data
+
+
+@benchmark('serializer.values')
+def represent_page(fixture):
+    # the same page, from the rows of the order views' fast path
+    supplier_generation = supplier_cache.generation()
+    rows = list(representations.order_rows(Order.objects.all())[:PAGE_SIZE])
+    line_items_rows = list(representations.line_item_rows(
+        LineItem.objects.filter(purchase_order_id__in=[row['id'] for row in rows])
+        .order_by(*LineItem.ORDER_ORDERING)))
+    return lambda: representations.represent_orders(
+        rows, line_items_rows, supplier_generation=supplier_generation)
+
+
+@benchmark('serializer.validate')
+def validate_order(fixture):
+    payload = fixture.payload()
+    for line_item in payload['line_items']:
+        del line_item['id']
+
+    def run():
+        serializer = OrderSerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+    return run
+
+
+@benchmark('serializer.create')
+def create_order(fixture):
+    payload = fixture.payload()
+    for line_item in payload['line_items']:
+        del line_item['id']
+
+    def run():
+        with rolled_back():
+            serializer = OrderSerializer(data=payload)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+    return run
+
+
+@benchmark('serializer.update')
+def update_order(fixture):
+    payload = fixture.payload()
+    payload['line_items'][0]['quantity'] += 1
+    payload['line_items'].append(dict(payload['line_items'][0], id=None))
+
+    def run():
+        with rolled_back():
+            order = Order.objects.for_serialization().get(id=fixture.order.id)
+            serializer = OrderSerializer(order, data=payload)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+    return run
+
+
+def filter_orders(params):
+    return lambda: list(OrderFilter(params, queryset=Order.objects.all()).qs[:PAGE_SIZE])
+
+
+def with_payload(run, content):
+    """`run`, reporting the size of the `content` it encodes or decodes."""
+    run.payload_kib = round(len(content) / 1024, 1)
+    return run
+
+
+def codec_payload(fixture):
+    return OrderSerializer(
+        Order.objects.for_serialization()[:CODEC_ORDERS], many=True).data
+
+
+def render_benchmark(renderer):
+    def setup(fixture):
+        data = codec_payload(fixture)
+        return with_payload(lambda: renderer.render(data), renderer.render(data))
+    return setup
+
+
+def parse_benchmark(renderer, parser):
+    def setup(fixture):
+        content = renderer.render(codec_payload(fixture))
+        return with_payload(lambda: parser.parse(io.BytesIO(content)), content)
+    return setup
+
+
+benchmark('codec.json_render')(render_benchmark(JSONRenderer()))
+benchmark('codec.json_parse')(parse_benchmark(JSONRenderer(), JSONParser()))
+if msgpack is not None:
+    benchmark('codec.msgpack_render')(render_benchmark(MessagePackRenderer()))
+    benchmark('codec.msgpack_parse')(parse_benchmark(MessagePackRenderer(), MessagePackParser()))
+
+
+@benchmark('filter.supplier_name')
+def filter_supplier_name(fixture):
+    return filter_orders({'supplier_name': fixture.supplier_name})
+
+
+@benchmark('filter.item_name')
+def filter_item_name(fixture):
+    return filter_orders({'item_name': fixture.item_name})
+
+
+@benchmark('filter.order_time')
+def filter_order_time(fixture):
+    return filter_orders({'order_time_after': fixture.order.order_time.isoformat()})
+
+
+@benchmark('view.order_list')
+def order_list(fixture):
+    url = reverse('order-list')
+    return lambda: fixture.get(url)
+
+
+@benchmark('view.order_detail')
+def order_detail(fixture):
+    url = reverse('order-detail', args=[fixture.order.id])
+    return lambda: fixture.get(url)
+
+
+@benchmark('view.order_list_async')
+def order_list_async(fixture):
+    url = reverse('async-order-list')
+    return lambda: async_to_sync(fixture.aget)(url)
+
+
+@benchmark('view.order_detail_async')
+def order_detail_async(fixture):
+    url = reverse('async-order-detail', args=[fixture.order.id])
+    return lambda: async_to_sync(fixture.aget)(url)
+
+
+def percentile(timings, percent):
+    """Nearest-rank percentile of a sorted list."""
+    return timings[max(0, math.ceil(percent / 100 * len(timings)) - 1)]
+
+
+def measure(run, repeat, warmup):
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    # queries and memory are measured on a separate call, tracing slows it down
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            before, _ = tracemalloc.get_traced_memory()
+            run()
+            after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'calls': repeat,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'queries': len(queries),
+        'peak_kib': round((peak - before) / 1024, 1),
+        'retained_kib': round((after - before) / 1024, 1),
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': f'{connection.vendor} {connection.Database.sqlite_version}'
+                    if connection.vendor == 'sqlite' else connection.vendor,
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def run_benchmarks(sizes, names=None, repeat=20, warmup=2, seed=0, progress=None):
+    """
+    Run the `names` benchmarks (all by default) against a dataset of each
+    size. The tables are cleared before each dataset is generated.
+    """
+    names = list(names or BENCHMARKS)
+    results = []
+    for size in sorted(sizes):
+        fixture = Fixture(size, seed)
+        fixture.clear()
+        fixture.generate()
+        for name in names:
+            run = BENCHMARKS[name](fixture)
+            result = {'name': name, 'size': size, **measure(run, repeat, warmup)}
+            if hasattr(run, 'payload_kib'):
+                result['payload_kib'] = run.payload_kib
+            results.append(result)
+            if progress:
+                progress(result)
+    return {'environment': environment(), 'results': results}
+
+
+def load_targets(fixture):
+    """(name, sync url, async url) of the views compared by `load_test`."""
+    return [
+        ('order_list', reverse('order-list'), reverse('async-order-list')),
+        ('order_detail', reverse('order-detail', args=[fixture.order.id]),
+         reverse('async-order-detail', args=[fixture.order.id])),
+    ]
+
+
+@contextmanager
+def simulated_latency(seconds):
+    """Delay every query by `seconds` on connections opened meanwhile, like a remote database."""
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(delay)
+
+    if seconds:
+        connection_created.connect(install)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+
+
+def wsgi_get(handler, url, cookie):
+    path, _, query = url.partition('?')
+    statuses = []
+    body = handler({
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_COOKIE': cookie, 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }, lambda status, headers: statuses.append(status))
+    try:
+        b''.join(body)
+    finally:
+        body.close()
+    assert statuses[0].startswith('200'), f'GET {url}: {statuses[0]}'
+
+
+async def asgi_get(handler, url, cookie):
+    path, _, query = url.partition('?')
+    messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+    sent = []
+
+    async def receive():
+        message = next(messages, None)
+        if message is None:
+            # the client never disconnects, the handler cancels this wait
+            await asyncio.Event().wait()
+        return message
+
+    async def send(message):
+        sent.append(message)
+
+    await handler({
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }, receive, send)
+    assert sent[0]['status'] == 200, f'GET {url}: {sent[0]["status"]}'
+
+
+def serve_wsgi(url, cookie, concurrency, requests, threads):
+    """Per request latencies of `concurrency` clients sharing a pool of `threads` threads."""
+    handler = WSGIHandler()
+
+    def client(count, pool):
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            pool.submit(wsgi_get, handler, url, cookie).result()
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    with ThreadPoolExecutor(threads) as pool, ThreadPoolExecutor(concurrency) as clients:
+        futures = [clients.submit(client, count, pool)
+                   for count in split(requests, concurrency)]
+        return [timing for future in futures for timing in future.result()]
+
+
+def serve_asgi(url, cookie, concurrency, requests):
+    """Per request latencies of `concurrency` clients served by one event loop."""
+    handler = ASGIHandler()
+
+    async def client(count):
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            await asgi_get(handler, url, cookie)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    async def clients():
+        # each client is its own context, as in an ASGI server
+        async def run(count):
+            async with ThreadSensitiveContext():
+                return await client(count)
+        return await asyncio.gather(*(run(count) for count in split(requests, concurrency)))
+
+    return [timing for timings in asyncio.run(clients()) for timing in timings]
+
+
+def split(requests, concurrency):
+    return [requests // concurrency + (index < requests % concurrency)
+            for index in range(concurrency)]
+
+
+def load_test(size, concurrency=32, requests=256, threads=4, db_latency=0.002, seed=0,
+              progress=None):
+    """
+    Serve the `load_targets` views to `concurrency` clients, `requests` GETs
+    each way: the DRF views through a WSGI handler with `threads` threads
+    (one worker's pool), the async views through an ASGI handler on a
+    single event loop. `db_latency` seconds are added to every query.
+
+    The database must be committed and shared between threads (a file, or
+    SQLite's shared in-memory test database), not a TestCase transaction.
+    """
+    fixture = Fixture(size, seed)
+    fixture.clear()
+    fixture.generate()
+    cookie = fixture.cookie()
+
+    results = []
+    with simulated_latency(db_latency):
+        for name, sync_url, async_url in load_targets(fixture):
+            for mode, serve in (
+                    ('sync', lambda: serve_wsgi(sync_url, cookie, concurrency, requests, threads)),
+                    ('async', lambda: serve_asgi(async_url, cookie, concurrency, requests))):
+                start = time.perf_counter()
+                timings = sorted(serve())
+                elapsed = time.perf_counter() - start
+                result = {
+                    'name': f'load.{name}', 'mode': mode, 'size': size,
+                    'concurrency': concurrency, 'requests': len(timings),
+                    'rps': round(len(timings) / elapsed, 1),
+                    'p50_ms': round(percentile(timings, 50) * 1000, 3),
+                    'p95_ms': round(percentile(timings, 95) * 1000, 3),
+                }
+                results.append(result)
+                if progress:
+                    progress(result)
+    return {'environment': environment(), 'results': results}
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Regressions of `results` against `baseline`: a p50 latency or peak memory
+    more than `threshold` above the baseline, or any extra query.
+    """
+    previous = {(result['name'], result['size']): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        base = previous.get((result['name'], result['size']))
+        if base is None:
+            continue
+        label = f"{result['name']} [{result['size']}]"
+        if result['queries'] > base['queries']:
+            regressions.append(f"{label}: {base['queries']} -> {result['queries']} queries")
+        for key, unit in (('p50_ms', 'ms'), ('peak_kib', 'KiB')):
+            if result[key] > base[key] * (1 + threshold):
+                regressions.append(f"{label}: {key} {base[key]}{unit} -> {result[key]}{unit}")
+    return regressions
@@ -0,0 +1,202 @@
+"""
+Cache of supplier representations and supplier list responses.
+
+Suppliers change rarely but are serialized on every supplier request and
+nested in every order, so their API representations and whole list pages
+are cached. Every write moves the suppliers to a new *generation*, a
+counter kept in Django's cache framework: `post_save` and `post_delete`
+signals (see purchase/signals.py) and the bulk write paths call
+`invalidate`. Entries of older generations are never read again.
+
+- List pages are stored in the Django cache, keyed by generation and URL.
+- Representations are kept in a per-process LRU keyed by generation and
+  id: looking up dozens of pickled entries in the cache backend for an
+  order page costs more than serializing them.
+
+Suppliers written in the current transaction are not cached until it
+commits (and invalidated again then), so a rollback or a concurrent reader
+cannot leave a stale entry behind. Neither is what is read from the
+replica (see purchase/routers.py): a copy older than the last write would
+be cached under the generation of that write.
+
+Settings:
+
+    CACHES['suppliers']                 # TIMEOUT is the TTL
+    SUPPLIER_CACHE = {
+        'ALIAS': 'suppliers',
+        'MAX_ENTRIES': 10000,           # representations kept per process
+    }
+
+The default local memory cache is per process: deployments running several
+workers need a shared backend (Redis, Memcached) for writes to be seen by
+every worker before the TTL expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from purchase import routers
+from purchase.models import Supplier
+
+GENERATION_KEY = 'supplier-generation'
+
+_local = Local()
+
+
+def get_setting(name, default):
+    return getattr(settings, 'SUPPLIER_CACHE', {}).get(name, default)
+
+
+def get_cache():
+    return caches[get_setting('ALIAS', 'default')]
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU mapping whose entries expire after the cache TTL."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        expires = time.monotonic() + get_cache().default_timeout
+        max_entries = get_setting('MAX_ENTRIES', 10000)
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_representations = LRUCache()
+
+
+def pending_ids():
+    """Ids of the suppliers written in the current, uncommitted transaction."""
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = set()
+    # Outside a transaction, whatever was pending has been committed or rolled back
+    if pending and not transaction.get_connection(Supplier.objects.db).in_atomic_block:
+        pending.clear()
+    return pending
+
+
+def new_generation():
+    # after an eviction, a fresh value cannot collide with an older generation
+    return time.time_ns()
+
+
+def generation():
+    """
+    The current generation. Take it before reading the database: a write
+    made meanwhile moves on to a new generation instead of caching stale data.
+    """
+    return get_cache().get_or_set(GENERATION_KEY, new_generation, None)
+
+
+def representations(suppliers, serialize, current):
+    """
+    Representations of `suppliers` by id, serialized with `serialize` on a
+    miss. `current` is the generation taken before `suppliers` were read:
+    they are only cached if no write moved on to another generation since,
+    and never when it is None.
+    """
+    latest, pending = generation(), pending_ids()
+    store = current == latest and not routers.reads_replica()
+    data = {}
+    for supplier in suppliers:
+        if supplier.pk in pending:
+            data[supplier.pk] = serialize(supplier)
+            continue
+        cached = local_representations.get((latest, supplier.pk))
+        if cached is None:
+            cached = serialize(supplier)
+            if store:
+                local_representations.set((latest, supplier.pk), cached)
+        # callers may modify the representation they get
+        data[supplier.pk] = dict(cached)
+    return data
+
+
+def representation(supplier, serialize, current):
+    return representations([supplier], serialize, current)[supplier.pk]
+
+
+def get_by_id(supplier_id):
+    if supplier_id in pending_ids():
+        return None
+    cached = local_representations.get((generation(), supplier_id))
+    return dict(cached) if cached is not None else None
+
+
+def cached_list(url, build):
+    """The cached list response data for `url`, built with `build()` on a miss."""
+    if pending_ids():
+        return build()
+    key = f'supplier-list:{generation()}:{url}'
+    data = get_cache().get(key)
+    if data is None:
+        data = build()
+        if not routers.reads_replica():
+            get_cache().set(key, data)
+    return data
+
+
+async def acached_list(url, build):
+    """
+    `cached_list` for async views, `build` is a coroutine function. Cache
+    lookups stay synchronous: they are in-process or sub-millisecond.
+    """
+    if pending_ids():
+        return await build()
+    key = f'supplier-list:{generation()}:{url}'
+    data = get_cache().get(key)
+    if data is None:
+        data = await build()
+        if not routers.reads_replica():
+            get_cache().set(key, data)
+    return data
+
+
+def bump_generation():
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, new_generation(), None)
+
+
+def invalidate(ids):
+    """Drop the cached representations of `ids` and every cached list page."""
+    ids = set(ids)
+    bump_generation()
+    if transaction.get_connection(Supplier.objects.db).in_atomic_block:
+        pending = pending_ids()
+        pending.update(ids)
+
+        def committed():
+            pending.difference_update(ids)
+            # Readers may have cached the previous version meanwhile
+            bump_generation()
+        transaction.on_commit(committed, using=Supplier.objects.db)
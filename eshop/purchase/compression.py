@@ -0,0 +1,147 @@
+"""
+Response compression, applied by CompressionMiddleware (purchase/middleware.py).
+
+Responses of at least MIN_SIZE bytes are compressed with the first codec of
+CODECS the client accepts (Accept-Encoding): zstd and brotli when the
+`zstandard` and `brotli` packages are installed, gzip always. Streaming
+responses, such as the order export, are compressed chunk by chunk as they
+are produced, whatever their size.
+
+HTML responses, the browsable API, are never compressed: they reflect
+request input next to the CSRF token, which compression would leak to a
+BREACH attack. Neither are responses marked `Cache-Control: no-transform`.
+
+Compressing a large page costs more than rendering it. The compressed
+bodies of responses that are likely to be requested again, those carrying
+an ETag (orders) or marked with `cache_compressed` (suppliers served from
+their cache), are kept in a cache keyed by a digest of the uncompressed
+body, so repeated hits only hash the bytes instead of compressing them.
+
+Settings:
+
+    COMPRESSION = {
+        'MIN_SIZE': 1024,                   # bytes
+        'CODECS': ['zstd', 'br', 'gzip'],   # server preference
+        'LEVELS': {'zstd': 3, 'br': 4, 'gzip': 6},
+        'CACHE': 'compressed',              # CACHES alias, None to disable
+    }
+"""
+import hashlib
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import cc_delim_re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+
+
+def get_setting(name, default):
+    return getattr(settings, 'COMPRESSION', {}).get(name, default)
+
+
+def compressible(response):
+    """Whether `response` may be compressed, whatever its size."""
+    if response.has_header('Content-Encoding'):
+        return False
+    if response.get('Content-Type', '').split(';')[0].strip().lower() == 'text/html':
+        return False
+    directives = cc_delim_re.split(response.get('Cache-Control', ''))
+    return 'no-transform' not in (directive.strip().lower() for directive in directives)
+
+
+def gzip_compressor(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def brotli_compressor(level):
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+
+
+def zstd_compressor(level):
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, compressor.flush
+
+
+# Content-Encoding -> function returning the (compress, flush) functions of a new stream
+COMPRESSORS = {'gzip': gzip_compressor}
+if brotli is not None:
+    COMPRESSORS['br'] = brotli_compressor
+if zstandard is not None:
+    COMPRESSORS['zstd'] = zstd_compressor
+
+
+def level(codec):
+    return get_setting('LEVELS', {}).get(codec, DEFAULT_LEVELS[codec])
+
+
+def choose_codec(accept_encoding):
+    """The preferred available codec accepted by an Accept-Encoding header, or None."""
+    accepted = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for codec in get_setting('CODECS', ['zstd', 'br', 'gzip']):
+        if codec in COMPRESSORS and accepted.get(codec, accepted.get('*', 0)) > 0:
+            return codec
+    return None
+
+
+def compress(codec, content):
+    compress_chunk, flush = COMPRESSORS[codec](level(codec))
+    return compress_chunk(content) + flush()
+
+
+def compress_cached(codec, content):
+    """`compress`, reusing the bytes compressed last time the same content was."""
+    alias = get_setting('CACHE', 'compressed')
+    if alias is None:
+        return compress(codec, content)
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    key = f'compressed:{codec}:{level(codec)}:{digest}'
+    cache = caches[alias]
+    compressed = cache.get(key)
+    if compressed is None:
+        compressed = compress(codec, content)
+        cache.set(key, compressed)
+    return compressed
+
+
+def compress_stream(codec, chunks):
+    compress_chunk, flush = COMPRESSORS[codec](level(codec))
+    for chunk in chunks:
+        # compressors buffer small chunks until they have a block to emit
+        compressed = compress_chunk(chunk)
+        if compressed:
+            yield compressed
+    yield flush()
+
+
+async def acompress_stream(codec, chunks):
+    compress_chunk, flush = COMPRESSORS[codec](level(codec))
+    async for chunk in chunks:
+        compressed = compress_chunk(chunk)
+        if compressed:
+            yield compressed
+    yield flush()
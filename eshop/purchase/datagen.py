@@ -0,0 +1,144 @@
+"""
+Deterministic synthetic purchase data, for benchmarks and local testing at
+production scale. The same options and seed always produce the same rows.
+"""
+import math
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from django.db import connections, transaction
+
+from purchase import reporting, search
+from purchase.models import Supplier, Order, LineItem
+from purchase.order_numbers import allocate_order_numbers
+
+TAX_NAMES = ['GST 5%', 'GST 12%', 'GST 18%', 'VAT 10%', 'VAT 20%']
+TAX_RATES = [0.05, 0.12, 0.18, 0.10, 0.20]
+
+DISTRIBUTIONS = ['fixed', 'uniform', 'poisson']
+
+LINE_ITEM_COLUMNS = [
+    'item_name', 'quantity', 'price_without_tax', 'tax_name', 'tax_amount', 'purchase_order']
+
+
+@dataclass
+class DatasetOptions:
+    suppliers: int = 3
+    orders: int = 3
+    # mean number of line items per order, and how it is distributed
+    items_per_order: float = 1
+    items_distribution: str = 'fixed'
+    # distinct item names
+    item_names: int = 100
+    # orders are spread uniformly over the `days` days before `end`
+    days: int = 365
+    end: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    # 0 spreads orders evenly over suppliers, higher values favour a few
+    # big suppliers (Zipf exponent)
+    supplier_skew: float = 0
+    seed: int = 0
+    batch_size: int = 5000
+
+
+class DatasetGenerator:
+    def __init__(self, options: DatasetOptions):
+        self.options = options
+        self.random = random.Random(options.seed)
+
+    def line_item_count(self):
+        mean = self.options.items_per_order
+        distribution = self.options.items_distribution
+        if distribution == 'fixed':
+            return round(mean)
+        if distribution == 'uniform':
+            return self.random.randint(1, max(1, round(2 * mean) - 1))
+        if distribution == 'poisson':
+            # 1 + Poisson(mean - 1), so every order has a line item (Knuth)
+            limit, count, product = math.exp(-max(mean - 1, 0)), 0, self.random.random()
+            while product > limit:
+                count += 1
+                product *= self.random.random()
+            return 1 + count
+        raise ValueError(f'Unknown distribution {distribution!r}, use one of {DISTRIBUTIONS}')
+
+    def suppliers(self):
+        return [Supplier(name=f'Supplier {index:06d}', email=f'supplier{index}@example.com')
+                for index in range(self.options.suppliers)]
+
+    def line_item_row(self, order_id):
+        """Column values of a line item, in LINE_ITEM_COLUMNS order."""
+        tax = self.random.randrange(len(TAX_NAMES))
+        price = round(self.random.uniform(1, 500), 2)
+        return (
+            f'Item {self.random.randrange(self.options.item_names):06d}',
+            self.random.randint(1, 50),
+            price,
+            TAX_NAMES[tax],
+            round(price * TAX_RATES[tax], 2),
+            order_id)
+
+    def generate(self, progress=None):
+        """
+        Write the dataset, one transaction per batch of orders.
+        `progress(orders, line_items)` is called after each batch.
+
+        Orders go through bulk_create, which returns their ids. Line items,
+        most of the rows, are inserted with a plain executemany: building and
+        compiling model instances would take several times longer than the
+        inserts themselves. The search index is dropped for the duration of
+        the load and rebuilt once at the end, rather than updated by its
+        triggers row by row; so are the reporting rollups of the range.
+        """
+        connection = connections[Order.objects.db]
+        insert_line_items = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            connection.ops.quote_name(LineItem._meta.db_table),
+            ', '.join(connection.ops.quote_name(LineItem._meta.get_field(name).column)
+                      for name in LINE_ITEM_COLUMNS),
+            ', '.join(['%s'] * len(LINE_ITEM_COLUMNS)))
+        rebuild_search_index = search.is_available(connection.alias)
+        if rebuild_search_index:
+            search.drop_index(connection)
+        try:
+            return self.write(connection, insert_line_items, progress)
+        finally:
+            if rebuild_search_index:
+                search.create_index(connection)
+
+    def write(self, connection, insert_line_items, progress):
+        options = self.options
+        suppliers = Supplier.objects.bulk_create(self.suppliers(), batch_size=options.batch_size)
+        cum_weights = list(accumulate(
+            1 / (rank + 1) ** options.supplier_skew for rank in range(len(suppliers))))
+        start = options.end - timedelta(days=options.days)
+        span = (options.end - start).total_seconds()
+
+        orders_done = line_items_done = 0
+        while orders_done < options.orders:
+            size = min(options.batch_size, options.orders - orders_done)
+            with transaction.atomic(using=connection.alias):
+                chosen = self.random.choices(suppliers, cum_weights=cum_weights, k=size)
+                orders = Order.objects.bulk_create([
+                    Order(supplier=supplier, order_number=order_number,
+                          order_time=start + timedelta(seconds=self.random.uniform(0, span)))
+                    for supplier, order_number in zip(chosen, allocate_order_numbers(size))
+                ])
+                line_items = [self.line_item_row(order.id)
+                              for order in orders
+                              for _ in range(self.line_item_count())]
+                with connection.cursor() as cursor:
+                    cursor.executemany(insert_line_items, line_items)
+
+            orders_done += size
+            line_items_done += len(line_items)
+            if progress:
+                progress(orders_done, line_items_done)
+
+        # One aggregate over the generated range instead of per-batch cells
+        reporting.rebuild(reporting.day_of(start), reporting.day_of(options.end))
+        return orders_done, line_items_done
+
+
+def generate_dataset(**options):
+    return DatasetGenerator(DatasetOptions(**options)).generate()
@@ -0,0 +1,45 @@
+"""
+ETags of order responses, for conditional GETs.
+
+An order's ETag is derived from its `version`, which is bumped in the
+database on every change to the order or its line items, and, when the
+supplier is nested in the response, from the supplier's `version` (see
+purchase/models.py): renaming a supplier does not write to its orders.
+Checking an `If-None-Match` header therefore costs one indexed query on the
+orders table, joined to their suppliers by primary key, without loading
+line items or serializing anything. A list page's ETag covers the ids and
+versions of the orders on the page.
+
+ETags also depend on the URL and the renderer, and are weak: the same data
+may be rendered, or compressed, to different bytes.
+"""
+import hashlib
+
+from django.utils.http import parse_etags
+
+
+def make_etag(request, *parts):
+    key = repr((request.get_full_path(), request.accepted_renderer.format, parts))
+    return 'W/"%s"' % hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def order_etag(request, key):
+    """ETag of an order given its key: (id, version) and its supplier's version if nested."""
+    return make_etag(request, *key)
+
+
+def page_etag(request, keys, has_next):
+    """ETag of a list page given the keys of its orders, see `order_etag`."""
+    return make_etag(request, tuple(keys), has_next)
+
+
+def if_none_match(request):
+    """The ETags of the If-None-Match header, or None when there is none."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    return parse_etags(header) if header else None
+
+
+def matches(etags, etag):
+    # If-None-Match uses the weak comparison
+    return '*' in etags or etag.removeprefix('W/') in {
+        tag.removeprefix('W/') for tag in etags}
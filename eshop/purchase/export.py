@@ -0,0 +1,82 @@
+"""
+Streaming export of orders with their line items and totals.
+
+Orders are read with a chunked `.iterator()` (line items are prefetched one
+chunk at a time) and written out as they come, so memory use does not grow
+with the size of the export.
+"""
+import csv
+
+from rest_framework.fields import DateTimeField
+from rest_framework.renderers import JSONRenderer
+
+from purchase import cache as supplier_cache
+from purchase.models import Order
+from purchase.serializers import OrderSerializer
+
+CHUNK_SIZE = 2000
+
+CSV_COLUMNS = [
+    'order_id', 'order_number', 'order_time',
+    'supplier_id', 'supplier_name', 'supplier_email',
+    'total_quantity', 'total_amount', 'total_tax',
+    'line_item_id', 'item_name', 'quantity', 'price_without_tax',
+    'tax_name', 'tax_amount', 'line_total',
+]
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_orders(queryset, chunk_size=CHUNK_SIZE):
+    return queryset.order_by(*Order._meta.ordering).iterator(chunk_size=chunk_size)
+
+
+def ndjson_lines(orders):
+    """One JSON document per order, as the API serializes it."""
+    renderer = JSONRenderer()
+    # taken before the first chunk of orders is read
+    context = {'supplier_generation': supplier_cache.generation()}
+    for order in orders:
+        yield renderer.render(OrderSerializer(order, context=context).data).decode() + '\n'
+
+
+def csv_lines(orders):
+    """One row per line item, repeating the order columns."""
+    writer = csv.writer(Echo())
+    order_time = DateTimeField()
+    yield writer.writerow(CSV_COLUMNS)
+    for order in orders:
+        order_columns = [
+            order.id, order.order_number, order_time.to_representation(order.order_time),
+            order.supplier_id, order.supplier.name, order.supplier.email,
+            order.total_quantity, order.total_amount, order.total_tax,
+        ]
+        line_items = order.line_items.all()
+        if not line_items:
+            yield writer.writerow(order_columns)
+        for line_item in line_items:
+            yield writer.writerow(order_columns + [
+                line_item.id, line_item.item_name, line_item.quantity,
+                line_item.price_without_tax, line_item.tax_name,
+                line_item.tax_amount, line_item.line_total,
+            ])
+
+
+EXPORT_FORMATS = {
+    'ndjson': ndjson_lines,
+    'csv': csv_lines,
+}
+
+
+def export_lines(queryset, export_format, chunk_size=CHUNK_SIZE):
+    return EXPORT_FORMATS[export_format](iter_orders(queryset, chunk_size))
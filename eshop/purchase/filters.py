@@ -1,15 +1,34 @@
 # filters.py
 
 import django_filters
-from purchase.models import Order
+from purchase.models import Order, SupplierDailyRollup
+from purchase import search
 
 
 class OrderFilter(django_filters.FilterSet):
-    supplier_name = django_filters.CharFilter(
-        field_name='supplier__name', lookup_expr='icontains')
-    item_name = django_filters.CharFilter(
-        field_name='line_items__item_name', lookup_expr='icontains')
+    # served from purchase_order_supplier_idx in list order
+    supplier = django_filters.NumberFilter(field_name='supplier_id')
+    supplier_name = django_filters.CharFilter(method='filter_supplier_name')
+    item_name = django_filters.CharFilter(method='filter_item_name')
+    # ?order_time_after=...&order_time_before=... (ISO 8601, both inclusive)
+    order_time = django_filters.IsoDateTimeFromToRangeFilter()
 
     class Meta:
         model = Order
-        fields = ['supplier_name', 'item_name']
+        fields = ['supplier', 'supplier_name', 'item_name', 'order_time']
+
+    def filter_supplier_name(self, queryset, name, value):
+        return search.filter_supplier_name(queryset, value)
+
+    def filter_item_name(self, queryset, name, value):
+        return search.filter_item_name(queryset, value)
+
+
+class SupplierDailyRollupFilter(django_filters.FilterSet):
+    supplier = django_filters.NumberFilter(field_name='supplier_id')
+    # ?day_after=...&day_before=... (YYYY-MM-DD, both inclusive)
+    day = django_filters.DateFromToRangeFilter()
+
+    class Meta:
+        model = SupplierDailyRollup
+        fields = ['supplier', 'day']
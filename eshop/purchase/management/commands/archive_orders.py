@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from purchase import archive
+
+
+class Command(BaseCommand):
+    help = ('Move the orders older than --older-than days, with their line items, into the '
+            'archive tables, see purchase/archive.py. Run it periodically, e.g. daily.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int,
+                            help="Age in days of the orders to archive, default: ARCHIVE['AGE_DAYS']")
+        parser.add_argument('--batch-size', type=int,
+                            help="Orders moved per transaction, default: ARCHIVE['BATCH_SIZE']")
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the orders that would be archived')
+
+    def handle(self, *args, **options):
+        if options['older_than'] is not None and options['older_than'] < 0:
+            raise CommandError('--older-than must not be negative')
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        day = archive.cutoff_day(options['older_than'])
+        if options['dry_run']:
+            count = archive.archivable(day).count()
+            self.stdout.write(f'{count} orders from before {day} would be archived')
+            return
+
+        progress = self.report if options['verbosity'] > 1 else None
+        orders, line_items = archive.archive_orders(
+            day, batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully archived {orders} orders and {line_items} line items from before {day}'))
+
+    def report(self, orders, line_items):
+        self.stdout.write(f'{orders} orders and {line_items} line items archived')
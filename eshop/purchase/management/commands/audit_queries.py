@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from purchase.datagen import DatasetGenerator, DatasetOptions
+from purchase.query_plans import AUDITED_REQUESTS, audit, audited_aliases
+
+
+class Command(BaseCommand):
+    help = ('Serve the list, detail and filter endpoints, show the SQLite query plan of every '
+            'query they run and flag full table scans and temporary B-tree sorts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help='Requests to audit, or prefixes such as "order." (default: all)')
+        parser.add_argument('--list', action='store_true', help='List the requests and exit')
+        parser.add_argument('--size', type=int,
+                            help='Audit a throwaway test database holding this many generated '
+                                 'orders instead of the configured database')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--sql', action='store_true', help='Also print each query')
+        parser.add_argument('--fail-on-flags', action='store_true',
+                            help='Fail if any query is flagged')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            self.stdout.write('\n'.join(AUDITED_REQUESTS))
+            return
+        if any(connections[alias].vendor != 'sqlite' for alias in audited_aliases()):
+            raise CommandError('audit_queries relies on SQLite\'s EXPLAIN QUERY PLAN')
+
+        names = [name for name in AUDITED_REQUESTS
+                 if not options['names'] or
+                 any(name.startswith(prefix) for prefix in options['names'])]
+        if not names:
+            raise CommandError(f"No request matches {' '.join(options['names'])}")
+        if options['size'] is not None and options['size'] < 1:
+            raise CommandError('--size must be at least 1')
+
+        if options['size']:
+            results = self.in_test_database(self.generate_and_audit, names, options)
+        else:
+            results = audit(names)
+
+        flagged = 0
+        for result in results:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{result['name']}  GET {result['url']}  ({result['status']})"))
+            for query in result['queries']:
+                if options['sql']:
+                    self.stdout.write(f"  {query['sql']}")
+                for line in query['plan']:
+                    self.stdout.write(f'    {line}')
+                for flag in query['flags']:
+                    self.stdout.write(self.style.WARNING(f'    ! {flag}'))
+                flagged += bool(query['flags'])
+
+        queries = sum(len(result['queries']) for result in results)
+        summary = f'{flagged} of {queries} queries flagged'
+        if flagged and options['fail_on_flags']:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary) if not flagged else self.style.WARNING(summary))
+
+    def generate_and_audit(self, names, options):
+        size = options['size']
+        DatasetGenerator(DatasetOptions(
+            suppliers=max(3, size // 20),
+            orders=size,
+            items_per_order=5,
+            items_distribution='poisson',
+            item_names=max(10, size // 4),
+            seed=options['seed'],
+        )).generate()
+        # the planner's statistics, as `PRAGMA optimize` leaves them in production
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return audit(names)
+
+    def in_test_database(self, function, *args, **kwargs):
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # the replica is not a copy of the throwaway database
+            with override_settings(REPLICA={'ENABLED': False}):
+                return function(*args, **kwargs)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
@@ -0,0 +1,124 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from purchase.benchmarks import BENCHMARKS, compare, load_test, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Time the order serializers, filters and views on generated datasets. '
+            'Runs against a throwaway test database, never the configured one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help='Benchmarks to run, or prefixes such as "view." (default: all)')
+        parser.add_argument('--list', action='store_true', help='List the benchmarks and exit')
+        parser.add_argument('--sizes', default='100,1000,10000',
+                            help='Comma separated dataset sizes, in orders')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed calls per benchmark')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Untimed calls before timing starts')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('-o', '--output', help='Save the results to this JSON file')
+        parser.add_argument('--baseline',
+                            help='Results JSON to compare against; regressions fail the command')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative slowdown or memory growth reported as a regression')
+        parser.add_argument('--load', action='store_true',
+                            help='Compare the sync and async order views under concurrent clients '
+                                 'instead, at the first of --sizes')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients (--load)')
+        parser.add_argument('--requests', type=int, default=256,
+                            help='Requests per view and mode (--load)')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Threads serving the sync views (--load)')
+        parser.add_argument('--db-latency', type=float, default=2.0,
+                            help='Milliseconds added to every query (--load)')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            self.stdout.write('\n'.join(BENCHMARKS))
+            return
+        if options['load']:
+            self.load(options)
+            return
+
+        names = [name for name in BENCHMARKS
+                 if not options['names'] or
+                 any(name.startswith(prefix) for prefix in options['names'])]
+        if not names:
+            raise CommandError(f"No benchmark matches {' '.join(options['names'])}")
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f"Invalid --sizes {options['sizes']!r}")
+        if min(sizes) < 1 or options['repeat'] < 1:
+            raise CommandError('--sizes and --repeat must be at least 1')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as source:
+                baseline = json.load(source)
+
+        self.stdout.write(f"{'benchmark':<30} {'size':>7} {'p50 ms':>9} {'p95 ms':>9} "
+                          f"{'queries':>7} {'peak KiB':>9} {'payload KiB':>11}")
+        results = self.run(names, sizes, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Results saved to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully ran {len(results["results"])} benchmarks'))
+
+    def run(self, names, sizes, options):
+        return self.in_test_database(
+            run_benchmarks, sizes, names, options['repeat'], options['warmup'],
+            options['seed'], progress=self.report)
+
+    def in_test_database(self, function, *args, **kwargs):
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def load(self, options):
+        if options['names'] or options['baseline']:
+            raise CommandError('--load runs its own views and has no baseline')
+        if min(options['concurrency'], options['requests'], options['threads']) < 1:
+            raise CommandError('--concurrency, --requests and --threads must be at least 1')
+        size = int(options['sizes'].split(',')[0])
+
+        self.stdout.write(f"{'benchmark':<20} {'mode':<6} {'size':>7} {'req/s':>9} "
+                          f"{'p50 ms':>9} {'p95 ms':>9}")
+        results = self.in_test_database(
+            load_test, size, options['concurrency'], options['requests'], options['threads'],
+            options['db_latency'] / 1000, options['seed'], progress=self.report_load)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Results saved to {options['output']}")
+        self.stdout.write(self.style.SUCCESS(f'Successfully ran {len(results["results"])} load tests'))
+
+    def report_load(self, result):
+        self.stdout.write(f"{result['name']:<20} {result['mode']:<6} {result['size']:>7} "
+                          f"{result['rps']:>9.1f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f}")
+
+    def report(self, result):
+        payload = f" {result['payload_kib']:>11.1f}" if 'payload_kib' in result else ''
+        self.stdout.write(f"{result['name']:<30} {result['size']:>7} {result['p50_ms']:>9.2f} "
+                          f"{result['p95_ms']:>9.2f} {result['queries']:>7} {result['peak_kib']:>9.1f}"
+                          + payload)
@@ -0,0 +1,50 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from purchase.filters import OrderFilter
+from purchase.models import Order
+from purchase import export
+
+
+class Command(BaseCommand):
+    help = 'Stream orders with their line items and totals as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', default='ndjson',
+                            choices=list(export.EXPORT_FORMATS))
+        parser.add_argument('--output', '-o',
+                            help='File to write to (default: standard output)')
+        parser.add_argument('--supplier-name', help='Same as OrderFilter supplier_name')
+        parser.add_argument('--item-name', help='Same as OrderFilter item_name')
+        parser.add_argument('--since', help='Only orders placed at or after this ISO 8601 time')
+        parser.add_argument('--until', help='Only orders placed at or before this ISO 8601 time')
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE,
+                            help='Orders fetched per query')
+
+    def handle(self, *args, **options):
+        params = {
+            'supplier_name': options['supplier_name'],
+            'item_name': options['item_name'],
+            'order_time_after': options['since'],
+            'order_time_before': options['until'],
+        }
+        filterset = OrderFilter(
+            {key: value for key, value in params.items() if value},
+            queryset=Order.objects.for_serialization())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        lines = export.export_lines(
+            filterset.qs, options['export_format'], options['chunk_size'])
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            count = 0
+            for line in lines:
+                output.write(line)
+                count += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        self.stderr.write(self.style.SUCCESS(f'Exported {count} lines'))
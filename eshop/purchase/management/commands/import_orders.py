@@ -0,0 +1,187 @@
+import csv
+import json
+import os
+import time
+from itertools import groupby
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import DateTimeField
+from purchase.serializers import OrderSerializer
+
+
+class Progress:
+    """
+    Byte offset of the first record not imported yet, saved next to the
+    input file after every committed batch so an import can be resumed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as state:
+                return json.load(state)
+        except FileNotFoundError:
+            return {'offset': 0, 'orders': 0, 'line_items': 0}
+
+    def save(self, state):
+        with open(self.path + '.tmp', 'w') as tmp:
+            json.dump(state, tmp)
+        os.replace(self.path + '.tmp', self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Command(BaseCommand):
+    help = ('Import orders from an NDJSON file (one order per line, as exported) '
+            'or a CSV file (one line item per row, as exported), in bulk batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON or CSV file to import')
+        parser.add_argument('--format', dest='import_format', choices=['ndjson', 'csv'],
+                            help='Input format (default: guessed from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Orders validated and committed together')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue after the last batch committed by a previous run')
+        parser.add_argument('--state-file',
+                            help='Where progress is tracked (default: <path>.progress)')
+        parser.add_argument('--stop-on-error', action='store_true',
+                            help='Abort on the first invalid record instead of skipping it')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['import_format'] or (
+            'csv' if path.lower().endswith('.csv') else 'ndjson')
+        progress = Progress(options['state_file'] or path + '.progress')
+        state = progress.load() if options['resume'] else {
+            'offset': 0, 'orders': 0, 'line_items': 0}
+        if state['offset']:
+            self.stdout.write(f"Resuming at byte {state['offset']}")
+
+        read_records = self.read_csv if import_format == 'csv' else self.read_ndjson
+        self.serializer = OrderSerializer()
+        self.order_time = DateTimeField()
+        # Suppliers seen so far, shared by every batch
+        context = {'supplier_map': {}}
+        started, imported, skipped = time.monotonic(), 0, 0
+
+        with open(path, 'rb') as source:
+            batch, end_offset = [], state['offset']
+            for record, offset, line_number in read_records(source, state['offset']):
+                validated = self.validate(record, line_number, options['stop_on_error'])
+                if validated is None:
+                    skipped += 1
+                else:
+                    batch.append(validated)
+                end_offset = offset
+
+                if len(batch) >= options['batch_size']:
+                    imported += self.commit(batch, context, state, end_offset, progress)
+                    batch = []
+                    self.report(state, imported, started)
+
+            if batch or end_offset != state['offset']:
+                imported += self.commit(batch, context, state, end_offset, progress)
+                self.report(state, imported, started)
+
+        progress.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully imported {state['orders']} orders "
+            f"({state['line_items']} line items), skipped {skipped} invalid records"))
+
+    def read_ndjson(self, source, offset):
+        source.seek(offset)
+        line_number = 0
+        for line in source:
+            offset += len(line)
+            line_number += 1
+            if line.strip():
+                try:
+                    yield json.loads(line), offset, line_number
+                except ValueError as error:
+                    yield error, offset, line_number
+
+    def read_csv(self, source, offset):
+        header = source.readline()
+        offset = max(offset, len(header))
+        source.seek(offset)
+
+        position = {'offset': offset, 'line': 0}
+
+        def lines():
+            for line in source:
+                position['offset'] += len(line)
+                position['line'] += 1
+                yield line.decode()
+
+        rows = csv.DictReader(lines(), fieldnames=next(csv.reader([header.decode()])))
+        # csv reads one record at a time, so position is the end of the current row
+        rows = ((row, position['offset'], position['line']) for row in rows)
+
+        # Rows of the same order are consecutive; rows without an order_id
+        # are orders of their own
+        for _, order_rows in groupby(rows, key=lambda item: item[0].get('order_id') or id(item)):
+            order_rows = list(order_rows)
+            first = order_rows[0][0]
+            yield {
+                'order_time': first.get('order_time'),
+                'supplier': {
+                    'id': int(first['supplier_id']) if first.get('supplier_id') else None,
+                    'name': first['supplier_name'],
+                    'email': first['supplier_email'],
+                },
+                'line_items': [
+                    {field: row[field] for field in (
+                        'item_name', 'quantity', 'price_without_tax', 'tax_name', 'tax_amount')}
+                    for row, _, _ in order_rows if row.get('item_name')
+                ],
+            }, order_rows[-1][1], order_rows[-1][2]
+
+    def validate(self, record, line_number, stop_on_error):
+        if isinstance(record, Exception):
+            errors = str(record)
+        elif not isinstance(record, dict):
+            errors = 'Expected an order object.'
+        else:
+            # Line items are always created, ids from another database are meaningless
+            for line_item in record.get('line_items') or []:
+                if isinstance(line_item, dict):
+                    line_item.pop('id', None)
+
+            try:
+                # One serializer for every record, as ListSerializer does, so
+                # the fields are only built once
+                validated = self.serializer.run_validation(record)
+                # Keep the original order_time of the imported orders
+                if record.get('order_time'):
+                    validated['order_time'] = self.order_time.to_internal_value(
+                        record['order_time'])
+                return validated
+            except ValidationError as error:
+                errors = error.detail
+
+        message = f'Record {line_number}: {errors}'
+        if stop_on_error:
+            raise CommandError(message)
+        self.stderr.write(self.style.WARNING(message))
+        return None
+
+    def commit(self, batch, context, state, end_offset, progress):
+        if batch:
+            OrderSerializer(many=True, context=context).create(batch)
+        state['offset'] = end_offset
+        state['orders'] += len(batch)
+        state['line_items'] += sum(len(order['line_items']) for order in batch)
+        progress.save(state)
+        return len(batch)
+
+    def report(self, state, imported, started):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(
+            f"{state['orders']} orders ({state['line_items']} line items) imported, "
+            f"{imported / elapsed:.0f} orders/s")
@@ -1,41 +1,63 @@
-from django.core.management.base import BaseCommand
-from purchase.models import Supplier, Order, LineItem, OrderNumber
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from purchase.datagen import DISTRIBUTIONS, DatasetGenerator, DatasetOptions
 
 
 class Command(BaseCommand):
-    help = 'Populate the database with sample data'
-
-    def handle(self, *args, **kwargs):
-        # Sample supplier data
-        suppliers_data = [
-            {"name": "Supplier 1", "email": "supplier1@email.com"},
-            {"name": "Supplier 2", "email": "supplier2@email.com"},
-            {"name": "Supplier 3", "email": "supplier3@email.com"},
-            # Add more suppliers as needed
-        ]
-
-        # Create Supplier instances
-        for supplier_data in suppliers_data:
-            supplier = Supplier.objects.create(**supplier_data)
-
-            order_data = {
-                "supplier": supplier,
-            }
-
-            # Create Order instance
-            order = Order.objects.create(**order_data)
-
-            # Sample line item data
-            line_item_data = {
-                "item_name": "Item 1",
-                "quantity": 5,
-                "price_without_tax": 20.0,
-                "tax_name": 1,
-                "tax_amount": 2.0,
-                "purchase_order": order,
-            }
-
-            # Create LineItem instance
-            line_item = LineItem.objects.create(**line_item_data)
-
-        self.stdout.write(self.style.SUCCESS('Successfully added sample data'))
+    help = ('Populate the database with deterministic sample data; the same '
+            'options and seed always produce the same dataset')
+
+    def add_arguments(self, parser):
+        defaults = DatasetOptions()
+        parser.add_argument('--suppliers', type=int, default=defaults.suppliers)
+        parser.add_argument('--orders', type=int, default=defaults.orders)
+        parser.add_argument('--items-per-order', type=float, default=defaults.items_per_order,
+                            help='Mean number of line items per order')
+        parser.add_argument('--items-distribution', choices=DISTRIBUTIONS,
+                            default=defaults.items_distribution,
+                            help='How the number of line items per order varies around the mean')
+        parser.add_argument('--item-names', type=int, default=defaults.item_names,
+                            help='Number of distinct item names')
+        parser.add_argument('--days', type=int, default=defaults.days,
+                            help='Order times are spread over this many days before --end')
+        parser.add_argument('--end', type=datetime.fromisoformat, default=defaults.end,
+                            help='Latest order time, as an ISO 8601 date (default: %(default)s)')
+        parser.add_argument('--supplier-skew', type=float, default=defaults.supplier_skew,
+                            help='Zipf exponent of orders per supplier, 0 for an even spread')
+        parser.add_argument('--seed', type=int, default=defaults.seed)
+        parser.add_argument('--batch-size', type=int, default=defaults.batch_size,
+                            help='Orders written per transaction')
+
+    def handle(self, *args, **options):
+        if min(options['suppliers'], options['item_names'], options['batch_size']) < 1:
+            raise CommandError('--suppliers, --item-names and --batch-size must be at least 1')
+        end = options['end']
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+
+        generator = DatasetGenerator(DatasetOptions(
+            suppliers=options['suppliers'],
+            orders=options['orders'],
+            items_per_order=options['items_per_order'],
+            items_distribution=options['items_distribution'],
+            item_names=options['item_names'],
+            days=options['days'],
+            end=end,
+            supplier_skew=options['supplier_skew'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+        ))
+        started = time.monotonic()
+
+        def progress(orders, line_items):
+            if options['verbosity'] > 1 or options['orders'] > options['batch_size']:
+                elapsed = max(time.monotonic() - started, 1e-9)
+                self.stdout.write(f'{orders} orders ({line_items} line items), '
+                                  f'{line_items / elapsed:.0f} line items/s')
+
+        orders, line_items = generator.generate(progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully added {options['suppliers']} suppliers, {orders} orders "
+            f"and {line_items} line items in {time.monotonic() - started:.1f}s"))
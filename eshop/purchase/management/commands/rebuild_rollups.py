@@ -0,0 +1,31 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from purchase import reporting
+
+
+class Command(BaseCommand):
+    help = ('Recompute the supplier daily reporting rollups from the orders and line items. '
+            'Run it after migrating, to backfill, or after writing orders outside of the ORM.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD), default: all')
+        parser.add_argument('--until', help='Last day to rebuild (YYYY-MM-DD), default: all')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rollup rows inserted per query')
+
+    def handle(self, *args, **options):
+        since, until = self.parse_day(options['since']), self.parse_day(options['until'])
+        if since and until and since > until:
+            raise CommandError('--since must not be after --until')
+
+        written = reporting.rebuild(since, until, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {written} rollup rows'))
+
+    def parse_day(self, value):
+        if value is None:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Invalid date: {value}')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from purchase import search
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the order search index (SQLite FTS5 shadow tables and their triggers). '
+            'Run it after restoring data outside of the ORM or after a migration that '
+            'rebuilt the purchase_supplier or purchase_lineitem tables.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to rebuild the index on')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        search.drop_index(connection)
+        if not search.create_index(connection):
+            self.stdout.write(self.style.WARNING(
+                'This database does not support FTS5 trigram indexes, '
+                'searches fall back to icontains'))
+            return
+
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt the search index'))
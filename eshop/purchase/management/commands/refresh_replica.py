@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from purchase import routers
+
+
+class Command(BaseCommand):
+    help = ('Copy the default SQLite database into the read replica file with the online backup '
+            'API. Keep it running with --interval while REPLICA["ENABLED"] is on.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Refresh every INTERVAL seconds until interrupted '
+                                 '(default: refresh once)')
+
+    def handle(self, *args, **options):
+        alias = routers.get_setting('ALIAS', 'replica')
+        if alias not in connections:
+            raise CommandError(f'No {alias!r} database is configured')
+        source, target = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+            raise CommandError('Only SQLite replicas can be refreshed')
+        if (target.is_in_memory_db() or
+                str(source.settings_dict['NAME']) == str(target.settings_dict['NAME'])):
+            raise CommandError(f'The {alias!r} database must be a file of its own')
+        if options['interval'] is not None and options['interval'] <= 0:
+            raise CommandError('--interval must be positive')
+
+        while True:
+            start = time.perf_counter()
+            pages = routers.refresh(source, target)
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully refreshed {target.settings_dict["NAME"]} '
+                f'({pages} pages in {(time.perf_counter() - start) * 1000:.0f} ms)'))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,182 @@
+"""
+Per-view request metrics, exported in the Prometheus text format.
+
+Each process records into its own in-memory `Registry` and writes it to
+`<directory>/<pid>.json` at most once per flush interval. The `/metrics`
+view adds up the files of every worker, so the numbers cover all the
+processes serving the site, including ones that have since exited.
+
+The scrape endpoint is only served to the networks of ALLOWED_IPS, or to
+requests sending `Authorization: Bearer <TOKEN>`; others get a 403.
+
+Settings, all optional:
+
+    METRICS = {
+        'DIRECTORY': '/var/run/eshop-metrics',  # shared by the workers
+        'FLUSH_INTERVAL': 1,                    # seconds
+        'ALLOWED_IPS': ['127.0.0.1', '::1'],    # addresses or networks
+        'TOKEN': None,
+    }
+"""
+import glob
+import hmac
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+LABELS = ('view', 'method', 'status')
+
+# name -> (help, bucket upper bounds)
+HISTOGRAMS = {
+    'eshop_http_request_duration_seconds': (
+        'Time to serve a request, including streaming the body.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'eshop_http_response_size_bytes': (
+        'Size of the response body.',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+    'eshop_sql_queries_per_request': (
+        'SQL queries run to serve a request.',
+        (0, 1, 2, 5, 10, 20, 50, 100, 500)),
+}
+
+# name -> help
+COUNTERS = {
+    'eshop_sql_queries_total': 'SQL queries run while serving requests.',
+    'eshop_sql_duration_seconds_total': 'Time spent running SQL queries.',
+}
+
+
+def get_setting(name, default):
+    return getattr(settings, 'METRICS', {}).get(name, default)
+
+
+def metrics_directory():
+    return get_setting('DIRECTORY', os.path.join(tempfile.gettempdir(), 'eshop-metrics'))
+
+
+def allows_scrape(request):
+    """Whether `request` comes from ALLOWED_IPS or carries the TOKEN."""
+    token = get_setting('TOKEN', None)
+    if token and hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                     f'Bearer {token}'.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in get_setting('ALLOWED_IPS', ['127.0.0.1', '::1']))
+
+
+class Registry:
+    """Counters and histograms of one process, keyed by metric name and label values."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.counters = defaultdict(float)
+        # (name, labels) -> [count per bucket, then +Inf], sum
+        self.histograms = {}
+        self.flushed = 0
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [[0] * (len(HISTOGRAMS[name][1]) + 1), 0]
+        histogram[0][bisect_left(HISTOGRAMS[name][1], value)] += 1
+        histogram[1] += value
+
+    def record(self, labels, duration, size, queries, sql_duration):
+        with self.lock:
+            # a forked worker starts from zero instead of double counting its parent
+            if self.pid != os.getpid():
+                self.reset()
+            self.observe('eshop_http_request_duration_seconds', labels, duration)
+            self.observe('eshop_http_response_size_bytes', labels, size)
+            self.observe('eshop_sql_queries_per_request', labels, queries)
+            self.counters[('eshop_sql_queries_total', labels)] += queries
+            self.counters[('eshop_sql_duration_seconds_total', labels)] += sql_duration
+
+        if time.monotonic() - self.flushed >= get_setting('FLUSH_INTERVAL', 1):
+            self.flush()
+
+    def dump(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value]
+                             for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, buckets, total]
+                               for (name, labels), (buckets, total) in self.histograms.items()],
+            }
+
+    def flush(self):
+        self.flushed = time.monotonic()
+        directory = metrics_directory()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        with open(f'{path}.{threading.get_ident()}.tmp', 'w') as tmp:
+            json.dump(self.dump(), tmp)
+        os.replace(tmp.name, path)
+
+
+registry = Registry()
+
+
+def collect():
+    """Sum the metrics written by every process, this one included."""
+    registry.flush()
+    counters, histograms = defaultdict(float), {}
+    for path in glob.glob(os.path.join(metrics_directory(), '*.json')):
+        try:
+            with open(path) as source:
+                data = json.load(source)
+        except (OSError, ValueError):
+            # removed or being replaced by its worker
+            continue
+        for name, labels, value in data['counters']:
+            counters[name, tuple(labels)] += value
+        for name, labels, buckets, total in data['histograms']:
+            merged = histograms.setdefault((name, tuple(labels)), [[0] * len(buckets), 0])
+            merged[0] = [count + other for count, other in zip(merged[0], buckets)]
+            merged[1] += total
+    return counters, histograms
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labels, **extra):
+    pairs = list(zip(LABELS, labels)) + list(extra.items())
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def render(counters, histograms):
+    lines = []
+    for name, (help_text, bounds) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (metric, labels), (buckets, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip([*bounds, '+Inf'], buckets):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines += [f'{name}{format_labels(labels)} {value}'
+                  for (metric, labels), value in sorted(counters.items()) if metric == name]
+    return '\n'.join(lines) + '\n'
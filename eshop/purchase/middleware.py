@@ -0,0 +1,211 @@
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+
+from purchase import compression, routers
+from purchase.metrics import registry
+
+# QueryCounter of the request being served. A context variable rather than
+# per-connection state: async views query from other threads, which have
+# their own connections but inherit the request's context.
+current_counter = ContextVar('current_counter', default=None)
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries run and the time spent in them."""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.duration += time.perf_counter() - start
+
+
+def count_queries(execute, sql, params, many, context):
+    counter = current_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def install(connection):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+@receiver(connection_created)
+def install_on_new_connection(sender, connection, **kwargs):
+    install(connection)
+
+
+class MetricsMiddleware:
+    """
+    Record the latency, response size and SQL queries of every request,
+    labelled with the resolved URL name, method and status code.
+    Exported by the /metrics view, see purchase/metrics.py.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        counter = QueryCounter()
+        # connections opened before this module was imported
+        for connection in connections.all():
+            install(connection)
+        token = current_counter.set(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        return self.record(request, response, start, counter)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        counter = QueryCounter()
+        token = current_counter.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_counter.reset(token)
+        return self.record(request, response, start, counter)
+
+    def record(self, request, response, start, counter):
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        if view == 'metrics':
+            return response
+        labels = (view, request.method, str(response.status_code))
+
+        if response.streaming:
+            # the body, and the queries behind it, are produced after we return
+            stream = self.astream if response.is_async else self.stream
+            response.streaming_content = stream(
+                response.streaming_content, labels, start, counter)
+        else:
+            registry.record(labels, time.perf_counter() - start, len(response.content),
+                            counter.queries, counter.duration)
+        return response
+
+    def stream(self, content, labels, start, counter):
+        size = 0
+        current_counter.set(counter)
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            current_counter.set(None)
+            registry.record(labels, time.perf_counter() - start, size,
+                            counter.queries, counter.duration)
+
+    async def astream(self, content, labels, start, counter):
+        size = 0
+        current_counter.set(counter)
+        try:
+            async for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            current_counter.set(None)
+            registry.record(labels, time.perf_counter() - start, size,
+                            counter.queries, counter.duration)
+
+
+class ReplicaMiddleware:
+    """Route the reads of safe requests to the read replica, see purchase/routers.py."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state, token = routers.start_request(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            routers.current_state.reset(token)
+            raise
+        return routers.finish_request(request, response, state, token)
+
+    async def __acall__(self, request):
+        state, token = routers.start_request(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            routers.current_state.reset(token)
+            raise
+        return routers.finish_request(request, response, state, token)
+
+
+class CompressionMiddleware:
+    """Compress responses with the best codec the client accepts, see purchase/compression.py."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if not compression.compressible(response):
+            return response
+        if not response.streaming and len(response.content) < compression.get_setting('MIN_SIZE', 1024):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        codec = compression.choose_codec(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if codec is None:
+            return response
+
+        if response.streaming:
+            stream = compression.acompress_stream if response.is_async else compression.compress_stream
+            response.streaming_content = stream(codec, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            if response.has_header('ETag') or getattr(response, 'cache_compressed', False):
+                response.content = compression.compress_cached(codec, response.content)
+            else:
+                response.content = compression.compress(codec, response.content)
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # the compressed bytes differ from those a strong ETag was computed on
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = codec
+        return response
@@ -0,0 +1,37 @@
+# Generated by Django 5.0 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='lineitem',
+            options={'ordering': ['item_name', 'quantity', 'id'], 'verbose_name': 'Line Item', 'verbose_name_plural': 'Line Items'},
+        ),
+        migrations.AlterModelOptions(
+            name='order',
+            options={'ordering': ['-order_time', 'id'], 'verbose_name': 'Order', 'verbose_name_plural': 'Orders'},
+        ),
+        migrations.AlterModelOptions(
+            name='supplier',
+            options={'ordering': ['name', 'id'], 'verbose_name': 'Supplier', 'verbose_name_plural': 'Suppliers'},
+        ),
+        migrations.AddIndex(
+            model_name='lineitem',
+            index=models.Index(fields=['item_name', 'quantity', 'id'], name='purchase_lineitem_name_qty_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-order_time', 'id'], name='purchase_order_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplier',
+            index=models.Index(fields=['name', 'id'], name='purchase_supplier_name_id_idx'),
+        ),
+    ]
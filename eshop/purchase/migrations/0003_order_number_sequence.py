@@ -0,0 +1,81 @@
+# Generated by Django 5.0 on 2026-10-18 19:20
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def copy_order_numbers(apps, schema_editor):
+    Order = apps.get_model('purchase', 'Order')
+    OrderNumber = apps.get_model('purchase', 'OrderNumber')
+    OrderNumberSequence = apps.get_model('purchase', 'OrderNumberSequence')
+    db_alias = schema_editor.connection.alias
+
+    orders = list(Order.objects.using(db_alias).only('id', 'order_number_id'))
+    for order in orders:
+        order.number = order.order_number_id
+    Order.objects.using(db_alias).bulk_update(orders, ['number'], batch_size=1000)
+
+    # Numbers handed out from now on start after every legacy OrderNumber id
+    last_value = OrderNumber.objects.using(db_alias).aggregate(
+        Max('id'))['id__max'] or 0
+    OrderNumberSequence.objects.using(db_alias).create(
+        name='order_number', last_value=last_value)
+
+
+def restore_order_numbers(apps, schema_editor):
+    Order = apps.get_model('purchase', 'Order')
+    OrderNumber = apps.get_model('purchase', 'OrderNumber')
+    db_alias = schema_editor.connection.alias
+
+    orders = list(Order.objects.using(db_alias).only('id', 'number'))
+    OrderNumber.objects.using(db_alias).bulk_create(
+        [OrderNumber(id=order.number) for order in orders], batch_size=1000)
+    for order in orders:
+        order.order_number_id = order.number
+    Order.objects.using(db_alias).bulk_update(orders, ['order_number'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0002_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='number',
+            field=models.BigIntegerField(null=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_number',
+            field=models.OneToOneField(editable=False, null=True, on_delete=models.deletion.CASCADE, to='purchase.ordernumber'),
+        ),
+        migrations.RunPython(copy_order_numbers, restore_order_numbers),
+        migrations.RemoveField(
+            model_name='order',
+            name='order_number',
+        ),
+        migrations.RenameField(
+            model_name='order',
+            old_name='number',
+            new_name='order_number',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_number',
+            field=models.BigIntegerField(editable=False, unique=True),
+        ),
+        migrations.DeleteModel(
+            name='OrderNumber',
+        ),
+    ]
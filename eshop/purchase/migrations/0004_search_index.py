@@ -0,0 +1,24 @@
+# Generated by Django 5.0 on 2026-10-18 19:30
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from purchase.search import create_index
+    create_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    from purchase.search import drop_index
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0003_order_number_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
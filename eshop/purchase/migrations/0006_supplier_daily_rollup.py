@@ -0,0 +1,55 @@
+# Generated by Django 5.0 on 2026-10-18 19:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill(apps, schema_editor):
+    # Same rows as purchase.reporting.rebuild(), with the historical models
+    Order = apps.get_model('purchase', 'Order')
+    SupplierDailyRollup = apps.get_model('purchase', 'SupplierDailyRollup')
+    rows = (Order.objects.using(schema_editor.connection.alias).order_by()
+            .annotate(day=TruncDate('order_time'))
+            .values('supplier_id', 'day')
+            .annotate(order_count=Count('id', distinct=True),
+                      total_quantity=Sum('line_items__quantity', default=0),
+                      total_amount=Sum(F('line_items__tax_amount')
+                                       + F('line_items__price_without_tax'), default=0.0),
+                      total_tax=Sum('line_items__tax_amount', default=0.0)))
+    SupplierDailyRollup.objects.using(schema_editor.connection.alias).bulk_create(
+        [SupplierDailyRollup(**row) for row in rows.iterator()], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0005_order_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupplierDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('total_quantity', models.BigIntegerField(default=0)),
+                ('total_amount', models.FloatField(default=0)),
+                ('total_tax', models.FloatField(default=0)),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='purchase.supplier')),
+            ],
+            options={
+                'verbose_name': 'Supplier Daily Rollup',
+                'verbose_name_plural': 'Supplier Daily Rollups',
+                'ordering': ['day', 'supplier'],
+                'indexes': [models.Index(fields=['day', 'supplier'], name='purchase_rollup_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='supplierdailyrollup',
+            constraint=models.UniqueConstraint(fields=('supplier', 'day'), name='purchase_rollup_supplier_day_uniq'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0006_supplier_daily_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lineitem',
+            index=models.Index(fields=['purchase_order', 'item_name', 'quantity', 'id'], name='purchase_lineitem_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['supplier', '-order_time', 'id'], name='purchase_order_supplier_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.0 on 2026-10-18 20:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0007_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_time', models.DateTimeField()),
+                ('order_number', models.BigIntegerField(unique=True)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to='purchase.supplier')),
+            ],
+            options={
+                'verbose_name': 'Archived Order',
+                'verbose_name_plural': 'Archived Orders',
+                'ordering': ['-order_time', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedLineItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('item_name', models.CharField(max_length=1024)),
+                ('quantity', models.IntegerField()),
+                ('price_without_tax', models.FloatField()),
+                ('tax_name', models.CharField(max_length=1024)),
+                ('tax_amount', models.FloatField()),
+                ('purchase_order', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='purchase.archivedorder')),
+            ],
+            options={
+                'verbose_name': 'Archived Line Item',
+                'verbose_name_plural': 'Archived Line Items',
+                'ordering': ['item_name', 'quantity', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['-order_time', 'id'], name='purchase_archived_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['supplier', '-order_time', 'id'], name='purchase_archived_supplier_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedlineitem',
+            index=models.Index(fields=['purchase_order', 'item_name', 'quantity', 'id'], name='purchase_archived_item_idx'),
+        ),
+    ]
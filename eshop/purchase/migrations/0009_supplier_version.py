@@ -0,0 +1,25 @@
+# Generated by Django 5.0 on 2026-10-18 21:06
+
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    # SQLite adds the column by rebuilding the table, which drops its triggers
+    from purchase.search import create_index
+    create_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0008_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supplier',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(create_search_index, migrations.RunPython.noop),
+    ]
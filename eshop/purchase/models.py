@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 
@@ -6,58 +8,195 @@ from django.utils import timezone
 class Supplier(models.Model):
     name = models.CharField(max_length=1024)
     email = models.EmailField()
+    # Incremented whenever the supplier changes: part of the ETag of its
+    # orders, which nest it, see purchase/etags.py
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def has_changed(self):
+        """Whether the fields differ from the database row, as far as we know."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or self._state.adding:
+            return True
+        return any(getattr(self, field.attname) != loaded[field.attname]
+                   for field in self._meta.concrete_fields if field.attname in loaded)
+
+    def save(self, *args, **kwargs):
+        changed = not self._state.adding and self.has_changed()
+        if changed:
+            # Incremented in the database, so concurrent saves both count
+            self.version = F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+        if changed:
+            # Reloaded from the database on next access
+            del self.version
+        self._loaded_values = {field.attname: self.__dict__[field.attname]
+                               for field in self._meta.concrete_fields
+                               if field.attname in self.__dict__}
 
     class Meta:
         verbose_name = "Supplier"
         verbose_name_plural = "Suppliers"
-        ordering = ['name']
+        ordering = ['name', 'id']
+        indexes = [
+            models.Index(fields=['name', 'id'], name='purchase_supplier_name_id_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.name
 
 
-class OrderNumber(models.Model):
-    pass
+class OrderNumberSequence(models.Model):
+    """
+    Highest order number reserved so far, see `purchase.order_numbers`.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.last_value}"
+
+
+class OrderQuerySet(models.QuerySet):
+    # annotation name -> expression summed over the order's line items
+    TOTALS = {
+        '_total_quantity': (F('quantity'), models.IntegerField()),
+        '_total_amount': (F('tax_amount') + F('price_without_tax'), models.FloatField()),
+        '_total_tax': (F('tax_amount'), models.FloatField()),
+    }
+
+    def with_totals(self, *names):
+        """
+        Annotate each order with its line item totals, computed in the database:
+        all of them, or only the annotations in `names`.
+
+        Correlated subqueries are used instead of a join so the sums are not
+        affected by filters that join `line_items` (e.g. OrderFilter.item_name).
+        """
+        annotations = {}
+        for name, (expression, output_field) in self.TOTALS.items():
+            if names and name not in names:
+                continue
+            total = (self.line_item_model().objects
+                     .filter(purchase_order=OuterRef('pk'))
+                     .order_by()
+                     .values('purchase_order')
+                     .annotate(total=Sum(expression, output_field=output_field))
+                     .values('total'))
+            annotations[name] = Coalesce(
+                Subquery(total, output_field=output_field), Value(0),
+                output_field=output_field)
+        return self.annotate(**annotations)
+
+    def line_item_model(self):
+        """LineItem, or ArchivedLineItem for archived orders."""
+        return self.model._meta.get_field('line_items').related_model
+
+    def bump_version(self):
+        """Mark the orders as changed, see `Order.version`."""
+        return self.update(version=F('version') + 1)
+
+    def for_serialization(self):
+        """Everything OrderSerializer reads, in a constant number of queries."""
+        return (self.with_totals()
+                .select_related('supplier')
+                .prefetch_related(models.Prefetch(
+                    'line_items',
+                    queryset=self.line_item_model().objects.order_by(*LineItem.ORDER_ORDERING))))
 
 
 class Order(models.Model):
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE)
     order_time = models.DateTimeField(editable=False)
-    order_number = models.OneToOneField(
-        OrderNumber, on_delete=models.CASCADE, editable=False)
+    order_number = models.BigIntegerField(unique=True, editable=False)
+    # Incremented whenever the order or its line items change, and served,
+    # with its supplier's version, as the order's ETag
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The reporting rollup cell the order was in, see purchase.reporting
+        instance._loaded_supplier_id = instance.__dict__.get('supplier_id')
+        instance._loaded_order_time = instance.__dict__.get('order_time')
+        return instance
 
     def save(self, *args, **kwargs):
+        from purchase.order_numbers import allocate_order_numbers
+
         # Check if the order_number is not set
-        if not hasattr(self, 'order_number'):
-            # Create a new OrderNumber instance
-            order_number_instance = OrderNumber.objects.create()
-            self.order_number = order_number_instance
+        if self.order_number is None:
+            # Take the next number from the allocator's reserved block
+            self.order_number = allocate_order_numbers()[0]
             self.order_time = timezone.now()
 
+        adding = self._state.adding
+        if not adding:
+            # Incremented in the database, so concurrent saves both count
+            self.version = F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+
         super().save(*args, **kwargs)
 
+        if not adding:
+            # Reloaded from the database on next access
+            del self.version
+        self._loaded_supplier_id = self.supplier_id
+        self._loaded_order_time = self.order_time
+
+    def clear_totals(self):
+        """Drop totals annotated by `with_totals()`, e.g. after line items changed."""
+        for name in OrderQuerySet.TOTALS:
+            self.__dict__.pop(name, None)
+
     @property
     def total_quantity(self) -> float:
+        if '_total_quantity' in self.__dict__:
+            return self._total_quantity
         return sum(item.quantity for item in self.line_items.all())
 
     @property
     def total_amount(self) -> float:
+        if '_total_amount' in self.__dict__:
+            return self._total_amount
         return sum(item.line_total for item in self.line_items.all())
 
     @property
     def total_tax(self) -> float:
+        if '_total_tax' in self.__dict__:
+            return self._total_tax
         return sum(item.tax_amount for item in self.line_items.all())
 
     class Meta:
         verbose_name = "Order"
         verbose_name_plural = "Orders"
-        ordering = ['-order_time']
+        ordering = ['-order_time', 'id']
+        indexes = [
+            models.Index(fields=['-order_time', 'id'], name='purchase_order_time_id_idx'),
+            # orders of a supplier in list order, e.g. ?supplier_name=
+            models.Index(fields=['supplier', '-order_time', 'id'],
+                         name='purchase_order_supplier_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"Order {self.order_number} - {self.order_time}"
 
 
 class LineItem(models.Model):
+    # The line items of several orders, each order's in `ordering`: read in
+    # this order from purchase_lineitem_order_idx instead of being sorted
+    ORDER_ORDERING = ['purchase_order_id', 'item_name', 'quantity', 'id']
+
     item_name = models.CharField(max_length=1024)
     quantity = models.IntegerField(validators=[MinValueValidator(0)])
     price_without_tax = models.FloatField(validators=[MinValueValidator(0.0)])
@@ -66,6 +205,52 @@ class LineItem(models.Model):
     purchase_order = models.ForeignKey(
         Order, on_delete=models.CASCADE, related_name='line_items')
 
+    # What the reporting rollups of the line item's order count, see purchase.reporting
+    REPORTED_FIELDS = ('purchase_order_id', 'quantity', 'price_without_tax', 'tax_amount')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in instance.__dict__ for name in cls.REPORTED_FIELDS):
+            instance._loaded_state = instance.reported_state()
+        return instance
+
+    def reported_state(self):
+        return tuple(getattr(self, name) for name in self.REPORTED_FIELDS)
+
+    def loaded_state(self):
+        """`reported_state()` as in the database, or None for a new line item."""
+        if self._state.adding:
+            return None
+        state = getattr(self, '_loaded_state', None)
+        if state is None:
+            state = LineItem.objects.filter(pk=self.pk).values_list(*self.REPORTED_FIELDS).first()
+        return state
+
+    def save(self, *args, **kwargs):
+        from purchase import reporting
+
+        before = self.loaded_state()
+        super().save(*args, **kwargs)
+        after = self.reported_state()
+        # A line item moved to another order changes both orders
+        order_ids = {after[0], before[0] if before else None} - {None}
+        Order.objects.filter(id__in=order_ids).bump_version()
+        reporting.line_items_changed([before] if before else [], [after])
+        self._loaded_state = after
+
+    def delete(self, *args, **kwargs):
+        from purchase import reporting
+
+        order_id = self.purchase_order_id
+        before = self.loaded_state()
+        result = super().delete(*args, **kwargs)
+        Order.objects.filter(id=order_id).bump_version()
+        # Not a pre_delete receiver: it would keep the line items of deleted
+        # orders from being deleted in bulk
+        reporting.line_items_changed([before] if before else [], [])
+        return result
+
     @property
     def line_total(self) -> float:
         return self.tax_amount + self.price_without_tax
@@ -73,7 +258,98 @@ class LineItem(models.Model):
     class Meta:
         verbose_name = "Line Item"
         verbose_name_plural = "Line Items"
-        ordering = ['item_name', 'quantity']
+        ordering = ['item_name', 'quantity', 'id']
+        indexes = [
+            models.Index(fields=['item_name', 'quantity', 'id'],
+                         name='purchase_lineitem_name_qty_idx'),
+            # line items of orders in list order, see `for_serialization()`
+            models.Index(fields=['purchase_order', 'item_name', 'quantity', 'id'],
+                         name='purchase_lineitem_order_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.item_name} - {self.quantity} units"
+
+
+class SupplierDailyRollup(models.Model):
+    """
+    Orders of a supplier on one day (in TIME_ZONE) and their line item
+    totals, maintained by `purchase.reporting`.
+    """
+    supplier = models.ForeignKey(
+        Supplier, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    order_count = models.PositiveIntegerField(default=0)
+    total_quantity = models.BigIntegerField(default=0)
+    total_amount = models.FloatField(default=0)
+    total_tax = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = "Supplier Daily Rollup"
+        verbose_name_plural = "Supplier Daily Rollups"
+        ordering = ['day', 'supplier']
+        constraints = [
+            models.UniqueConstraint(fields=['supplier', 'day'],
+                                    name='purchase_rollup_supplier_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'supplier'], name='purchase_rollup_day_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.supplier_id} - {self.day}: {self.order_count} orders"
+
+
+class ArchivedOrder(models.Model):
+    """
+    An order moved out of `Order` by `purchase.archive`, with the same id,
+    order number, time and version. Archived orders are read-only.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='archived_orders')
+    order_time = models.DateTimeField()
+    order_number = models.BigIntegerField(unique=True)
+    version = models.PositiveIntegerField(default=1)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Archived Order"
+        verbose_name_plural = "Archived Orders"
+        ordering = ['-order_time', 'id']
+        indexes = [
+            models.Index(fields=['-order_time', 'id'], name='purchase_archived_time_id_idx'),
+            models.Index(fields=['supplier', '-order_time', 'id'],
+                         name='purchase_archived_supplier_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"Archived order {self.order_number} - {self.order_time}"
+
+
+class ArchivedLineItem(models.Model):
+    """A line item of an `ArchivedOrder`, with the same id."""
+    ORDER_ORDERING = LineItem.ORDER_ORDERING
+
+    id = models.BigIntegerField(primary_key=True)
+    item_name = models.CharField(max_length=1024)
+    quantity = models.IntegerField()
+    price_without_tax = models.FloatField()
+    tax_name = models.CharField(max_length=1024)
+    tax_amount = models.FloatField()
+    # purchase_archived_item_idx serves the foreign key lookups
+    purchase_order = models.ForeignKey(
+        ArchivedOrder, on_delete=models.CASCADE, related_name='line_items', db_index=False)
+
+    class Meta:
+        verbose_name = "Archived Line Item"
+        verbose_name_plural = "Archived Line Items"
+        ordering = ['item_name', 'quantity', 'id']
+        indexes = [
+            models.Index(fields=['purchase_order', 'item_name', 'quantity', 'id'],
+                         name='purchase_archived_item_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.item_name} - {self.quantity} units"
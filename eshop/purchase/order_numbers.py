@@ -0,0 +1,143 @@
+"""
+Order number allocation.
+
+Order numbers used to be the id of a row inserted in a dedicated table for
+every order, a global write hotspot. Allocators now reserve ranges of numbers
+from the `OrderNumberSequence` row (hi/lo style) and hand them out from memory.
+
+Numbers are strictly unique across threads and processes, since every range
+is reserved by an atomic UPDATE of the sequence row, but they may have gaps:
+numbers left in a process' range when it exits are never used.
+
+The allocator is configured with the `ORDER_NUMBER_ALLOCATOR` setting:
+
+    ORDER_NUMBER_ALLOCATOR = {
+        'BACKEND': 'purchase.order_numbers.BlockOrderNumberAllocator',
+        'OPTIONS': {'block_size': 100},
+    }
+"""
+import os
+import threading
+from collections import deque
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F, Max
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from purchase.models import ArchivedOrder, Order, OrderNumberSequence
+
+SEQUENCE_NAME = 'order_number'
+
+DEFAULT_ALLOCATOR = {
+    'BACKEND': 'purchase.order_numbers.BlockOrderNumberAllocator',
+    'OPTIONS': {'block_size': 100},
+}
+
+
+class BaseOrderNumberAllocator:
+    def allocate(self, count=1) -> list[int]:
+        """Return `count` new, unique order numbers."""
+        raise NotImplementedError('subclasses must implement allocate()')
+
+    def reserve(self, size) -> range:
+        """Reserve `size` consecutive numbers in the database."""
+        using = router.db_for_write(OrderNumberSequence)
+        sequence = OrderNumberSequence.objects.using(using).filter(name=SEQUENCE_NAME)
+
+        while True:
+            with transaction.atomic(using=using):
+                if sequence.update(last_value=F('last_value') + size):
+                    last_value = sequence.values_list('last_value', flat=True).get()
+                    return range(last_value - size + 1, last_value + 1)
+
+            # No sequence row yet (e.g. flushed database): start after the
+            # highest number in use, archived orders included. A concurrent
+            # worker may create it first.
+            try:
+                with transaction.atomic(using=using):
+                    in_use = max(model.objects.using(using).aggregate(
+                        Max('order_number'))['order_number__max'] or 0
+                        for model in (Order, ArchivedOrder))
+                    OrderNumberSequence.objects.using(using).create(
+                        name=SEQUENCE_NAME, last_value=in_use + size)
+                    return range(in_use + 1, in_use + size + 1)
+            except IntegrityError:
+                continue
+
+
+class SequenceOrderNumberAllocator(BaseOrderNumberAllocator):
+    """Reserve exactly the numbers asked for, one UPDATE per call."""
+
+    def allocate(self, count=1):
+        return list(self.reserve(count))
+
+
+class BlockOrderNumberAllocator(BaseOrderNumberAllocator):
+    """
+    Reserve `block_size` numbers at a time and hand them out from memory, so
+    a database write is only needed once every `block_size` orders.
+    """
+
+    def __init__(self, block_size=100):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = deque()
+        self._pid = os.getpid()
+
+    def allocate(self, count=1):
+        numbers = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent (or a sibling) owns these blocks
+                self._blocks.clear()
+                self._pid = os.getpid()
+
+            while self._blocks and len(numbers) < count:
+                block = self._blocks.popleft()
+                taken = block[:count - len(numbers)]
+                numbers.extend(taken)
+                if len(taken) < len(block):
+                    self._blocks.appendleft(block[len(taken):])
+
+        missing = count - len(numbers)
+        if missing:
+            block = self.reserve(missing + self.block_size)
+            numbers.extend(block[:missing])
+            self.keep(block[missing:])
+        return numbers
+
+    def keep(self, block):
+        """Hand out the rest of a freshly reserved block on later calls."""
+        using = router.db_for_write(OrderNumberSequence)
+        if connections[using].in_atomic_block:
+            # The reservation is only durable once the enclosing transaction
+            # commits; after a rollback another worker may reserve the same
+            # numbers, so they must not be reused.
+            transaction.on_commit(lambda: self._add(block), using=using)
+        else:
+            self._add(block)
+
+    def _add(self, block):
+        with self._lock:
+            self._blocks.append(block)
+
+
+@lru_cache(maxsize=None)
+def get_allocator() -> BaseOrderNumberAllocator:
+    config = getattr(settings, 'ORDER_NUMBER_ALLOCATOR', DEFAULT_ALLOCATOR)
+    allocator_class = import_string(config['BACKEND'])
+    return allocator_class(**config.get('OPTIONS', {}))
+
+
+def allocate_order_numbers(count=1) -> list[int]:
+    return get_allocator().allocate(count)
+
+
+@receiver(setting_changed)
+def reset_allocator(setting, **kwargs):
+    if setting == 'ORDER_NUMBER_ALLOCATOR':
+        get_allocator.cache_clear()
@@ -0,0 +1,191 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import cmp_to_key
+from itertools import chain
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor, _reverse_ordering
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on a composite, unique ordering.
+
+    DRF's CursorPagination positions on the first ordering field only and
+    skips ties with an OFFSET. Here the cursor carries the full ordering key
+    of the boundary row, so every page is one range query on the matching
+    index: no COUNT(*) and no OFFSET, whatever the page number.
+
+    `ordering` must end with a unique field (usually `id`).
+    """
+    ordering = ('id',)
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        `paginate_queryset` over the rows of several querysets with the same
+        ordering fields, e.g. orders and archived orders: the page is read
+        from each of them and the pages are merged.
+        """
+        pages = [self.page_queryset(queryset, request, view) for queryset in querysets]
+        if pages[0] is None:
+            return None
+        if len(pages) == 1:
+            return self.set_page(list(pages[0]))
+        rows = sorted(chain.from_iterable(pages), key=cmp_to_key(self.compare))
+        return self.set_page(rows[:self.page_size + 1])
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """`paginate_queryset` for async views, fetching the page with the async ORM."""
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(
+            [row async for row in queryset.aiterator(chunk_size=self.page_size + 1)])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The rows of the requested page, plus one, or None when not paginated."""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.fields = [queryset.model._meta.get_field(order.lstrip('-'))
+                       for order in self.ordering]
+        self.cursor = self.decode_cursor(request)
+
+        self.reverse = self.cursor is not None and self.cursor.reverse
+        self.page_ordering = _reverse_ordering(self.ordering) if self.reverse else self.ordering
+        queryset = queryset.order_by(*self.page_ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(
+                self.keyset_filter(self.page_ordering, self.cursor.position))
+
+        # Fetch one extra row to find out whether there is a following page
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        return self.page
+
+    def compare(self, row, other):
+        """Compare two rows in the order the page was read, as with `cmp()`."""
+        for order, value, other_value in zip(
+                self.page_ordering, self.get_position(row), self.get_position(other)):
+            if value != other_value:
+                before = value < other_value
+                if order.startswith('-'):
+                    before = not before
+                return -1 if before else 1
+        return 0
+
+    def keyset_filter(self, ordering, position):
+        """
+        Rows strictly after `position` in `ordering`, i.e. for (a, b, c):
+        a >= A AND (a > A OR (a = A AND (b > B OR (b = B AND c > C))))
+        The leading `a >= A` bound lets the database range scan the index.
+        """
+        condition = None
+        for order, value in reversed(list(zip(ordering, position))):
+            name = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') else 'gt'
+            after = Q(**{f'{name}__{lookup}': value})
+            condition = after if condition is None else (
+                after | (Q(**{name: value}) & condition))
+
+        first = ordering[0]
+        lookup = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': position[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            reverse = bool(tokens.get('r', 0))
+            position = tokens['p']
+            if len(position) != len(self.fields):
+                raise ValueError
+            position = [field.to_python(value)
+                        for field, value in zip(self.fields, position)]
+            # the ordering fields are not nullable
+            if None in position:
+                raise ValueError
+        except (TypeError, ValueError, KeyError, AttributeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor):
+        tokens = {'p': [value.isoformat() if hasattr(value, 'isoformat') else value
+                        for value in cursor.position]}
+        if cursor.reverse:
+            tokens['r'] = 1
+
+        encoded = urlsafe_b64encode(
+            json.dumps(tokens, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_position(self, instance):
+        if isinstance(instance, dict):
+            return [instance[field.attname] for field in self.fields]
+        return [getattr(instance, field.attname) for field in self.fields]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self.get_position(self.page[-1])
+        else:
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self.get_position(self.page[0])
+        else:
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+
+class OrderCursorPagination(KeysetPagination):
+    ordering = ('-order_time', 'id')
+
+
+class SupplierCursorPagination(KeysetPagination):
+    ordering = ('name', 'id')
+
+
+class LineItemCursorPagination(KeysetPagination):
+    ordering = ('item_name', 'quantity', 'id')
+
+
+class SupplierDailyRollupCursorPagination(KeysetPagination):
+    # (supplier, day) is unique
+    ordering = ('day', 'supplier')
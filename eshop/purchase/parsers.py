@@ -0,0 +1,15 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from purchase.renderers import MEDIA_TYPE, msgpack
+
+
+class MessagePackParser(BaseParser):
+    """Request bodies sent as `Content-Type: application/msgpack`, see purchase/renderers.py."""
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read())
+        except (ValueError, TypeError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
@@ -0,0 +1,207 @@
+"""
+Query plan audit of the read endpoints, see `python manage.py audit_queries`.
+
+Every audited request is a GET on a list, detail or filter endpoint, served
+by the real views. Each SELECT it runs is explained with SQLite's
+`EXPLAIN QUERY PLAN` and flagged when the plan
+
+- scans a whole table without an index (`SCAN purchase_order`), or
+- sorts or groups rows in a temporary B-tree (`USE TEMP B-TREE FOR ORDER BY`).
+
+A scan that walks an index in order (`SCAN ... USING INDEX`), as the cursor
+paginated lists do, is not flagged: it stops after a page.
+
+With REPLICA enabled the requests read from the replica, whose queries are
+captured and explained there.
+"""
+import re
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+from rest_framework.test import APIClient
+
+from purchase import cache as supplier_cache, routers
+from purchase.models import LineItem, Order, Supplier, SupplierDailyRollup
+
+SCAN = re.compile(r'^SCAN (?:TABLE )?(?P<table>\w+)(?: AS \w+)?(?P<rest>.*)$')
+# an index scan, or a search through a full text index
+INDEXED_SCAN = re.compile(r'^ (USING|VIRTUAL TABLE)')
+TEMP_B_TREE = re.compile(r'USE TEMP B-TREE FOR (?P<purpose>.+)$')
+
+AUDITED_REQUESTS = {}
+
+
+def audited(name):
+    def register(url):
+        AUDITED_REQUESTS[name] = url
+        return url
+    return register
+
+
+class Sample:
+    """Ids and names of existing rows, so detail and filter requests match something."""
+
+    def __init__(self):
+        order = Order.objects.order_by('id').first()
+        line_item = LineItem.objects.order_by('id').first()
+        supplier = Supplier.objects.order_by('id').first()
+        self.order_id = order.id if order else 1
+        self.order_time = order.order_time if order else None
+        self.line_item_id = line_item.id if line_item else 1
+        self.item_name = line_item.item_name if line_item else 'item'
+        self.supplier_id = supplier.id if supplier else 1
+        self.supplier_name = supplier.name if supplier else 'supplier'
+        rollup = SupplierDailyRollup.objects.order_by('day').first()
+        self.day = rollup.day if rollup else None
+
+
+def with_params(url, **params):
+    params = {name: value for name, value in params.items() if value is not None}
+    return f'{url}?{urlencode(params)}' if params else url
+
+
+@audited('order.list')
+def order_list(sample):
+    return reverse('order-list')
+
+
+@audited('order.detail')
+def order_detail(sample):
+    return reverse('order-detail', args=[sample.order_id])
+
+
+@audited('order.filter_supplier')
+def order_filter_supplier(sample):
+    return with_params(reverse('order-list'), supplier=sample.supplier_id)
+
+
+@audited('order.filter_supplier_name')
+def order_filter_supplier_name(sample):
+    return with_params(reverse('order-list'), supplier_name=sample.supplier_name)
+
+
+@audited('order.filter_item_name')
+def order_filter_item_name(sample):
+    return with_params(reverse('order-list'), item_name=sample.item_name)
+
+
+@audited('order.filter_order_time')
+def order_filter_order_time(sample):
+    after = sample.order_time - timedelta(days=30) if sample.order_time else None
+    return with_params(reverse('order-list'), order_time_after=after and after.isoformat(),
+                       order_time_before=sample.order_time and sample.order_time.isoformat())
+
+
+@audited('order.include_archived')
+def order_include_archived(sample):
+    return with_params(reverse('order-list'), include_archived='true')
+
+
+@audited('line_item.list')
+def line_item_list(sample):
+    return reverse('lineitem-list')
+
+
+@audited('line_item.detail')
+def line_item_detail(sample):
+    return reverse('lineitem-detail', args=[sample.line_item_id])
+
+
+@audited('supplier.list')
+def supplier_list(sample):
+    return reverse('supplier-list')
+
+
+@audited('supplier.detail')
+def supplier_detail(sample):
+    return reverse('supplier-detail', args=[sample.supplier_id])
+
+
+@audited('report.list')
+def report_list(sample):
+    return with_params(reverse('supplierdailyrollup-list'), supplier=sample.supplier_id)
+
+
+@audited('report.daily')
+def report_daily(sample):
+    return with_params(reverse('supplierdailyrollup-daily'), day_after=sample.day)
+
+
+@audited('report.suppliers')
+def report_suppliers(sample):
+    return with_params(reverse('supplierdailyrollup-suppliers'), day_after=sample.day)
+
+
+def explain(sql, using=connection):
+    """The lines of the plan of `sql`, indented by depth."""
+    with using.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        rows = cursor.fetchall()
+    depths, lines = {0: -1}, []
+    for node_id, parent, _, detail in rows:
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append('  ' * depths[node_id] + detail)
+    return lines
+
+
+def plan_flags(plan, tables):
+    """What is wrong with `plan`: full scans of `tables` and temporary B-tree sorts."""
+    flags = []
+    for line in plan:
+        detail = line.strip()
+        scan = SCAN.match(detail)
+        if scan and scan['table'] in tables and not INDEXED_SCAN.match(scan['rest']):
+            flags.append(f"full scan of {scan['table']}")
+        temp = TEMP_B_TREE.search(detail)
+        if temp:
+            flags.append(f"temp B-tree for {temp['purpose'].lower()}")
+    return flags
+
+
+def audited_aliases():
+    """The databases the audited requests read from: `default`, and the replica if enabled."""
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, routers.replica_alias() or DEFAULT_DB_ALIAS]))
+
+
+def audit(names=None):
+    """
+    Serve the `names` audited requests (all by default) and explain their
+    queries, each on the database it ran on. Returns one dict per request,
+    with the plan and flags of each SELECT it ran.
+    """
+    aliases = audited_aliases()
+    for alias in aliases:
+        if connections[alias].vendor != 'sqlite':
+            raise ValueError(f'EXPLAIN QUERY PLAN is only available on SQLite, not on {alias!r}')
+    tables = {alias: set(connections[alias].introspection.table_names()) for alias in aliases}
+    sample = Sample()
+    client = APIClient()
+    client.force_authenticate(User(username='audit'))
+
+    results = []
+    for name in names or AUDITED_REQUESTS:
+        url = AUDITED_REQUESTS[name](sample)
+        # served from the database rather than the supplier cache
+        supplier_cache.bump_generation()
+        with ExitStack() as stack:
+            contexts = {alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in aliases}
+            response = client.get(url)
+        queries = []
+        for alias, context in contexts.items():
+            for query in context.captured_queries:
+                sql = query['sql'].lstrip()
+                # schema lookups, e.g. whether the search index exists
+                if not sql.upper().startswith('SELECT') or 'sqlite_master' in sql:
+                    continue
+                plan = explain(sql, connections[alias])
+                queries.append({'sql': sql, 'database': alias, 'plan': plan,
+                                'flags': plan_flags(plan, tables[alias])})
+        results.append({'name': name, 'url': url, 'status': response.status_code,
+                        'queries': queries})
+    return results
@@ -0,0 +1,35 @@
+"""
+MessagePack rendering, chosen through content negotiation with
+`Accept: application/msgpack` (or `?format=msgpack`).
+
+Order payloads are mostly floats and short strings: MessagePack encodes
+floats as 9 bytes without formatting or parsing decimal text, and
+decodes faster than JSON on the client side as well.
+
+`msgpack` is optional: the renderer and the parser (purchase/parsers.py)
+are only registered in settings.py when it is installed.
+"""
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MEDIA_TYPE = 'application/msgpack'
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    # Dates, decimals, UUIDs and lazy strings as the JSON renderer outputs them
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=self.encoder.default)
@@ -0,0 +1,298 @@
+"""
+Reporting rollups: orders, quantities, amounts and taxes per supplier and day.
+
+`SupplierDailyRollup` has one row per (supplier, day) *cell* with orders, so
+a report over a date range reads at most one row per supplier and day,
+however many line items sit underneath.
+
+The rollups are maintained incrementally. Write paths add what they change
+to the cells they touch, with `F()` updates run in the writing transaction,
+so a rolled back write leaves the rollups as they were and concurrent
+writers add up:
+
+- order saves and deletes, through signals (see purchase/signals.py): a new
+  order counts in its cell, an order moved to another supplier or day takes
+  its totals along and a deleted order takes them away, unless its supplier
+  is deleted: the supplier's cells are then deleted with it by cascade;
+- line item saves and deletes add their difference to their order's cell,
+  see `LineItem`;
+- bulk paths add the totals of the rows they write (`OrderSerializer`,
+  `OrderListSerializer.create`) or rebuild the range they wrote (the data
+  generator).
+
+Amounts and taxes are floats, added up in another order than a
+recomputation would: they may drift by rounding errors. `rebuild()` (`manage.py
+rebuild_rollups`) recomputes the rows from the orders and line items, and
+also picks up data written outside the ORM.
+
+Days are calendar days in the current time zone (TIME_ZONE).
+
+Archived orders (see purchase/archive.py) still count: moving orders to the
+archive leaves the rollups `unchanged()`, and cells are recomputed from the
+orders and the archived orders.
+"""
+import heapq
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from itertools import chain, groupby
+from operator import itemgetter
+
+from asgiref.local import Local
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from purchase.models import ArchivedOrder, Order, SupplierDailyRollup
+
+# rollup field -> aggregate over an order queryset joined to its line items
+AGGREGATES = {
+    'order_count': Count('id', distinct=True),
+    'total_quantity': Sum('line_items__quantity', default=0),
+    'total_amount': Sum(F('line_items__tax_amount') + F('line_items__price_without_tax'),
+                        default=0.0),
+    'total_tax': Sum('line_items__tax_amount', default=0.0),
+}
+# the rollup fields line items add to
+LINE_ITEM_TOTALS = ('total_quantity', 'total_amount', 'total_tax')
+
+# cells written per query
+BATCH_SIZE = 500
+
+_local = Local()
+
+
+def day_of(moment):
+    return timezone.localdate(moment)
+
+
+def day_range(day):
+    """The [start, end) datetimes of `day` in the current time zone."""
+    return (timezone.make_aware(datetime.combine(day, time.min)),
+            timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min)))
+
+
+def order_cell(order):
+    return (order.supplier_id, day_of(order.order_time))
+
+
+def loaded_cell(order):
+    """The cell `order` is in in the database: the one it was in when loaded."""
+    loaded_supplier_id = getattr(order, '_loaded_supplier_id', None)
+    loaded_order_time = getattr(order, '_loaded_order_time', None)
+    if loaded_supplier_id is None or loaded_order_time is None:
+        return order_cell(order)
+    return (loaded_supplier_id, day_of(loaded_order_time))
+
+
+def totals(quantity, price_without_tax, tax_amount, sign=1):
+    """What a line item adds to its cell, or takes away with `sign=-1`."""
+    return {'total_quantity': sign * quantity,
+            'total_amount': sign * (tax_amount + price_without_tax),
+            'total_tax': sign * tax_amount}
+
+
+def line_item_totals(line_items, sign=1):
+    """What `line_items` add to their cell, or take away with `sign=-1`."""
+    sums = dict.fromkeys(LINE_ITEM_TOTALS, 0)
+    for line_item in line_items:
+        for name, value in totals(line_item.quantity, line_item.price_without_tax,
+                                  line_item.tax_amount, sign).items():
+            sums[name] += value
+    return sums
+
+
+def order_totals(order, sign=1):
+    """What `order` adds to its cell with its line items, as in the database."""
+    sums = Order.objects.filter(pk=order.pk).aggregate(
+        **{name: AGGREGATES[name] for name in LINE_ITEM_TOTALS})
+    return {'order_count': sign, **{name: sign * value for name, value in sums.items()}}
+
+
+def merge(*deltas):
+    """The sum of `deltas`, each {cell: {rollup field: value}}."""
+    merged = defaultdict(lambda: defaultdict(int))
+    for delta in deltas:
+        for cell, values in delta.items():
+            for name, value in values.items():
+                merged[cell][name] += value
+    return merged
+
+
+@contextmanager
+def unchanged():
+    """Leave the rollups as they are during the block, e.g. while orders are archived."""
+    previous = suspended()
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = previous
+
+
+def suspended():
+    return getattr(_local, 'suspended', False)
+
+
+def add(deltas):
+    """
+    Add `deltas`, {cell: {rollup field: value}}, to the rollup rows. The rows
+    of cells gaining orders are created if needed, rows left without orders
+    are deleted. A cell with orders but no row was written outside the ORM:
+    it is left to `rebuild()`.
+    """
+    if suspended():
+        return
+    deltas = {cell: changes for cell, changes in (
+        (cell, {name: value for name, value in values.items() if value})
+        for cell, values in deltas.items()) if changes}
+    cells = list(deltas)
+    for start in range(0, len(cells), BATCH_SIZE):
+        add_batch({cell: deltas[cell] for cell in cells[start:start + BATCH_SIZE]})
+
+
+def cells_filter(cells):
+    supplier_ids_by_day = defaultdict(list)
+    for supplier_id, day in cells:
+        supplier_ids_by_day[day].append(supplier_id)
+    condition = Q()
+    for day, supplier_ids in supplier_ids_by_day.items():
+        condition |= Q(day=day, supplier_id__in=supplier_ids)
+    return condition
+
+
+def add_batch(deltas):
+    rollups = SupplierDailyRollup.objects
+    if len(deltas) == 1:
+        # one UPDATE, the common case of a single order written
+        [(cell, values)] = deltas.items()
+        updated = rollups.filter(supplier_id=cell[0], day=cell[1]).update(
+            **{name: F(name) + value for name, value in values.items()})
+        missing = [] if updated else [cell]
+    else:
+        existing = {(row.supplier_id, row.day): row
+                    for row in rollups.filter(cells_filter(deltas)).only('supplier', 'day')}
+        for cell, row in existing.items():
+            for name in AGGREGATES:
+                setattr(row, name, F(name) + deltas[cell].get(name, 0))
+        rollups.bulk_update(existing.values(), list(AGGREGATES))
+        missing = [cell for cell in deltas if cell not in existing]
+
+    created = [SupplierDailyRollup(supplier_id=cell[0], day=cell[1], **deltas[cell])
+               for cell in missing if deltas[cell].get('order_count', 0) > 0]
+    if created:
+        try:
+            with transaction.atomic(using=rollups.db):
+                rollups.bulk_create(created)
+        except IntegrityError:
+            # some were created by a concurrent writer meanwhile
+            for row in created:
+                rollups.filter(supplier_id=row.supplier_id, day=row.day).update(
+                    **{name: F(name) + value for name, value in deltas[row.supplier_id, row.day].items()})
+
+    emptied = [cell for cell, values in deltas.items() if values.get('order_count', 0) < 0]
+    if emptied:
+        rollups.filter(cells_filter(emptied), order_count=0).delete()
+
+
+def add_orders(orders, line_items):
+    """Count new `orders` and their `line_items` in their cells."""
+    cells = {order.pk: order_cell(order) for order in orders}
+    add(merge(*[{cell: {'order_count': 1}} for cell in cells.values()],
+              *[{cells[line_item.purchase_order_id]: totals(
+                  line_item.quantity, line_item.price_without_tax, line_item.tax_amount)}
+                for line_item in line_items]))
+
+
+def order_saved(order, created):
+    """Count a new order, or move a saved order's totals to the cell it moved to."""
+    if suspended():
+        return
+    if created:
+        add({order_cell(order): {'order_count': 1}})
+        return
+    previous, current = loaded_cell(order), order_cell(order)
+    if previous != current:
+        moved = order_totals(order)
+        add({previous: {name: -value for name, value in moved.items()}, current: moved})
+
+
+def order_deleted(order):
+    """Take an order about to be deleted, with its line items, out of its cell."""
+    if not suspended():
+        add({loaded_cell(order): order_totals(order, -1)})
+
+
+def line_items_changed(before, after):
+    """
+    Add the difference between two states of line items to the cells of
+    their orders: `before` and `after` list the (order id, quantity,
+    price_without_tax, tax_amount) of line items, see `LineItem.REPORTED_FIELDS`.
+    """
+    if suspended() or not (before or after):
+        return
+    cells = {order_id: (supplier_id, day_of(order_time)) for order_id, supplier_id, order_time
+             in Order.objects.filter(id__in={state[0] for state in before + after})
+             .values_list('id', 'supplier_id', 'order_time')}
+    add(merge(*[{cells[order_id]: totals(*values, sign=-1)}
+                for order_id, *values in before if order_id in cells],
+              *[{cells[order_id]: totals(*values)}
+                for order_id, *values in after if order_id in cells]))
+
+
+def aggregate(orders):
+    """Rollup rows (dicts) of an order queryset, one per supplier and day."""
+    return (orders.order_by()
+            .annotate(day=TruncDate('order_time'))
+            .values('supplier_id', 'day')
+            .annotate(**AGGREGATES))
+
+
+def combine(rows):
+    """Rollup rows with the same cell summed, e.g. from orders and archived orders."""
+    cells = {}
+    for row in rows:
+        cell = (row['supplier_id'], row['day'])
+        if cell in cells:
+            for name in AGGREGATES:
+                cells[cell][name] += row[name]
+        else:
+            cells[cell] = row
+    return list(cells.values())
+
+
+def rebuild(since=None, until=None, batch_size=5000):
+    """
+    Recompute every rollup row from `since` to `until` (dates, inclusive;
+    open-ended when None) in one pass over the orders and one over the
+    archived orders. Returns the number of rows written.
+    """
+    rollups, orders = SupplierDailyRollup.objects.all(), Q()
+    if since is not None:
+        rollups = rollups.filter(day__gte=since)
+        orders &= Q(order_time__gte=day_range(since)[0])
+    if until is not None:
+        rollups = rollups.filter(day__lte=until)
+        orders &= Q(order_time__lt=day_range(until)[1])
+
+    # A cell can have both orders and archived orders, e.g. orders imported
+    # with an archived day's order_time: merge the two streams by cell
+    cell = itemgetter('supplier_id', 'day')
+    streams = [aggregate(model.objects.filter(orders)).order_by('supplier_id', 'day')
+               .iterator(chunk_size=batch_size) for model in (Order, ArchivedOrder)]
+    cells = chain.from_iterable(
+        combine(rows) for _, rows in groupby(heapq.merge(*streams, key=cell), key=cell))
+    written = 0
+    with transaction.atomic(using=SupplierDailyRollup.objects.db):
+        rollups.delete()
+        rows = []
+        for row in cells:
+            rows.append(SupplierDailyRollup(**row))
+            if len(rows) >= batch_size:
+                SupplierDailyRollup.objects.bulk_create(rows)
+                written += len(rows)
+                rows = []
+        SupplierDailyRollup.objects.bulk_create(rows)
+        written += len(rows)
+    return written
@@ -0,0 +1,200 @@
+"""
+Fast read path of the order and line item endpoints.
+
+Serializing model instances with OrderSerializer runs DRF's field machinery
+for every field of every row, and builds a model instance per order, line
+item and supplier before that. List and detail responses are built here
+instead from `values()` rows, straight into the dicts OrderSerializer and
+LineItemSerializer would produce: same keys in the same order and same
+values, so the rendered JSON is byte for byte the same (test.py checks it).
+
+Any field added to these serializers must be added here too.
+
+Clients may ask for less with `?fields=` and `?expand=` (see FieldSet).
+Only what they ask for is read: the supplier join, each total's subquery
+and the line items query are left out of the queries when not needed.
+"""
+from collections import defaultdict
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import DateTimeField
+
+from purchase import cache as supplier_cache
+from purchase.models import LineItem, Supplier
+from purchase.serializers import SupplierSerializer
+
+ORDER_FIELDS = ('id', 'supplier', 'line_items', 'order_number', 'total_quantity',
+                'total_amount', 'total_tax', 'order_time', 'version')
+ORDER_RELATIONS = ('supplier', 'line_items')
+ORDER_TOTALS = ('total_quantity', 'total_amount', 'total_tax')
+
+LINE_ITEM_FIELDS = ('id', 'line_total', 'item_name', 'quantity', 'price_without_tax',
+                    'tax_name', 'tax_amount', 'purchase_order')
+
+SUPPLIER_FIELDS = ('id', 'name', 'email')
+
+# Always read: the cursor needs (order_time, id) and the ETag (id, version)
+ORDER_COLUMNS = ('id', 'supplier_id', 'order_number', 'order_time', 'version')
+ORDER_SUPPLIER_COLUMNS = ('supplier__name', 'supplier__email', 'supplier__version')
+
+LINE_ITEM_COLUMNS = ('id', 'item_name', 'quantity', 'price_without_tax', 'tax_name',
+                     'tax_amount', 'purchase_order_id')
+
+datetime_field = DateTimeField()
+supplier_serializer = SupplierSerializer()
+
+
+class FieldSet:
+    """
+    The fields of a representation to output, in representation order, and
+    the relations to expand. Relations that are output but not expanded
+    are collapsed to their ids.
+    """
+
+    def __init__(self, fields, expand, sparse=False):
+        self.fields = fields
+        self.expand = expand
+        self.sparse = sparse
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def select(self, data):
+        if not self.sparse:
+            return data
+        return {name: data[name] for name in self.fields}
+
+
+ORDER_FIELDSET = FieldSet(ORDER_FIELDS, frozenset(ORDER_RELATIONS))
+
+
+def requested_fields(request, fields, relations=()):
+    """
+    The FieldSet asked for by `request`: `?fields=` among `fields` (default:
+    all of them) and `?expand=` among `relations`, which are output as well.
+    Without either parameter every relation is expanded, as the serializers
+    do; with any of them, only the relations in `?expand=` are.
+    """
+    params = request.query_params
+    if 'fields' not in params and 'expand' not in params:
+        return FieldSet(fields, frozenset(relations))
+
+    expand = parse_names(params.get('expand', ''), relations, 'expand')
+    selected = parse_names(params['fields'], fields, 'fields') if 'fields' in params else set(fields)
+    selected |= expand
+    return FieldSet(tuple(name for name in fields if name in selected), frozenset(expand),
+                    sparse=len(selected) < len(fields))
+
+
+def parse_names(value, choices, param):
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = names - set(choices)
+    if unknown and not choices:
+        raise ValidationError({param: ['No field can be expanded here.']})
+    if unknown:
+        raise ValidationError({param: [
+            f'Unknown fields: {", ".join(sorted(unknown))}. Choose from: {", ".join(choices)}.']})
+    return names
+
+
+def etag_columns(fieldset=ORDER_FIELDSET):
+    """The columns of an order row its ETag is computed from, see purchase/etags.py."""
+    if 'supplier' in fieldset.expand:
+        return ('id', 'version', 'supplier__version')
+    return ('id', 'version')
+
+
+def order_rows(queryset, fieldset=ORDER_FIELDSET):
+    """The rows of the orders of `queryset` that `fieldset` needs, as dicts."""
+    columns = list(ORDER_COLUMNS)
+    if 'supplier' in fieldset.expand:
+        columns += ORDER_SUPPLIER_COLUMNS
+    totals = [f'_{name}' for name in ORDER_TOTALS if name in fieldset]
+    if totals:
+        queryset = queryset.with_totals(*totals)
+    return queryset.values(*columns, *totals)
+
+
+def line_item_rows(queryset):
+    return queryset.values(*LINE_ITEM_COLUMNS)
+
+
+def line_item(row):
+    """LineItemSerializer's representation of a line item row."""
+    return {
+        'id': row['id'],
+        'line_total': row['tax_amount'] + row['price_without_tax'],
+        'item_name': row['item_name'],
+        'quantity': row['quantity'],
+        'price_without_tax': row['price_without_tax'],
+        'tax_name': row['tax_name'],
+        'tax_amount': row['tax_amount'],
+        'purchase_order': row['purchase_order_id'],
+    }
+
+
+def order(row, supplier, line_items):
+    """OrderSerializer's representation of an order row, given its nested representations."""
+    return {
+        'id': row['id'],
+        'supplier': supplier,
+        'line_items': line_items,
+        'order_number': row['order_number'],
+        'total_quantity': row.get('_total_quantity'),
+        'total_amount': row.get('_total_amount'),
+        'total_tax': row.get('_total_tax'),
+        'order_time': datetime_field.to_representation(row['order_time']),
+        'version': row['version'],
+    }
+
+
+def represent_orders(rows, line_items, fieldset=ORDER_FIELDSET, supplier_generation=None):
+    """
+    Representations of order `rows`, given the rows of their line items in
+    order, or their (purchase_order_id, id) when collapsed.
+    `supplier_generation` is the supplier cache generation taken before the
+    rows were read, see `cache.representations`.
+    """
+    if 'supplier' in fieldset.expand:
+        # Nested suppliers come from the supplier cache, as with OrderSerializer
+        suppliers = supplier_cache.representations(
+            {row['supplier_id']: Supplier(id=row['supplier_id'], name=row['supplier__name'],
+                                          email=row['supplier__email'])
+             for row in rows}.values(),
+            supplier_serializer.serialize, supplier_generation)
+    else:
+        suppliers = None
+
+    by_order = defaultdict(list)
+    if 'line_items' in fieldset.expand:
+        for row in line_items:
+            by_order[row['purchase_order_id']].append(line_item(row))
+    else:
+        for order_id, line_item_id in line_items:
+            by_order[order_id].append(line_item_id)
+
+    return [fieldset.select(order(
+        row,
+        suppliers[row['supplier_id']] if suppliers is not None else row['supplier_id'],
+        by_order[row['id']]))
+        for row in rows]
+
+
+def orders(rows, fieldset=ORDER_FIELDSET, line_item_models=(LineItem,), supplier_generation=None):
+    """
+    Representations of order `rows`, reading their line items if needed: in
+    one query per model of `line_item_models`, which also has ArchivedLineItem
+    when some of the rows are archived orders.
+    """
+    line_items = []
+    if rows and 'line_items' in fieldset:
+        order_ids = [row['id'] for row in rows]
+        for model in line_item_models:
+            queryset = (model.objects
+                        .filter(purchase_order_id__in=order_ids)
+                        .order_by(*model.ORDER_ORDERING))
+            if 'line_items' in fieldset.expand:
+                line_items += line_item_rows(queryset)
+            else:
+                line_items += queryset.values_list('purchase_order_id', 'id')
+    return represent_orders(rows, line_items, fieldset, supplier_generation)
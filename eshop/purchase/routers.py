@@ -0,0 +1,133 @@
+"""
+Read replica routing.
+
+While a safe request (GET, HEAD, OPTIONS) is served, reads of the purchase
+models go to the replica database alias. Everything else stays on
+`default`: writes, reads made while serving unsafe requests (validation,
+read-modify-write) and reads outside of requests (commands, on_commit
+hooks).
+
+Replicas lag behind, so clients read their own writes:
+
+- once a request writes, the rest of it reads from `default`;
+- the response then pins the client to `default` for STICKY_SECONDS with a
+  cookie, which must outlast the replica's refresh interval.
+
+ReplicaMiddleware (purchase/middleware.py) tracks both for each request.
+
+Settings:
+
+    REPLICA = {
+        'ENABLED': False,
+        'ALIAS': 'replica',             # a DATABASES alias
+        'STICKY_SECONDS': 15,
+        'COOKIE': 'replica_pin',
+    }
+
+The replica can be a local SQLite copy of the default database, kept fresh
+by `manage.py refresh_replica --interval 5` (see `refresh`).
+"""
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+ROUTED_APPS = {'purchase'}
+
+# ReplicaState of the request being served
+current_state = ContextVar('current_replica_state', default=None)
+
+
+def get_setting(name, default):
+    return getattr(settings, 'REPLICA', {}).get(name, default)
+
+
+def replica_alias():
+    """The replica alias, or None when replica reads are disabled."""
+    alias = get_setting('ALIAS', 'replica')
+    if get_setting('ENABLED', False) and alias in settings.DATABASES:
+        return alias
+    return None
+
+
+def reads_replica():
+    """Whether reads of the purchase models go to the replica right now."""
+    state = current_state.get()
+    return (state is not None and state.use_replica and not state.wrote
+            and replica_alias() is not None)
+
+
+class ReplicaState:
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+def start_request(request):
+    """Set up the routing of `request`, returns the state and the token to reset it."""
+    state = ReplicaState(
+        replica_alias() is not None and request.method in SAFE_METHODS and not is_pinned(request))
+    return state, current_state.set(state)
+
+
+def finish_request(request, response, state, token):
+    current_state.reset(token)
+    if state.wrote and replica_alias() is not None:
+        sticky_seconds = get_setting('STICKY_SECONDS', 15)
+        response.set_cookie(get_setting('COOKIE', 'replica_pin'),
+                            str(time.time() + sticky_seconds),
+                            max_age=sticky_seconds, httponly=True, samesite='Lax')
+    return response
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES[get_setting('COOKIE', 'replica_pin')]) > time.time()
+    except (KeyError, ValueError):
+        return False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in ROUTED_APPS or not reads_replica():
+            return None
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in ROUTED_APPS or replica_alias() is None:
+            return None
+        state = current_state.get()
+        if state is not None:
+            state.wrote = True
+        # also for instances read from the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, get_setting('ALIAS', 'replica')}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica is a copy of the migrated default database
+        if db == get_setting('ALIAS', 'replica'):
+            return False
+        return None
+
+
+def refresh(source, target):
+    """
+    Copy the SQLite database of connection `source` into `target` with
+    SQLite's online backup API, in a single step: readers of the replica,
+    including persistent connections, move from the previous copy to the
+    new one atomically. Returns the number of pages copied.
+    """
+    source.ensure_connection()
+    target.ensure_connection()
+    pages = []
+    source.connection.backup(target.connection, progress=lambda status, remaining, total:
+                             pages.append(total))
+    return pages[-1] if pages else 0
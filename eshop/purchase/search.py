@@ -0,0 +1,151 @@
+"""
+Search index behind OrderFilter's `supplier_name` and `item_name` filters.
+
+On SQLite, FTS5 tables with the trigram tokenizer shadow `Supplier.name` and
+`LineItem.item_name`, so substring searches use an index instead of scanning
+and joining every line item. The shadow tables are external content tables
+kept in sync by triggers, which also covers bulk_create/bulk_update and
+cascading deletes that bypass model signals. The index is only used when the
+triggers exist too: SQLite drops them when a migration remakes a content
+table, and they are then recreated, with the index, after `migrate`.
+
+Other databases, or SQLite builds without FTS5, fall back to `icontains`.
+"""
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from purchase.models import LineItem
+
+# shadow table -> (content table, indexed column)
+SEARCH_TABLES = {
+    'purchase_supplier_fts': ('purchase_supplier', 'name'),
+    'purchase_lineitem_fts': ('purchase_lineitem', 'item_name'),
+}
+
+TRIGGER_SUFFIXES = ('ai', 'ad', 'au')
+INDEX_TRIGGERS = {f'{fts_table}_{suffix}' for fts_table in SEARCH_TABLES for suffix in TRIGGER_SUFFIXES}
+
+# The trigram tokenizer cannot match anything shorter
+MIN_QUERY_LENGTH = 3
+
+_available = {}
+
+
+def index_statements():
+    for fts_table, (table, column) in SEARCH_TABLES.items():
+        yield (f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+               f"{column}, content='{table}', content_rowid='id', tokenize='trigram')")
+        yield (f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN "
+               f"INSERT INTO {fts_table}(rowid, {column}) VALUES (new.id, new.{column}); END")
+        yield (f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN "
+               f"INSERT INTO {fts_table}({fts_table}, rowid, {column}) "
+               f"VALUES ('delete', old.id, old.{column}); END")
+        yield (f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column} ON {table} BEGIN "
+               f"INSERT INTO {fts_table}({fts_table}, rowid, {column}) "
+               f"VALUES ('delete', old.id, old.{column}); "
+               f"INSERT INTO {fts_table}(rowid, {column}) VALUES (new.id, new.{column}); END")
+
+
+def supports_index(connection):
+    # the trigram tokenizer was added in SQLite 3.34
+    if connection.vendor != 'sqlite' or connection.Database.sqlite_version_info < (3, 34):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+def create_index(connection):
+    """Create the shadow tables and triggers, and index the existing rows."""
+    _available.pop(connection.alias, None)
+    if not supports_index(connection):
+        return False
+    with connection.cursor() as cursor:
+        for statement in index_statements():
+            cursor.execute(statement)
+        for fts_table in SEARCH_TABLES:
+            cursor.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+    return True
+
+
+def drop_index(connection):
+    _available.pop(connection.alias, None)
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for fts_table in SEARCH_TABLES:
+            for suffix in TRIGGER_SUFFIXES:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {fts_table}")
+
+
+def index_objects(connection):
+    """The shadow tables and triggers of the index that exist in the database."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        names = {name for name, in cursor.fetchall()}
+    return set(SEARCH_TABLES) & names, INDEX_TRIGGERS & names
+
+
+def is_available(using):
+    if using not in _available:
+        connection = connections[using]
+        _available[using] = (connection.vendor == 'sqlite' and
+                             index_objects(connection) == (set(SEARCH_TABLES), INDEX_TRIGGERS))
+    return _available[using]
+
+
+@receiver(post_migrate)
+def repair_index(sender, using, **kwargs):
+    """Recreate the triggers, and reindex, when a migration dropped some of them."""
+    connection = connections[using]
+    if sender.label != 'purchase' or connection.vendor != 'sqlite':
+        return
+    tables, triggers = index_objects(connection)
+    if tables and triggers != INDEX_TRIGGERS:
+        create_index(connection)
+    _available.pop(using, None)
+
+
+async def ais_available(using):
+    # The first check introspects the database, which async code cannot do directly
+    if using in _available:
+        return _available[using]
+    return await sync_to_async(is_available)(using)
+
+
+def match_expression(value):
+    """FTS5 phrase matching `value` anywhere in the indexed column."""
+    return '"' + value.replace('"', '""') + '"'
+
+
+def filter_supplier_name(queryset, value):
+    """Orders of `queryset` whose supplier name contains `value`."""
+    if len(value) < MIN_QUERY_LENGTH or not is_available(queryset.db):
+        return queryset.filter(supplier__name__icontains=value)
+
+    return queryset.filter(supplier_id__in=RawSQL(
+        "SELECT rowid FROM purchase_supplier_fts WHERE purchase_supplier_fts MATCH %s",
+        [match_expression(value)]))
+
+
+def filter_item_name(queryset, value):
+    """
+    Orders of `queryset` with a line item whose name contains `value`.
+    Each order is returned once, however many of its items match.
+    Archived line items are not indexed.
+    """
+    line_items = queryset.line_item_model()
+    if (len(value) < MIN_QUERY_LENGTH or line_items is not LineItem
+            or not is_available(queryset.db)):
+        return queryset.filter(id__in=line_items.objects
+                               .filter(item_name__icontains=value)
+                               .values('purchase_order_id'))
+
+    return queryset.filter(id__in=RawSQL(
+        "SELECT purchase_order_id FROM purchase_lineitem WHERE id IN "
+        "(SELECT rowid FROM purchase_lineitem_fts WHERE purchase_lineitem_fts MATCH %s)",
+        [match_expression(value)]))
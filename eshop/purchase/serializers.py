@@ -1,6 +1,11 @@
 from django.contrib.auth.models import Group, User
+from django.db import models, transaction
+from django.utils import timezone
 from rest_framework import serializers
-from purchase.models import Supplier, Order, LineItem
+from purchase import cache as supplier_cache, reporting
+from purchase.models import Supplier, Order, LineItem, SupplierDailyRollup
+from purchase.order_numbers import allocate_order_numbers
+from purchase.suppliers import SupplierResolver
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -18,7 +23,19 @@ class GroupSerializer(serializers.HyperlinkedModelSerializer):
 class SupplierSerializer(serializers.ModelSerializer):
     class Meta:
         model = Supplier
-        fields = '__all__'
+        # the version only serves the ETags of orders
+        exclude = ['version']
+
+    def to_representation(self, instance):
+        prefetched = self.context.get('supplier_representations')
+        if prefetched and instance.pk in prefetched:
+            return prefetched[instance.pk]
+        return supplier_cache.representation(
+            instance, self.serialize, self.context.get('supplier_generation'))
+
+    def serialize(self, instance):
+        """Representation built from the fields, bypassing the cache."""
+        return super().to_representation(instance)
 
     def to_internal_value(self, data):
         if self.instance is None:  # Check if creating a new instance
@@ -27,15 +44,8 @@ class SupplierSerializer(serializers.ModelSerializer):
             return super().to_internal_value(data)
     
     def create(self, validated_data):
-        instance_id = validated_data.get('id')
-        
-        if instance_id:
-            # If an ID is provided, try to update the instance
-            instance, created = Supplier.objects.update_or_create(id=instance_id, defaults=validated_data)
-            return instance
-
-        # If no ID is provided, create a new instance
-        return Supplier.objects.create(**validated_data)
+        # Updates the supplier when an ID is provided and a field differs
+        return SupplierResolver().resolve([validated_data])[0]
 
 
 class LineItemSerializer(serializers.ModelSerializer):
@@ -56,25 +66,109 @@ class LineItemSerializer(serializers.ModelSerializer):
             return super().to_internal_value(data)
 
 
+class OrderLineItemSerializer(LineItemSerializer):
+    """
+    Line item nested in an order: it always belongs to the enclosing order,
+    so `purchase_order` is output only and never looked up on input.
+    """
+    class Meta(LineItemSerializer.Meta):
+        extra_kwargs = {
+            'purchase_order': {'read_only': True},
+        }
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    """
+    Creates many orders at once with batched INSERTs: suppliers, order
+    numbers, orders and line items each cost one statement per batch,
+    whatever the number of orders.
+    """
+    batch_size = 1000
+
+    def to_representation(self, data):
+        orders = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        # Nested supplier representations come from the cache in one round trip
+        self.context['supplier_representations'] = supplier_cache.representations(
+            {order.supplier for order in orders},
+            self.child.fields['supplier'].serialize, self.context.get('supplier_generation'))
+        return super().to_representation(orders)
+
+    @transaction.atomic
+    def create(self, validated_data):
+        # A dict passed as `supplier_map` in the serializer context keeps the
+        # known suppliers across batches, see purchase/suppliers.py
+        suppliers = self.child.get_supplier_resolver().resolve(
+            [self.child.pop_supplier(order_data) for order_data in validated_data])
+
+        order_numbers = allocate_order_numbers(len(validated_data))
+
+        order_time = timezone.now()
+        orders = Order.objects.bulk_create([
+            Order(supplier=supplier, order_number=order_number,
+                  order_time=order_data.get('order_time', order_time))
+            for supplier, order_number, order_data
+            in zip(suppliers, order_numbers, validated_data)
+        ], batch_size=self.batch_size)
+
+        line_items = []
+        for order, order_data in zip(orders, validated_data):
+            for line_item_data in order_data['line_items']:
+                line_item_data = {**line_item_data, 'purchase_order': order}
+                if not line_item_data.get('id'):
+                    line_item_data.pop('id', None)
+                line_items.append(LineItem(**line_item_data))
+        LineItem.objects.bulk_create(line_items, batch_size=self.batch_size)
+        # bulk_create sends no signals
+        reporting.add_orders(orders, line_items)
+
+        return orders
+
+
+class OrderBulkResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    order_number = serializers.IntegerField()
+
+
 class OrderSerializer(serializers.ModelSerializer):
-    supplier = SupplierSerializer()
-    line_items = LineItemSerializer(many=True)
-    order_number = serializers.PrimaryKeyRelatedField(read_only=True)
+    supplier = SupplierSerializer(required=False)
+    supplier_id = serializers.IntegerField(
+        write_only=True, required=False,
+        help_text='ID of an existing supplier, instead of the nested `supplier`.')
+    line_items = OrderLineItemSerializer(many=True)
+    order_number = serializers.IntegerField(read_only=True)
 
     # computed field
     total_quantity = serializers.ReadOnlyField()
     total_amount = serializers.ReadOnlyField()
     total_tax = serializers.ReadOnlyField()
 
-    
-    def create_or_update_supplier(self,validated_data):
-        supplier_data = validated_data.pop('supplier')
-        supplier_serializer = SupplierSerializer(data=supplier_data)
-        supplier_serializer.is_valid(raise_exception=True)
-        supplier_serializer.save()
-        return supplier_serializer.instance
-
-
+    def validate(self, attrs):
+        if 'supplier' in attrs and 'supplier_id' in attrs:
+            raise serializers.ValidationError(
+                {'supplier_id': ['Send either supplier or supplier_id, not both.']})
+        if 'supplier' not in attrs and 'supplier_id' not in attrs and not self.partial:
+            raise serializers.ValidationError({'supplier': ['This field is required.']})
+        return attrs
+
+    def get_supplier_resolver(self):
+        """Resolver shared by the orders of this request, see purchase/suppliers.py."""
+        resolver = self.context.get('supplier_resolver')
+        if resolver is None:
+            resolver = self.context['supplier_resolver'] = SupplierResolver(
+                self.context.get('supplier_map'))
+        return resolver
+
+    @staticmethod
+    def pop_supplier(validated_data):
+        """The supplier entry of an order: its ID when referenced, else the nested data."""
+        if 'supplier_id' in validated_data:
+            return validated_data.pop('supplier_id')
+        return validated_data.pop('supplier')
+
+    def create_or_update_supplier(self, validated_data):
+        return self.get_supplier_resolver().resolve([self.pop_supplier(validated_data)])[0]
+
+    @transaction.atomic
     def create(self, validated_data):
         supplier = self.create_or_update_supplier(validated_data)
 
@@ -82,49 +176,114 @@ class OrderSerializer(serializers.ModelSerializer):
 
         order = Order.objects.create(supplier=supplier, **validated_data)
 
-        line_item_serializer = LineItemSerializer(data=line_items_data, many=True)
-        line_item_serializer.is_valid(raise_exception=True)
-        line_item_serializer.save(purchase_order=order)
-
+        # Already validated by the nested serializer; one INSERT for all of
+        # them, and no version bump per line item of a brand new order (its
+        # reporting rollup counts them once, post_save counted the order)
+        line_items = LineItem.objects.bulk_create([
+            LineItem(purchase_order=order, **line_item_data)
+            for line_item_data in line_items_data
+        ])
+        reporting.add({reporting.order_cell(order): reporting.line_item_totals(line_items)})
 
         return order
 
-    def update(self, instance, validated_data):
-
-        supplier = self.create_or_update_supplier(validated_data)
-
-        instance.supplier = supplier
-
-        line_items_data = validated_data.pop('line_items')
-
-        # Update the line items
-        updated_line_item_ids = set()
+    def reconcile_line_items(self, order, line_items_data):
+        """
+        Make the line items of `order` match `line_items_data`.
+
+        Existing items are loaded once (or taken from the prefetch cache), the
+        inserts, updates and deletes are worked out in memory, and unchanged
+        rows are not written at all.
+        """
+        existing = {line_item.id: line_item for line_item in order.line_items.all()}
+        # added to the rollup cell the order is in until it is saved
+        before = reporting.line_item_totals(existing.values(), -1)
+
+        unknown_ids = [data['id'] for data in line_items_data
+                       if data.get('id') and data['id'] not in existing]
+        if unknown_ids:
+            raise serializers.ValidationError({'line_items': [
+                f'Line item {line_item_id} does not belong to this order.'
+                for line_item_id in unknown_ids]})
+
+        to_create, to_update, kept_ids = [], {}, set()
+        changed_fields = set()
         for line_item_data in line_items_data:
-            line_item_id = line_item_data.get('id')
-            if line_item_id:
-                # If line item ID is provided, update the existing line item
-                line_item = LineItem.objects.get(id=line_item_id)
-                for field_name, field_value in line_item_data.items():
+            line_item_data = dict(line_item_data)
+            line_item_id = line_item_data.pop('id', None)
+            # Line items always stay on the order being updated
+            line_item_data.pop('purchase_order', None)
+
+            if not line_item_id:
+                to_create.append(LineItem(purchase_order=order, **line_item_data))
+                continue
+
+            line_item = existing[line_item_id]
+            kept_ids.add(line_item_id)
+            for field_name, field_value in line_item_data.items():
+                if getattr(line_item, field_name) != field_value:
                     setattr(line_item, field_name, field_value)
-                line_item.save()
-                updated_line_item_ids.add(line_item_id)
-            else:
-                # If no line item ID is provided, create a new line item
-                new_line_item = LineItem.objects.create(
-                    purchase_order=instance, **line_item_data)
+                    changed_fields.add(field_name)
+                    to_update[line_item_id] = line_item
+
+        deleted_ids = existing.keys() - kept_ids
+        if deleted_ids:
+            LineItem.objects.filter(id__in=deleted_ids).delete()
+        if to_update:
+            LineItem.objects.bulk_update(
+                to_update.values(), sorted(changed_fields))
+        LineItem.objects.bulk_create(to_create)
+
+        after = reporting.line_item_totals(
+            [*(existing[line_item_id] for line_item_id in kept_ids), *to_create])
+        cell = reporting.loaded_cell(order)
+        reporting.add(reporting.merge({cell: before}, {cell: after}))
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
 
-                updated_line_item_ids.add(new_line_item.id)
+        if 'supplier' in validated_data or 'supplier_id' in validated_data:
+            instance.supplier = self.create_or_update_supplier(validated_data)
 
-        # Delete line items that are not present in the updated data
-        instance.line_items.exclude(id__in=updated_line_item_ids).delete()
+        # left out of partial updates
+        line_items_data = validated_data.pop('line_items', None)
+        if line_items_data is not None:
+            self.reconcile_line_items(instance, line_items_data)
 
         # Update other fields of the order if needed
         instance.save()
 
+        # Totals annotated when the order was fetched are stale now
+        instance.clear_totals()
+
         return instance
 
     class Meta:
         model = Order
         fields = '__all__'
+        list_serializer_class = OrderListSerializer
         read_only_fields = ['total_quantity',
                             'total_amount', 'total_tax']
+
+
+class SupplierDailyRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SupplierDailyRollup
+        fields = ['supplier', 'day', 'order_count', 'total_quantity',
+                  'total_amount', 'total_tax']
+
+
+class RollupTotalsSerializer(serializers.Serializer):
+    order_count = serializers.IntegerField()
+    total_quantity = serializers.IntegerField()
+    total_amount = serializers.FloatField()
+    total_tax = serializers.FloatField()
+
+
+class DailyTotalsSerializer(RollupTotalsSerializer):
+    day = serializers.DateField()
+
+
+class SupplierTotalsSerializer(RollupTotalsSerializer):
+    supplier = serializers.IntegerField(source='supplier_id')
+    supplier_name = serializers.CharField(source='supplier__name')
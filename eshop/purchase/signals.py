@@ -0,0 +1,39 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from purchase import cache as supplier_cache, reporting
+from purchase.models import Order, Supplier
+
+
+@receiver(post_save, sender=Supplier)
+def invalidate_saved_supplier(sender, instance, **kwargs):
+    # e.g. suppliers saved unchanged from the admin
+    if instance.has_changed():
+        supplier_cache.invalidate([instance.pk])
+
+
+@receiver(post_delete, sender=Supplier)
+def invalidate_deleted_supplier(sender, instance, **kwargs):
+    supplier_cache.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Order)
+def add_saved_order(sender, instance, created, **kwargs):
+    reporting.order_saved(instance, created)
+
+
+def deletes_supplier(origin):
+    """Whether the delete started from `origin` deletes suppliers."""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model is Supplier
+
+
+@receiver(pre_delete, sender=Order)
+def subtract_deleted_order(sender, instance, origin=None, **kwargs):
+    # The orders of a deleted supplier go with its rollups, in one DELETE of
+    # the cascade, rather than being subtracted one by one
+    if deletes_supplier(origin):
+        return
+    # before its line items are deleted with it
+    reporting.order_deleted(instance)
@@ -0,0 +1,98 @@
+"""
+Supplier resolution for order writes.
+
+Every order names its supplier, either nested (`supplier`: created, or
+upserted when it carries an id) or by reference (`supplier_id`).
+SupplierResolver turns these into Supplier instances with as few queries as
+possible:
+
+- suppliers are read in one query per batch, without locking, and kept for
+  the resolver's lifetime: a request, or a whole import when the `known`
+  map is shared across batches;
+- a supplier is only written when one of its fields differs, so orders
+  sent with an unchanged supplier neither update nor lock its row;
+- references are only checked to exist.
+"""
+from django.db.models import F
+from rest_framework import serializers
+
+from purchase import cache as supplier_cache
+from purchase.models import Supplier
+
+
+class SupplierResolver:
+    batch_size = 1000
+
+    def __init__(self, known=None):
+        # supplier id, or (name, email) of suppliers sent without one -> Supplier.
+        # Suppliers without an id are only matched on a map shared by the
+        # caller, as an import does; otherwise each creates a supplier.
+        self.match_new = known is not None
+        self.known = known if known is not None else {}
+
+    def resolve(self, entries):
+        """
+        Suppliers of `entries`, in order: each is either the id of an
+        existing supplier or the nested supplier data to create or update.
+        When several entries change the same supplier, the last one wins.
+        """
+        ids = {entry if isinstance(entry, int) else entry.get('id') for entry in entries}
+        existing = Supplier.objects.in_bulk(ids - self.known.keys() - {None})
+
+        missing = [entry for entry in entries if isinstance(entry, int)
+                   and entry not in self.known and entry not in existing]
+        if missing:
+            raise serializers.ValidationError({'supplier_id': [
+                f'Invalid pk "{supplier_id}" - object does not exist.' for supplier_id in missing]})
+
+        suppliers, to_create, to_update = [], [], {}
+        for entry in entries:
+            if isinstance(entry, int):
+                supplier = self.known.get(entry) or existing[entry]
+                self.known[entry] = supplier
+                suppliers.append(supplier)
+                continue
+
+            data = dict(entry)
+            supplier_id = data.pop('id', None)
+            if supplier_id:
+                key = supplier_id
+            elif self.match_new:
+                key = (data['name'], data['email'])
+            else:
+                key = None
+
+            supplier = self.known.get(key) if key is not None else None
+            if supplier is None and supplier_id in existing:
+                supplier = existing[supplier_id]
+            elif supplier is None:
+                supplier = Supplier(id=supplier_id, **data)
+                to_create.append(supplier)
+            if key is not None:
+                self.known[key] = supplier
+
+            changed = [field_name for field_name, field_value in data.items()
+                       if getattr(supplier, field_name) != field_value]
+            for field_name in changed:
+                setattr(supplier, field_name, data[field_name])
+            if changed and not supplier._state.adding:
+                to_update[supplier.pk] = supplier
+            suppliers.append(supplier)
+
+        self.write(to_create, list(to_update.values()))
+        return suppliers
+
+    def write(self, to_create, to_update):
+        Supplier.objects.bulk_create(to_create, batch_size=self.batch_size)
+        if to_update:
+            for supplier in to_update:
+                # see Supplier.version
+                supplier.version = F('version') + 1
+            Supplier.objects.bulk_update(to_update, ['name', 'email', 'version'],
+                                         batch_size=self.batch_size)
+            for supplier in to_update:
+                # Reloaded from the database on next access
+                del supplier.version
+        if to_create or to_update:
+            # bulk writes do not send the signals that keep the cache fresh
+            supplier_cache.invalidate([supplier.pk for supplier in to_create + to_update])
@@ -1,13 +1,40 @@
 # tests.py
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.db import connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.utils import OperationalError
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from rest_framework import status
-from purchase.models import Supplier, OrderNumber, Order, LineItem
-from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
+from purchase.models import Supplier, OrderNumberSequence, Order, LineItem, SupplierDailyRollup
+from purchase.models import ArchivedOrder, ArchivedLineItem
+from purchase.order_numbers import BlockOrderNumberAllocator, allocate_order_numbers, get_allocator
+from django.contrib.auth.models import Group, User
 import json
 from rest_framework.test import APITestCase
 from django.urls import reverse
-from purchase.serializers import OrderSerializer
+from purchase.serializers import LineItemSerializer, OrderSerializer
+from purchase.suppliers import SupplierResolver
+from django.utils import timezone
+from django.core.management import call_command, CommandError
+from io import StringIO
+from purchase import archive, benchmarks, cache as supplier_cache, compression, metrics, query_plans
+from purchase import reporting, routers, search
+from purchase.renderers import msgpack
 
 
 class ConsoleColors:
@@ -36,6 +63,61 @@ def pprint(response, flag=False):
                 f"{ConsoleColors.RED}Unable to decode response content as JSON:\n{content}{ConsoleColors.RESET}")
 
 
+class QueryBudgetMixin:
+    """
+    Helpers to state the maximum number of queries an endpoint may run,
+    so N+1 regressions fail the suite instead of slowing down production.
+    """
+    query_budget_sizes = (10, 100, 1000)
+
+    def create_orders(self, count, line_items_per_order=2, supplier=None):
+        """Bulk create `count` orders (bypassing the API) and return them."""
+        if supplier is None:
+            supplier = Supplier.objects.create(
+                name='Budget Supplier', email='budget@example.com')
+
+        order_numbers = allocate_order_numbers(count)
+        orders = Order.objects.bulk_create([
+            Order(supplier=supplier, order_number=order_number,
+                  order_time=timezone.now())
+            for order_number in order_numbers
+        ])
+        LineItem.objects.bulk_create([
+            LineItem(item_name=f'Item {index}', quantity=index + 1,
+                     price_without_tax=10.0, tax_name='GST 5%',
+                     tax_amount=0.5, purchase_order=order)
+            for order in orders
+            for index in range(line_items_per_order)
+        ])
+        return orders
+
+    @contextmanager
+    def assertMaxQueries(self, max_queries):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        self.assertLessEqual(
+            executed, max_queries,
+            f"{executed} queries executed, budget is {max_queries}:\n" +
+            "\n".join(query['sql'] for query in context.captured_queries))
+
+    def assertQueryBudget(self, url, max_queries):
+        with self.assertMaxQueries(max_queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def assertQueryBudgetAtSizes(self, url, max_queries, fill):
+        """
+        Check `url` against the same budget while `fill(size)` grows the
+        table to each of `query_budget_sizes` rows.
+        """
+        for size in self.query_budget_sizes:
+            fill(size)
+            with self.subTest(rows=size):
+                self.assertQueryBudget(url, max_queries)
+
+
 class SupplierAPITestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -327,14 +409,14 @@ class OrderAPITestCase(APITestCase):
             reverse('order-list'), {'supplier_name': supplier_name})
         pprint(response)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
         supplier_name = 'Test'
         response = self.client.get(
             reverse('order-list'), {'supplier_name': supplier_name})
         pprint(response)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
         supplier_name = 'Testt SSupplier'
 
@@ -342,7 +424,7 @@ class OrderAPITestCase(APITestCase):
             reverse('order-list'), {'supplier_name': supplier_name})
         pprint(response)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_filter_orders_by_item_name(self):
         # Log in the user to establish a session
@@ -354,15 +436,15 @@ class OrderAPITestCase(APITestCase):
             reverse('order-list'), {'item_name': item_name})
         pprint(response)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
-        # Test filter by item_name
+        # Test filter by item_name, matching both line items of the order
         item_name = 'Test'
         response = self.client.get(
             reverse('order-list'), {'item_name': item_name})
         pprint(response)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 1)
 
         # Test filter by item_name
         item_name = 'TRest ItMem'
@@ -370,7 +452,7 @@ class OrderAPITestCase(APITestCase):
             reverse('order-list'), {'item_name': item_name})
         pprint(response)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_filter_orders_by_supplier_and_item_name(self):
         # Log in the user to establish a session
@@ -383,7 +465,7 @@ class OrderAPITestCase(APITestCase):
             reverse('order-list'), {'supplier_name': supplier_name, 'item_name': item_name})
         pprint(response)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_update_order(self):
         # Log in the user to establish a session
@@ -481,6 +563,45 @@ class OrderAPITestCase(APITestCase):
         self.assertEqual(pre_exist_line_item.tax_amount,
                          updated_data['line_items'][0]['tax_amount'])
 
+    def test_partial_update_of_supplier(self):
+        # Log in the user to establish a session
+        self.client.login(username='testuser', password='testpassword')
+
+        other = Supplier.objects.create(name='Other Supplier', email='other@example.com')
+        line_items = list(self.order.line_items.order_by('id').values())
+
+        response = self.client.patch(reverse('order-detail', args=[self.order.id]),
+                                     {'supplier_id': other.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.supplier_id, other.id)
+        self.assertEqual(list(self.order.line_items.order_by('id').values()), line_items)
+
+    def test_order_totals_annotated(self):
+        order = Order.objects.with_totals().get(id=self.order.id)
+
+        # Annotated totals are served without touching line_items
+        with self.assertNumQueries(0):
+            self.assertEqual(order.total_quantity, 5)
+            self.assertEqual(order.total_amount, 15.5)
+            self.assertEqual(order.total_tax, 2.5)
+
+        empty_order = Order.objects.create(supplier=self.supplier)
+        empty_order = Order.objects.with_totals().get(id=empty_order.id)
+        self.assertEqual(empty_order.total_quantity, 0)
+        self.assertEqual(empty_order.total_amount, 0)
+
+    def test_order_totals_not_affected_by_item_name_filter(self):
+        # Log in the user to establish a session
+        self.client.login(username='testuser', password='testpassword')
+
+        response = self.client.get(
+            reverse('order-list'), {'item_name': 'Test Item 1'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['total_quantity'], 5)
+        self.assertEqual(response.data['results'][0]['total_amount'], 15.5)
+
     def test_delete_order_by_id(self):
         # Log in the user to establish a session
         self.client.login(username='testuser', password='testpassword')
@@ -508,10 +629,10 @@ class OrderAPITestCase(APITestCase):
         # Attempt to update the order_number field
         url = reverse('order-detail', args=[self.order.id])
 
-        # Provide a new order_number id
-        new_order_number = OrderNumber.objects.create()
-        self.order.order_number = new_order_number
+        # Provide a new order_number
+        new_order_number = self.order.order_number + 1000
         order_data = OrderSerializer(self.order).data
+        order_data['order_number'] = new_order_number
 
         response = self.client.patch(url, order_data, format='json')
 
@@ -521,3 +642,1729 @@ class OrderAPITestCase(APITestCase):
         # Optionally, check if the order_number field has been updated
         self.order.refresh_from_db()
         self.assertNotEqual(self.order.order_number, new_order_number)
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, APITestCase):
+    # session + user lookups done by the authentication middleware
+    AUTH_QUERIES = 2
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(
+            name='Budget Supplier', email='budget@example.com')
+
+    def fill_orders(self, size):
+        self.create_orders(size - Order.objects.count(), supplier=self.supplier)
+
+    def fill_suppliers(self, size):
+        Supplier.objects.bulk_create([
+            Supplier(name=f'Supplier {index}', email=f'{index}@example.com')
+            for index in range(size - Supplier.objects.count())
+        ])
+
+    def test_order_list_budget(self):
+        # orders (with totals) + line items prefetch
+        self.assertQueryBudgetAtSizes(
+            reverse('order-list'), self.AUTH_QUERIES + 2, self.fill_orders)
+
+    def test_order_detail_budget(self):
+        order = self.create_orders(1, supplier=self.supplier)[0]
+        self.assertQueryBudgetAtSizes(
+            reverse('order-detail', args=[order.id]),
+            self.AUTH_QUERIES + 2, self.fill_orders)
+
+    def test_line_item_list_budget(self):
+        self.assertQueryBudgetAtSizes(
+            reverse('lineitem-list'), self.AUTH_QUERIES + 1, self.fill_orders)
+
+    def test_line_item_detail_budget(self):
+        line_item = self.create_orders(
+            1, supplier=self.supplier)[0].line_items.first()
+        self.assertQueryBudgetAtSizes(
+            reverse('lineitem-detail', args=[line_item.id]),
+            self.AUTH_QUERIES + 1, self.fill_orders)
+
+    def test_supplier_list_budget(self):
+        self.assertQueryBudgetAtSizes(
+            reverse('supplier-list'), self.AUTH_QUERIES + 1, self.fill_suppliers)
+
+    def test_supplier_detail_budget(self):
+        self.assertQueryBudgetAtSizes(
+            reverse('supplier-detail', args=[self.supplier.id]),
+            self.AUTH_QUERIES + 1, self.fill_suppliers)
+
+    def test_user_list_budget(self):
+        group = Group.objects.create(name='buyers')
+        self.user.groups.add(group)
+
+        def fill_users(size):
+            users = User.objects.bulk_create([
+                User(username=f'user{index}')
+                for index in range(User.objects.count(), size)
+            ])
+            group.user_set.add(*users)
+
+        # users + groups prefetch
+        self.assertQueryBudgetAtSizes(
+            reverse('user-list'), self.AUTH_QUERIES + 2, fill_users)
+
+
+class KeysetPaginationTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(
+            name='Test Supplier', email='test@example.com')
+
+        # Several orders share an order_time so the id tie-breaker matters
+        self.orders = self.create_orders(7, supplier=self.supplier)
+        Order.objects.filter(id__in=[order.id for order in self.orders[:4]]).update(
+            order_time=timezone.now() - timedelta(days=1))
+
+    def collect_pages(self, url, key='next'):
+        ids, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            queries.extend(query['sql'] for query in context.captured_queries)
+            url = response.data[key]
+        return ids, queries
+
+    def test_order_pages_follow_meta_ordering(self):
+        ids, queries = self.collect_pages(
+            reverse('order-list') + '?page_size=2')
+
+        expected = list(Order.objects.order_by('-order_time', 'id')
+                        .values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+        for sql in queries:
+            self.assertNotIn('COUNT(', sql.upper())
+            self.assertNotIn('OFFSET', sql.upper())
+
+    def test_previous_link_walks_back(self):
+        url = reverse('order-list') + '?page_size=3'
+        first = self.client.get(url).data
+        second = self.client.get(first['next']).data
+        third = self.client.get(second['next']).data
+        self.assertIsNone(third['next'])
+
+        back = self.client.get(third['previous']).data
+        self.assertEqual(back['results'], second['results'])
+        back = self.client.get(back['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_supplier_and_line_item_pages(self):
+        Supplier.objects.create(name='Test Supplier', email='dup@example.com')
+        ids, _ = self.collect_pages(reverse('supplier-list') + '?page_size=1')
+        self.assertEqual(ids, list(Supplier.objects.order_by('name', 'id')
+                                   .values_list('id', flat=True)))
+
+        ids, _ = self.collect_pages(reverse('lineitem-list') + '?page_size=4')
+        self.assertEqual(ids, list(LineItem.objects.order_by('item_name', 'quantity', 'id')
+                                   .values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('order-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # {"p":[null,1,2]}: a position value cannot be null
+        response = self.client.get(reverse('lineitem-list'), {'cursor': 'eyJwIjpbbnVsbCwxLDJdfQ=='})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BulkOrderAPITestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(
+            name='Test Supplier', email='test@example.com')
+
+    def order_payload(self, index, supplier=None):
+        return {
+            "supplier": supplier or {
+                "name": f"supplier {index}",
+                "email": f"supplier{index}@email.com",
+            },
+            "line_items": [
+                {
+                    "item_name": f"prod {index}-{line}",
+                    "quantity": line + 1,
+                    "price_without_tax": 10.00,
+                    "tax_name": "GST 5%",
+                    "tax_amount": 0.50
+                }
+                for line in range(3)
+            ]
+        }
+
+    def test_bulk_create_orders(self):
+        data = [self.order_payload(index) for index in range(200)]
+        data.append(self.order_payload(200, supplier={
+            "id": self.supplier.id,
+            "name": "Renamed Supplier",
+            "email": "renamed@example.com",
+        }))
+
+        # auth, savepoint, supplier lookup/update, order number block
+        # reservation, the batched inserts (SQLite's 999 parameters limit
+        # splits the 603 line items in 4) and the reporting rollups: lookup
+        # and inserts of the 201 cells, in a savepoint
+        with self.assertMaxQueries(21):
+            response = self.client.post(
+                reverse('order-bulk'), data, format='json')
+        pprint(response)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(len(response.data), 201)
+        self.assertEqual(Order.objects.count(), 201)
+        self.assertEqual(LineItem.objects.count(), 603)
+
+        order = Order.objects.get(id=response.data[5]['id'])
+        self.assertEqual(order.order_number, response.data[5]['order_number'])
+        self.assertEqual(order.supplier.name, 'supplier 5')
+        self.assertEqual(order.total_quantity, 6)
+
+        self.supplier.refresh_from_db()
+        self.assertEqual(self.supplier.name, 'Renamed Supplier')
+        self.assertEqual(
+            Order.objects.get(id=response.data[200]['id']).supplier, self.supplier)
+
+    def test_bulk_create_reports_errors_per_order(self):
+        data = [self.order_payload(index) for index in range(3)]
+        del data[1]['supplier']
+        data[2]['line_items'][0]['quantity'] = -1
+
+        response = self.client.post(reverse('order-bulk'), data, format='json')
+        pprint(response)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(response.data[0], {})
+        self.assertIn('supplier', response.data[1])
+        self.assertIn('line_items', response.data[2])
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class SupplierResolutionTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(
+            name='Test Supplier', email='test@example.com')
+        self.order, = self.create_orders(1, supplier=self.supplier)
+
+    def payload(self, **supplier):
+        return {
+            **supplier,
+            "line_items": [{"item_name": "prod", "quantity": 1, "price_without_tax": 10.0,
+                            "tax_name": "GST 5%", "tax_amount": 0.5}],
+        }
+
+    def supplier_writes(self, context):
+        return [query['sql'] for query in context.captured_queries
+                if '"purchase_supplier"' in query['sql']
+                and (not query['sql'].startswith('SELECT') or 'FOR UPDATE' in query['sql'])]
+
+    def test_unchanged_supplier_is_not_written(self):
+        supplier = {"id": self.supplier.id, "name": self.supplier.name,
+                    "email": self.supplier.email}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse('order-list'), self.payload(supplier=supplier), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.supplier_writes(context), [])
+        self.assertEqual(Supplier.objects.count(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.version, 1)
+
+        supplier['name'] = 'Renamed Supplier'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.put(reverse('order-detail', args=[self.order.id]),
+                                       self.payload(supplier=supplier), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.supplier_writes(context)), 1)
+        self.assertEqual(response.data['supplier']['name'], 'Renamed Supplier')
+        self.order.refresh_from_db()
+        self.assertGreater(self.order.version, 1)
+
+    def test_reference_supplier_by_id(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse('order-list'), self.payload(supplier_id=self.supplier.id), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.supplier_writes(context), [])
+        self.assertEqual(response.data['supplier'], {
+            'id': self.supplier.id, 'name': 'Test Supplier', 'email': 'test@example.com'})
+        self.assertNotIn('supplier_id', response.data)
+
+        response = self.client.post(
+            reverse('order-bulk'),
+            [self.payload(supplier_id=self.supplier.id) for _ in range(3)] +
+            [self.payload(supplier={"name": "New Supplier", "email": "new@example.com"})],
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.filter(supplier=self.supplier).count(), 5)
+
+        response = self.client.post(
+            reverse('order-list'), self.payload(supplier_id=self.supplier.id + 100), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('supplier_id', response.data)
+        response = self.client.post(reverse('order-list'), self.payload(
+            supplier_id=self.supplier.id, supplier={"name": "Other", "email": "other@example.com"}),
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('supplier_id', response.data)
+        self.assertEqual(Order.objects.count(), 6)
+
+
+class OrderLineItemReconciliationTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(
+            name='Test Supplier', email='test@example.com')
+        self.order, self.other_order = self.create_orders(
+            2, line_items_per_order=500, supplier=self.supplier)
+        self.url = reverse('order-detail', args=[self.order.id])
+
+    def payload(self, line_items):
+        return {
+            "supplier": {
+                "id": self.supplier.id,
+                "name": self.supplier.name,
+                "email": self.supplier.email,
+            },
+            "line_items": line_items,
+        }
+
+    def line_items_data(self):
+        return [{key: value for key, value in item.items() if key != 'line_total'}
+                for item in self.client.get(self.url).data['line_items']]
+
+    def test_update_large_order_in_constant_queries(self):
+        line_items = self.line_items_data()
+        # change 100 items, drop 100, keep the rest untouched and add 50
+        for item in line_items[:100]:
+            item['quantity'] += 10
+        kept = line_items[:400]
+        added = [{"item_name": f"New {index}", "quantity": 1, "price_without_tax": 1.0,
+                  "tax_name": "VAT", "tax_amount": 0.1} for index in range(50)]
+
+        with self.assertMaxQueries(20):
+            response = self.client.put(
+                self.url, self.payload(kept + added), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.order.line_items.count(), 450)
+        self.assertEqual(len(response.data['line_items']), 450)
+        self.assertEqual(
+            LineItem.objects.get(id=line_items[0]['id']).quantity,
+            line_items[0]['quantity'])
+        self.assertFalse(LineItem.objects.filter(id=line_items[450]['id']).exists())
+        self.assertEqual(self.other_order.line_items.count(), 500)
+
+    def test_unchanged_line_items_are_not_written(self):
+        line_items = self.line_items_data()
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.put(
+                self.url, self.payload(line_items), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        writes = [query['sql'] for query in context.captured_queries
+                  if 'purchase_lineitem' in query['sql']
+                  and not query['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+
+    def test_reject_line_item_of_another_order(self):
+        foreign = self.other_order.line_items.first()
+        line_items = self.line_items_data()
+        line_items[0]['id'] = foreign.id
+
+        response = self.client.put(self.url, self.payload(line_items), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('line_items', response.data)
+
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.purchase_order, self.other_order)
+        self.assertEqual(self.order.line_items.count(), 500)
+
+
+class OrderNumberAllocatorTestCase(TestCase):
+    def setUp(self):
+        self.supplier = Supplier.objects.create(
+            name='Test Supplier', email='test@example.com')
+
+    def test_blocks_are_unique_across_workers(self):
+        # Two allocators stand for two worker processes
+        first = BlockOrderNumberAllocator(block_size=10)
+        second = BlockOrderNumberAllocator(block_size=10)
+
+        numbers = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(15):
+                numbers += first.allocate() + second.allocate(2)
+        self.assertEqual(len(numbers), len(set(numbers)))
+
+    def test_numbers_served_from_memory(self):
+        allocator = BlockOrderNumberAllocator(block_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            allocator.allocate()
+
+        with self.assertNumQueries(0):
+            numbers = allocator.allocate(9)
+        self.assertEqual(len(set(numbers)), 9)
+
+    def test_rolled_back_block_is_not_reused(self):
+        allocator = BlockOrderNumberAllocator(block_size=10)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            first = allocator.allocate()[0]
+        # the transaction never commits: the rest of the block is dropped
+        self.assertEqual(len(callbacks), 1)
+
+        second = allocator.allocate()[0]
+        self.assertGreater(second, first + 10)
+
+    def test_order_creation_does_not_insert_order_numbers(self):
+        with self.settings(ORDER_NUMBER_ALLOCATOR={
+                'BACKEND': 'purchase.order_numbers.BlockOrderNumberAllocator'}):
+            with self.captureOnCommitCallbacks(execute=True):
+                Order.objects.create(supplier=self.supplier)
+            # the order, and its count in the reporting rollups
+            with self.assertNumQueries(2):
+                order = Order.objects.create(supplier=self.supplier)
+
+        self.assertIsNotNone(order.order_number)
+
+    def test_sequence_is_recreated_after_numbers_in_use(self):
+        order = Order.objects.create(supplier=self.supplier)
+        OrderNumberSequence.objects.all().delete()
+
+        number = BlockOrderNumberAllocator(block_size=10).allocate()[0]
+        self.assertEqual(number, order.order_number + 1)
+
+    def test_sequence_is_recreated_after_archived_numbers(self):
+        order = Order.objects.create(supplier=self.supplier)
+        archived = ArchivedOrder.objects.create(
+            id=order.id + 1, supplier=self.supplier, order_time=order.order_time,
+            order_number=order.order_number + 50)
+        OrderNumberSequence.objects.all().delete()
+
+        number = BlockOrderNumberAllocator(block_size=10).allocate()[0]
+        self.assertEqual(number, archived.order_number + 1)
+
+
+class OrderSearchIndexTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(
+            name='Acme Widgets', email='acme@example.com')
+        self.order = self.create_orders(1, supplier=self.supplier)[0]
+
+    def search(self, **params):
+        response = self.client.get(reverse('order-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [order['id'] for order in response.data['results']]
+
+    def test_search_uses_index(self):
+        self.assertTrue(search.is_available('default'))
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.search(item_name='item'), [self.order.id])
+        self.assertTrue(any('purchase_lineitem_fts' in query['sql']
+                            for query in context.captured_queries))
+
+        self.assertEqual(self.search(supplier_name='widget'), [self.order.id])
+        self.assertEqual(self.search(supplier_name='Acme Gadgets'), [])
+        # shorter than a trigram: falls back to icontains
+        self.assertEqual(self.search(item_name='m 1'), [self.order.id])
+        self.assertEqual(self.search(item_name='1'), [self.order.id])
+
+    def test_index_follows_writes(self):
+        self.supplier.name = 'Globex'
+        self.supplier.save()
+        self.assertEqual(self.search(supplier_name='acme'), [])
+        self.assertEqual(self.search(supplier_name='globex'), [self.order.id])
+
+        self.order.line_items.update(item_name='Sprocket')
+        self.assertEqual(self.search(item_name='sprocket'), [self.order.id])
+
+        other = self.create_orders(1, supplier=self.supplier)[0]
+        self.assertEqual(self.search(item_name='item'), [other.id])
+
+        self.order.delete()
+        self.assertEqual(self.search(item_name='sprocket'), [])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM purchase_lineitem_fts")
+        self.assertEqual(self.search(item_name='item'), [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search(item_name='item'), [self.order.id])
+
+    def test_missing_triggers(self):
+        # as after a migration remaking purchase_lineitem
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER purchase_lineitem_fts_au")
+        search._available.clear()
+        self.assertFalse(search.is_available('default'))
+        self.order.line_items.update(item_name='Sprocket')
+        self.assertEqual(self.search(item_name='sprocket'), [self.order.id])
+
+        search.repair_index(sender=apps.get_app_config('purchase'), using='default')
+        self.assertTrue(search.is_available('default'))
+        self.assertEqual(self.search(item_name='sprocket'), [self.order.id])
+        self.assertEqual(self.search(item_name='item'), [])
+
+
+class OrderExportTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(
+            name='Test Supplier', email='test@example.com')
+        self.orders = self.create_orders(5, supplier=self.supplier)
+        self.old_order = self.orders[0]
+        Order.objects.filter(id=self.old_order.id).update(
+            order_time=timezone.now() - timedelta(days=30))
+
+    def export(self, **params):
+        response = self.client.get(reverse('order-export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        lines = self.export().splitlines()
+        self.assertEqual(len(lines), 5)
+
+        listed = self.client.get(reverse('order-list')).data['results']
+        self.assertEqual([json.loads(line) for line in lines],
+                         json.loads(json.dumps(listed)))
+
+    def test_export_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export(export_format='csv'))))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0]['supplier_name'], 'Test Supplier')
+        self.assertEqual(float(rows[0]['total_amount']), 21.0)
+
+    def test_export_filters(self):
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        lines = self.export(order_time_after=since).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertNotIn(self.old_order.id, [json.loads(line)['id'] for line in lines])
+
+        self.assertEqual(self.export(supplier_name='nobody'), '')
+
+        response = self.client.get(reverse('order-export'), {'export_format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_command(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.csv') as output:
+            call_command('export_orders', format='csv', output=output.name,
+                         until=(timezone.now() - timedelta(days=1)).isoformat(),
+                         stderr=StringIO())
+            rows = list(csv.DictReader(output))
+        self.assertEqual({row['order_id'] for row in rows}, {str(self.old_order.id)})
+
+
+class ImportOrdersTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.supplier = Supplier.objects.create(
+            name='Test Supplier', email='test@example.com')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return f'{self.directory.name}/{name}'
+
+    def export_and_reset(self, export_format):
+        self.create_orders(5, supplier=self.supplier)
+        expected = sorted((order.total_quantity, order.order_time)
+                          for order in Order.objects.with_totals())
+        path = self.path(f'orders.{export_format}')
+        call_command('export_orders', format=export_format, output=path, stderr=StringIO())
+        Order.objects.all().delete()
+        return path, expected
+
+    def test_roundtrip_ndjson(self):
+        path, expected = self.export_and_reset('ndjson')
+        call_command('import_orders', path, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(sorted((order.total_quantity, order.order_time)
+                                for order in Order.objects.with_totals()), expected)
+        self.assertEqual(LineItem.objects.count(), 10)
+        # suppliers are resolved, not duplicated
+        self.assertEqual(Supplier.objects.count(), 1)
+
+    def test_roundtrip_csv(self):
+        path, expected = self.export_and_reset('csv')
+        call_command('import_orders', path, batch_size=3, stdout=StringIO())
+
+        self.assertEqual(sorted((order.total_quantity, order.order_time)
+                                for order in Order.objects.with_totals()), expected)
+        self.assertEqual(Supplier.objects.count(), 1)
+
+    def test_resume_after_failure(self):
+        records = [{
+            "supplier": {"name": "New Supplier", "email": "new@example.com"},
+            "line_items": [{"item_name": f"prod {index}", "quantity": 1,
+                            "price_without_tax": 1.0, "tax_name": "VAT", "tax_amount": 0.1}],
+        } for index in range(5)]
+        records[3]['line_items'][0]['quantity'] = -1
+        path = self.path('orders.ndjson')
+        with open(path, 'w') as source:
+            source.writelines(json.dumps(record) + '\n' for record in records)
+
+        with self.assertRaises(CommandError):
+            call_command('import_orders', path, batch_size=2, stop_on_error=True,
+                         stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 2)
+
+        stderr = StringIO()
+        call_command('import_orders', path, batch_size=2, resume=True,
+                     stdout=StringIO(), stderr=stderr)
+        self.assertIn('Record', stderr.getvalue())
+        self.assertEqual(
+            sorted(LineItem.objects.values_list('item_name', flat=True)),
+            ['prod 0', 'prod 1', 'prod 2', 'prod 4'])
+
+
+class PopulateDataTestCase(TestCase):
+    options = dict(suppliers=20, orders=300, items_per_order=4, items_distribution='poisson',
+                   item_names=50, supplier_skew=1.2, seed=7, batch_size=128)
+
+    def snapshot(self):
+        return (
+            list(Order.objects.order_by('id').values_list('supplier__name', 'order_time')),
+            list(LineItem.objects.order_by('id').values_list(
+                'purchase_order__order_time', 'item_name', 'quantity',
+                'price_without_tax', 'tax_name', 'tax_amount')),
+        )
+
+    def test_same_seed_same_dataset(self):
+        call_command('populate_data', stdout=StringIO(), **self.options)
+        orders, line_items = self.snapshot()
+        self.assertEqual(len(orders), 300)
+        self.assertEqual(len({name for name, in LineItem.objects.values_list('item_name')}), 50)
+        self.assertLess(min(time for _, time in orders), max(time for _, time in orders))
+        # poisson around the mean, at least one line item per order
+        self.assertAlmostEqual(len(line_items) / len(orders), 4, delta=0.5)
+        self.assertFalse(Order.objects.filter(line_items__isnull=True).exists())
+
+        Supplier.objects.all().delete()
+        call_command('populate_data', stdout=StringIO(), **self.options)
+        self.assertEqual(self.snapshot(), (orders, line_items))
+
+        call_command('populate_data', stdout=StringIO(), **dict(self.options, seed=8))
+        self.assertNotEqual(self.snapshot()[1][-len(line_items):], line_items)
+
+    def test_search_index_is_rebuilt(self):
+        call_command('populate_data', stdout=StringIO(), **self.options)
+        self.assertTrue(search.is_available('default'))
+        item_name = LineItem.objects.values_list('item_name', flat=True).first()
+        self.assertEqual(
+            set(search.filter_item_name(Order.objects.all(), item_name)),
+            set(Order.objects.filter(line_items__item_name=item_name)))
+
+
+class BenchmarkTestCase(TestCase):
+    def test_run_and_compare(self):
+        results = benchmarks.run_benchmarks([20], repeat=2, warmup=0)
+        self.assertEqual([result['name'] for result in results['results']],
+                         list(benchmarks.BENCHMARKS))
+        by_name = {result['name']: result for result in results['results']}
+        self.assertGreater(by_name['view.order_list']['queries'], 0)
+        self.assertGreater(by_name['serializer.to_representation']['peak_kib'], 0)
+        # writes are rolled back
+        self.assertEqual(Order.objects.count(), 20)
+
+        self.assertEqual(benchmarks.compare(results, results), [])
+        baseline = json.loads(json.dumps(results))
+        baseline['results'][0]['p50_ms'] /= 2
+        baseline['results'][1]['queries'] -= 1
+        regressions = benchmarks.compare(results, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('p50_ms', regressions[0])
+        self.assertIn('queries', regressions[1])
+
+    def test_list_command(self):
+        stdout = StringIO()
+        call_command('benchmark', list=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue().split(), list(benchmarks.BENCHMARKS))
+
+
+class LoadTestTestCase(TransactionTestCase):
+    def test_sync_and_async_views(self):
+        # other threads only see committed data, hence a TransactionTestCase
+        results = benchmarks.load_test(20, concurrency=3, requests=6, threads=2, db_latency=0.001)
+        self.assertEqual([(result['name'], result['mode']) for result in results['results']], [
+            ('load.order_list', 'sync'), ('load.order_list', 'async'),
+            ('load.order_detail', 'sync'), ('load.order_detail', 'async')])
+        for result in results['results']:
+            self.assertEqual(result['requests'], 6)
+            self.assertGreater(result['rps'], 0)
+
+
+class MetricsTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.enterContext(self.settings(METRICS={'DIRECTORY': self.directory.name}))
+        self.addCleanup(self.directory.cleanup)
+        metrics.registry.reset()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.orders = self.create_orders(3)
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                    if not line.startswith('#'))
+
+    def test_metrics_per_view_and_status(self):
+        self.client.get(reverse('order-list'))
+        self.client.get(reverse('order-list'))
+        self.client.get(reverse('order-detail', args=[self.orders[0].id]))
+        self.client.get(reverse('order-detail', args=[0]))
+
+        samples = self.scrape()
+        order_list = 'view="order-list",method="GET",status="200"'
+        self.assertEqual(samples[f'eshop_http_request_duration_seconds_count{{{order_list}}}'], '2')
+        self.assertEqual(samples[f'eshop_http_request_duration_seconds_bucket{{{order_list},le="+Inf"}}'], '2')
+        self.assertEqual(
+            samples['eshop_http_request_duration_seconds_count'
+                    '{view="order-detail",method="GET",status="404"}'], '1')
+        self.assertGreater(float(samples[f'eshop_sql_queries_total{{{order_list}}}']), 0)
+        self.assertGreater(float(samples[f'eshop_http_response_size_bytes_sum{{{order_list}}}']), 0)
+        # the scrape itself is not recorded
+        self.assertFalse(any('view="metrics"' in sample for sample in samples))
+
+    def test_streaming_responses_and_other_workers(self):
+        response = self.client.get(reverse('order-export'), {'export_format': 'csv'})
+        size = len(b''.join(response.streaming_content))
+
+        # another worker process
+        labels = ['order-list', 'GET', '200']
+        with open(os.path.join(self.directory.name, '1.json'), 'w') as other:
+            json.dump({'counters': [['eshop_sql_queries_total', labels, 5]],
+                       'histograms': []}, other)
+        self.client.get(reverse('order-list'))
+
+        samples = self.scrape()
+        export_labels = 'view="order-export",method="GET",status="200"'
+        self.assertEqual(float(samples[f'eshop_http_response_size_bytes_sum{{{export_labels}}}']), size)
+        self.assertGreater(float(samples[f'eshop_sql_queries_total{{{export_labels}}}']), 0)
+        self.assertGreater(
+            float(samples['eshop_sql_queries_total{view="order-list",method="GET",status="200"}']), 5)
+
+
+    def test_async_views(self):
+        self.async_client.force_login(self.user)
+        # the async views look the search index up once per process
+        search.is_available('default')
+        self.client.get(reverse('order-list'))
+        response = async_to_sync(self.async_client.get)(reverse('async-order-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        samples = self.scrape()
+        labels = 'view="async-order-list",method="GET",status="200"'
+        self.assertEqual(samples[f'eshop_http_request_duration_seconds_count{{{labels}}}'], '1')
+        # counted although the async ORM runs them in another thread
+        self.assertEqual(samples[f'eshop_sql_queries_total{{{labels}}}'],
+                         samples['eshop_sql_queries_total{view="order-list",method="GET",status="200"}'])
+
+    def test_scrape_access(self):
+        remote = {'REMOTE_ADDR': '203.0.113.7'}
+        self.assertEqual(self.client.get('/metrics', **remote).status_code, status.HTTP_403_FORBIDDEN)
+
+        with self.settings(METRICS={'DIRECTORY': self.directory.name, 'ALLOWED_IPS': ['203.0.113.0/24']}):
+            self.assertEqual(self.client.get('/metrics', **remote).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+
+        with self.settings(METRICS={'DIRECTORY': self.directory.name, 'TOKEN': 's3cret'}):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret',
+                                             **remote).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other',
+                                             **remote).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class OrderRepresentationTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        supplier = Supplier.objects.create(name='Fournisseur «Ünïcode»', email='u@example.com')
+        self.create_orders(3, line_items_per_order=4, supplier=supplier)
+        self.create_orders(2, line_items_per_order=0)
+        LineItem.objects.filter(quantity=2).update(price_without_tax=0.1, tax_amount=0.2)
+
+    def assertRendersAs(self, url, data):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, JSONRenderer().render(data))
+
+    def test_orders_match_serializer(self):
+        expected = OrderSerializer(Order.objects.for_serialization(), many=True).data
+        self.assertRendersAs(reverse('order-list'),
+                             {'next': None, 'previous': None, 'results': expected})
+        for order in expected:
+            self.assertRendersAs(reverse('order-detail', args=[order['id']]), order)
+
+        response = self.client.get(reverse('order-detail', args=[0]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_line_items_match_serializer(self):
+        expected = LineItemSerializer(LineItem.objects.all(), many=True).data
+        self.assertRendersAs(reverse('lineitem-list'),
+                             {'next': None, 'previous': None, 'results': expected})
+        for line_item in expected[:3]:
+            self.assertRendersAs(reverse('lineitem-detail', args=[line_item['id']]), line_item)
+
+    def test_sparse_fieldsets(self):
+        full = {order['id']: order for order in self.client.get(reverse('order-list')).data['results']}
+        url = reverse('order-list') + '?fields=id,order_number,supplier,total_amount'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for order in response.data['results']:
+            expected = full[order['id']]
+            self.assertEqual(order, {'id': expected['id'], 'supplier': expected['supplier']['id'],
+                                     'order_number': expected['order_number'],
+                                     'total_amount': expected['total_amount']})
+        # no supplier join, line items query nor other totals
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('purchase_supplier', sql)
+        self.assertNotIn('_total_quantity', sql)
+        self.assertFalse(any(query['sql'].startswith('SELECT "purchase_lineitem"')
+                             for query in context.captured_queries))
+
+        order_id = next(iter(full))
+        response = self.client.get(
+            reverse('order-detail', args=[order_id]) + '?fields=id,line_items&expand=supplier')
+        self.assertEqual(response.data, {
+            'id': order_id, 'supplier': full[order_id]['supplier'],
+            'line_items': [line_item['id'] for line_item in full[order_id]['line_items']]})
+        response = self.client.get(reverse('order-list') + '?expand=line_items')
+        for order in response.data['results']:
+            self.assertEqual(order, {**full[order['id']], 'supplier': full[order['id']]['supplier']['id']})
+
+        response = self.client.get(reverse('lineitem-list') + '?fields=id,line_total')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'line_total'})
+        supplier_id = full[order_id]['supplier']['id']
+        response = self.client.get(reverse('supplier-detail', args=[supplier_id]) + '?fields=name')
+        self.assertEqual(response.data, {'name': full[order_id]['supplier']['name']})
+        response = self.client.get(reverse('supplier-list') + '?fields=id')
+        self.assertEqual(set(response.data['results'][0]), {'id'})
+
+        for url in (reverse('order-list') + '?fields=id,unknown',
+                    reverse('order-list') + '?expand=order_number',
+                    reverse('supplier-list') + '?expand=name'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, url)
+
+
+@skipUnless(msgpack, 'msgpack is not installed')
+class MessagePackTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.orders = self.create_orders(3)
+        LineItem.objects.update(price_without_tax=0.1, tax_amount=1 / 3)
+
+    def get(self, url):
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        return msgpack.unpackb(response.content)
+
+    def test_responses(self):
+        for url in (reverse('order-list'), reverse('order-detail', args=[self.orders[0].id]),
+                    reverse('supplier-list'), reverse('lineitem-list'),
+                    reverse('async-order-list'), reverse('order-list') + '?fields=id,line_items'):
+            # floats round-trip exactly
+            self.assertEqual(self.get(url), json.loads(self.client.get(url).content), url)
+        self.assertEqual(self.get(reverse('order-list') + '?format=msgpack')['results'][0]['id'],
+                         self.client.get(reverse('order-list')).data['results'][0]['id'])
+
+    def test_requests(self):
+        payload = [{
+            'supplier_id': self.orders[0].supplier_id,
+            'line_items': [{'item_name': 'prod', 'quantity': 2, 'price_without_tax': 0.1,
+                            'tax_name': 'GST 5%', 'tax_amount': 1 / 3}],
+        }] * 2
+        response = self.client.post(reverse('order-bulk'), msgpack.packb(payload),
+                                    content_type='application/msgpack',
+                                    HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(msgpack.unpackb(response.content)), 2)
+        self.assertEqual(LineItem.objects.filter(item_name='prod', tax_amount=1 / 3).count(), 2)
+
+        response = self.client.post(reverse('order-list'), b'\xc1',
+                                    content_type='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('MessagePack parse error', response.data['detail'])
+
+
+class CompressionTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.orders = self.create_orders(5)
+
+    def get(self, url, codec):
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING=codec)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], codec)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        return response
+
+    def test_gzip(self):
+        url = reverse('order-list')
+        plain = self.client.get(url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        response = self.get(url, 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], plain['ETag'])
+
+        # small responses are sent as they are
+        response = self.client.get(url + '?page_size=1&fields=id', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_not_compressed(self):
+        # the browsable API, see BREACH
+        response = self.client.get(reverse('order-list'), HTTP_ACCEPT='text/html',
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertGreater(len(response.content), 1024)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = HttpResponse(b'x' * 2048, content_type='application/json')
+        self.assertTrue(compression.compressible(response))
+        response['Cache-Control'] = 'max-age=60, No-Transform'
+        self.assertFalse(compression.compressible(response))
+
+    def test_export_stream(self):
+        response = self.client.get(reverse('order-export'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual(len(body.splitlines()), 5)
+
+    def test_cached(self):
+        url = reverse('order-list')
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            first = self.get(url, 'gzip')
+            second = self.get(url, 'gzip')
+            self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first.content, second.content)
+
+        # content changed, compressed again
+        Order.objects.filter(id=self.orders[0].id).update(order_number=987654321)
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            self.assertIn(b'987654321', gzip.decompress(self.get(url, 'gzip').content))
+            self.assertEqual(compress.call_count, 1)
+
+    @skipUnless(compression.brotli and compression.zstandard, 'brotli or zstandard is not installed')
+    def test_codecs(self):
+        url = reverse('order-list')
+        plain = self.client.get(url).content
+        self.assertEqual(compression.brotli.decompress(self.get(url, 'br').content), plain)
+        response = self.get(url, 'zstd')
+        self.assertEqual(compression.zstandard.ZstdDecompressor().decompressobj()
+                         .decompress(response.content), plain)
+
+    def test_choose_codec(self):
+        with override_settings(COMPRESSION={'CODECS': ['zstd', 'br', 'gzip']}):
+            self.assertEqual(compression.choose_codec('gzip, deflate'), 'gzip')
+            self.assertIsNone(compression.choose_codec('identity'))
+            self.assertIsNone(compression.choose_codec('gzip;q=0'))
+            self.assertIsNone(compression.choose_codec(''))
+        with override_settings(COMPRESSION={'CODECS': ['gzip']}):
+            self.assertEqual(compression.choose_codec('*'), 'gzip')
+            self.assertEqual(compression.choose_codec('br, gzip;q=0.5'), 'gzip')
+            self.assertIsNone(compression.choose_codec('*;q=0'))
+
+
+class SupplierCacheTestCase(QueryBudgetMixin, APITestCase):
+    AUTH_QUERIES = 2
+
+    def setUp(self):
+        supplier_cache.get_cache().clear()
+        supplier_cache.local_representations.clear()
+        # written by earlier tests, whose transactions were rolled back
+        supplier_cache.pending_ids().clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.supplier = Supplier.objects.create(name='Cached Supplier', email='cached@example.com')
+        self.url = reverse('supplier-detail', args=[self.supplier.id])
+
+    def rename(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'name': name}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_is_cached_and_invalidated(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(self.AUTH_QUERIES):
+            self.assertEqual(self.client.get(self.url).data['name'], 'Cached Supplier')
+
+        self.rename('Renamed Supplier')
+        self.assertEqual(self.client.get(self.url).data['name'], 'Renamed Supplier')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(self.url)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_is_cached_and_invalidated(self):
+        url = reverse('supplier-list')
+        self.client.get(url)
+        with self.assertNumQueries(self.AUTH_QUERIES):
+            self.assertEqual(self.client.get(url).data['results'][0]['name'], 'Cached Supplier')
+
+        # bulk order creation updates suppliers without signals
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('order-bulk'), [{
+                'supplier': {'id': self.supplier.id, 'name': 'Bulk Supplier', 'email': 'cached@example.com'},
+                'line_items': [],
+            }], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.get(url).data['results'][0]['name'], 'Bulk Supplier')
+        self.assertEqual(self.client.get(self.url).data['name'], 'Bulk Supplier')
+
+    def test_uncommitted_writes_are_not_cached(self):
+        self.client.get(self.url)
+        with transaction.atomic():
+            supplier = Supplier.objects.get(id=self.supplier.id)
+            supplier.name = 'Rolled Back'
+            supplier.save()
+            self.assertEqual(self.client.get(self.url).data['name'], 'Rolled Back')
+            transaction.set_rollback(True)
+        self.assertEqual(self.client.get(self.url).data['name'], 'Cached Supplier')
+
+    def test_orders_use_cached_supplier(self):
+        self.create_orders(3, supplier=self.supplier)
+        supplier_cache.local_representations.set(
+            (supplier_cache.generation(), self.supplier.id), {'id': self.supplier.id, 'name': 'From Cache'})
+        response = self.client.get(reverse('order-list'))
+        self.assertEqual({order['supplier']['name'] for order in response.data['results']},
+                         {'From Cache'})
+        order_id = response.data['results'][0]['id']
+        self.assertEqual(self.client.get(reverse('order-detail', args=[order_id]))
+                         .data['supplier']['name'], 'From Cache')
+
+        self.rename('Renamed Supplier')
+        response = self.client.get(reverse('order-list'))
+        self.assertEqual({order['supplier']['name'] for order in response.data['results']},
+                         {'Renamed Supplier'})
+
+
+    def test_write_between_read_and_cache_fill(self):
+        self.create_orders(1, supplier=self.supplier)
+        fill = supplier_cache.representations
+        names = iter(['First Rename', 'Second Rename'])
+
+        def write_then_fill(*args):
+            # a supplier write commits after the suppliers were read
+            with self.captureOnCommitCallbacks(execute=True):
+                supplier = Supplier.objects.get(id=self.supplier.id)
+                supplier.name = next(names)
+                supplier.save()
+            return fill(*args)
+
+        order_list = reverse('order-list')
+        for url, name in ((order_list, 'First Rename'), (self.url, 'Second Rename')):
+            supplier_cache.local_representations.clear()
+            with mock.patch.object(supplier_cache, 'representations', write_then_fill):
+                self.client.get(url)
+            # what was read before the write is not cached
+            self.assertEqual(self.client.get(self.url).data['name'], name)
+            self.assertEqual(self.client.get(order_list).data['results'][0]['supplier']['name'], name)
+
+class OrderETagTestCase(QueryBudgetMixin, APITestCase):
+    AUTH_QUERIES = 2
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.order = self.create_orders(3)[0]
+        self.url = reverse('order-detail', args=[self.order.id])
+
+    def assertNotModified(self, url, etag, max_queries, if_none_match=None):
+        with self.assertMaxQueries(max_queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=if_none_match or etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(response.data['version'], 1)
+        # one query on the order's version, no line items, no serialization
+        self.assertNotModified(self.url, etag, self.AUTH_QUERIES + 1)
+        self.assertNotModified(self.url, etag, self.AUTH_QUERIES + 1,
+                               if_none_match=f'"other", {etag}')
+
+    def test_detail_version_follows_changes(self):
+        etag = self.client.get(self.url)['ETag']
+        line_item = self.order.line_items.first()
+
+        self.client.patch(reverse('lineitem-detail', args=[line_item.id]),
+                          {'quantity': 42}, format='json')
+        etag = self.assertModified(self.url, etag)
+
+        other_order = self.create_orders(1, supplier=self.order.supplier)[0]
+        self.client.patch(reverse('lineitem-detail', args=[line_item.id]),
+                          {'purchase_order': other_order.id}, format='json')
+        etag = self.assertModified(self.url, etag)
+        self.assertEqual(Order.objects.get(id=other_order.id).version, 2)
+
+        self.client.delete(reverse('lineitem-detail', args=[line_item.id]))
+        self.assertEqual(Order.objects.get(id=other_order.id).version, 3)
+
+        self.client.patch(reverse('supplier-detail', args=[self.order.supplier_id]),
+                          {'name': 'Renamed Supplier'}, format='json')
+        etag = self.assertModified(self.url, etag)
+        # the supplier's own version changed, not its orders'
+        self.assertEqual(Order.objects.get(id=self.order.id).version, 3)
+        self.assertEqual(Supplier.objects.get(id=self.order.supplier_id).version, 2)
+        # saving a supplier without changes leaves its orders alone
+        self.client.patch(reverse('supplier-detail', args=[self.order.supplier_id]),
+                          {'name': 'Renamed Supplier'}, format='json')
+        self.assertNotModified(self.url, etag, self.AUTH_QUERIES + 1)
+
+        response = self.client.get(self.url)
+        data = {'supplier': response.data['supplier'], 'line_items': response.data['line_items']}
+        self.client.put(self.url, data, format='json')
+        etag = self.assertModified(self.url, etag)
+        self.assertEqual(self.client.get(self.url).data['version'], 4)
+
+    def test_list_not_modified(self):
+        url = reverse('order-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        # ids and versions of the page only
+        self.assertNotModified(url, etag, self.AUTH_QUERIES + 1)
+
+        self.create_orders(1)
+        etag = self.assertModified(url, etag)
+
+        self.client.patch(reverse('lineitem-detail', args=[self.order.line_items.first().id]),
+                          {'quantity': 42}, format='json')
+        etag = self.assertModified(url, etag)
+
+        # pages and filters have their own ETags
+        self.assertModified(url + '?page_size=1', etag)
+        self.assertNotModified(url, etag, self.AUTH_QUERIES + 1)
+
+
+class ReportingTestCase(QueryBudgetMixin, APITestCase):
+    AUTH_QUERIES = 2
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.supplier = Supplier.objects.create(name='Test Supplier', email='test@example.com')
+        # numbers reserved by earlier, rolled back tests are still in memory
+        get_allocator.cache_clear()
+
+    def order_payload(self, supplier=None):
+        return {
+            "supplier": supplier or {"id": self.supplier.id, "name": self.supplier.name,
+                                     "email": self.supplier.email},
+            "line_items": [
+                {"item_name": f"prod {line}", "quantity": line + 1, "price_without_tax": 10.00,
+                 "tax_name": "GST 5%", "tax_amount": 0.50}
+                for line in range(2)
+            ]
+        }
+
+    def rollups(self):
+        return {(rollup.supplier_id, rollup.day): (
+                    rollup.order_count, rollup.total_quantity,
+                    rollup.total_amount, rollup.total_tax)
+                for rollup in SupplierDailyRollup.objects.all()}
+
+    def assertRollupsRebuilt(self):
+        """The incrementally maintained rollups equal a rebuild from scratch."""
+        incremental = self.rollups()
+        reporting.rebuild()
+        self.assertEqual(incremental, self.rollups())
+
+    def test_rollups_follow_writes(self):
+        today = timezone.localdate()
+        response = self.client.post(reverse('order-list'), self.order_payload(), format='json')
+        order_id = response.data['id']
+        self.assertEqual(self.rollups(), {(self.supplier.id, today): (1, 3, 21.0, 1.0)})
+
+        line_item_id = response.data['line_items'][0]['id']
+        self.client.patch(reverse('lineitem-detail', args=[line_item_id]),
+                          {'quantity': 10}, format='json')
+        self.assertEqual(self.rollups()[self.supplier.id, today], (1, 12, 21.0, 1.0))
+        self.client.delete(reverse('lineitem-detail', args=[line_item_id]))
+        self.assertEqual(self.rollups()[self.supplier.id, today], (1, 2, 10.5, 0.5))
+        self.assertRollupsRebuilt()
+
+        # moving the order to another supplier empties its previous cell
+        self.client.put(reverse('order-detail', args=[order_id]), self.order_payload(
+            supplier={"name": "Other Supplier", "email": "other@example.com"}), format='json')
+        other = Supplier.objects.get(name='Other Supplier')
+        self.assertEqual(self.rollups(), {(other.id, today): (1, 3, 21.0, 1.0)})
+
+        self.client.delete(reverse('order-detail', args=[order_id]))
+        self.assertEqual(self.rollups(), {})
+
+    def test_bulk_create_updates_rollups(self):
+        response = self.client.post(
+            reverse('order-bulk'), [self.order_payload() for _ in range(50)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.rollups(), {
+            (self.supplier.id, timezone.localdate()): (50, 150, 1050.0, 50.0)})
+        self.assertRollupsRebuilt()
+
+        # cells with and without rows
+        response = self.client.post(reverse('order-bulk'), [
+            self.order_payload(),
+            self.order_payload(supplier={"name": "Other Supplier", "email": "other@example.com"}),
+        ], format='json')
+        other = Supplier.objects.get(name='Other Supplier')
+        self.assertEqual(self.rollups(), {
+            (self.supplier.id, timezone.localdate()): (51, 153, 1071.0, 51.0),
+            (other.id, timezone.localdate()): (1, 3, 21.0, 1.0)})
+        self.assertRollupsRebuilt()
+
+    def test_supplier_delete_query_budget(self):
+        other = Supplier.objects.create(name='Other Supplier', email='other@example.com')
+        for size in (10, 100):
+            supplier = Supplier.objects.create(name=f'Supplier {size}', email=f'{size}@example.com')
+            self.create_orders(size, supplier=supplier)
+            self.create_orders(1, supplier=other)
+            reporting.rebuild()
+            # its rollups are deleted with it, not adjusted order by order
+            with self.assertMaxQueries(8):
+                if size == 10:
+                    supplier.delete()
+                else:
+                    Supplier.objects.filter(id=supplier.id).delete()
+            self.assertFalse(SupplierDailyRollup.objects.filter(supplier_id=supplier.id).exists())
+            self.assertRollupsRebuilt()
+
+    def test_rolled_back_writes(self):
+        order = self.create_orders(1, supplier=self.supplier)[0]
+        reporting.rebuild()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            order.line_items.first().delete()
+            self.assertEqual(self.rollups()[self.supplier.id, timezone.localdate()][:2], (1, 2))
+            raise RuntimeError
+        # rolled back with the deleted line item
+        self.assertEqual(self.rollups()[self.supplier.id, timezone.localdate()][:2], (1, 3))
+        LineItem.objects.create(item_name='Extra', quantity=1, price_without_tax=1.0,
+                                tax_name='GST 5%', tax_amount=0.05, purchase_order=order)
+        self.assertEqual(self.rollups()[self.supplier.id, timezone.localdate()][:2], (1, 4))
+        self.assertRollupsRebuilt()
+
+    def test_archived_orders_leave_rollups_unchanged(self):
+        orders = self.create_orders(2, supplier=self.supplier)
+        reporting.rebuild()
+        rollups = self.rollups()
+        with reporting.unchanged():
+            orders[0].delete()
+        self.assertEqual(self.rollups(), rollups)
+        orders[1].delete()
+        self.assertEqual(self.rollups()[self.supplier.id, timezone.localdate()], (1, 3, 21.0, 1.0))
+
+    def test_rebuild_command(self):
+        orders = self.create_orders(4, supplier=self.supplier)
+        for days, order in enumerate(orders):
+            order.order_time -= timedelta(days=days)
+        Order.objects.bulk_update(orders, ['order_time'])
+        days = [timezone.localdate(order.order_time) for order in orders]
+
+        out = StringIO()
+        call_command('rebuild_rollups', since=days[2].isoformat(), stdout=out)
+        self.assertIn('Successfully rebuilt 3 rollup rows', out.getvalue())
+        self.assertEqual(set(self.rollups()), {(self.supplier.id, day) for day in days[:3]})
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(len(self.rollups()), 4)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', since='2024-02-01', until='2024-01-01')
+
+    def test_report_endpoints(self):
+        other = Supplier.objects.create(name='Other Supplier', email='other@example.com')
+
+        url = reverse('supplierdailyrollup-list')
+        # served from the rollups: the same queries whatever the number of
+        # line items (110 orders per supplier once filled)
+        for size in (10, 100):
+            for supplier in (self.supplier, other):
+                self.create_orders(size, supplier=supplier)
+            reporting.rebuild()
+            for name in ('list', 'daily', 'suppliers'):
+                with self.subTest(rows=size, endpoint=name):
+                    self.assertQueryBudget(reverse(f'supplierdailyrollup-{name}'),
+                                           self.AUTH_QUERIES + 1)
+
+        today = timezone.localdate()
+        response = self.client.get(url, {'supplier': other.id, 'day_after': today.isoformat()})
+        self.assertEqual(response.data['results'], [{
+            'supplier': other.id, 'day': today.isoformat(), 'order_count': 110,
+            'total_quantity': 330, 'total_amount': 2310.0, 'total_tax': 110.0}])
+        response = self.client.get(url, {'day_before': (today - timedelta(days=1)).isoformat()})
+        self.assertEqual(response.data['results'], [])
+
+        response = self.client.get(reverse('supplierdailyrollup-daily'))
+        self.assertEqual(response.data, [{
+            'order_count': 220, 'total_quantity': 660, 'total_amount': 4620.0,
+            'total_tax': 220.0, 'day': today.isoformat()}])
+        response = self.client.get(reverse('supplierdailyrollup-suppliers'))
+        self.assertEqual([(row['supplier_name'], row['order_count']) for row in response.data],
+                         [('Test Supplier', 110), ('Other Supplier', 110)])
+
+
+class AsyncReadViewsTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        supplier_cache.get_cache().clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        self.orders = self.create_orders(5)
+
+    def aget(self, url, data=None, headers=None):
+        return async_to_sync(self.async_client.get)(url, data, headers=headers)
+
+    def assertSameResponse(self, name, args=(), data=None):
+        expected = self.client.get(reverse(name, args=args), data, HTTP_ACCEPT='application/json')
+        response = self.aget(reverse(f'async-{name}', args=args), data)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response['Content-Type'], expected['Content-Type'])
+        # pagination links point to the async views
+        self.assertEqual(response.content.replace(b'/purchase/async/', b'/purchase/'),
+                         expected.content)
+        return response
+
+    def test_same_responses(self):
+        order = self.orders[2]
+        line_item = order.line_items.first()
+        self.assertSameResponse('order-list')
+        response = self.assertSameResponse('order-list', data={'page_size': 2})
+        self.assertSameResponse('order-list', data={
+            'page_size': 2, 'cursor': response.json()['next'].split('cursor=')[1]})
+        self.assertSameResponse('order-list', data={'supplier_name': 'Budget'})
+        self.assertSameResponse('order-list', data={'item_name': 'Item 1'})
+        self.assertSameResponse('order-detail', args=[order.id])
+        self.assertSameResponse('supplier-list')
+        self.assertSameResponse('supplier-detail', args=[order.supplier_id])
+        self.assertSameResponse('lineitem-list', data={'page_size': 3})
+        self.assertSameResponse('lineitem-detail', args=[line_item.id])
+
+    def test_errors(self):
+        self.assertSameResponse('order-detail', args=[0])
+        self.assertSameResponse('order-detail', args=['abc'])
+        self.assertSameResponse('order-list', data={'order_time_after': 'yesterday'})
+        self.assertSameResponse('order-list', data={'cursor': 'garbage'})
+        response = async_to_sync(self.async_client.post)(reverse('async-order-list'), {})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_authentication(self):
+        self.client.logout()
+        self.async_client.logout()
+        response = self.assertSameResponse('order-list')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        credentials = base64.b64encode(b'testuser:testpassword').decode()
+        response = self.aget(reverse('async-order-list'), headers={'Authorization': f'Basic {credentials}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        credentials = base64.b64encode(b'testuser:wrong').decode()
+        response = self.aget(reverse('async-order-list'), headers={'Authorization': f'Basic {credentials}'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_conditional_get(self):
+        for url in (reverse('async-order-list'),
+                    reverse('async-order-detail', args=[self.orders[0].id])):
+            etag = self.aget(url)['ETag']
+            response = self.aget(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response.content, b'')
+
+        self.orders[0].save()
+        response = self.aget(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SQLiteProfileTestCase(SimpleTestCase):
+    """Connections to a database file: the test database lives in memory."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'db.sqlite3')
+
+    def open(self, **options):
+        wrapper = DatabaseWrapper(
+            {**connection.settings_dict, 'NAME': self.path, 'OPTIONS': options}, alias='profile')
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def count_orders(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM purchase_order')
+            return cursor.fetchone()[0]
+
+    def start_order_write(self, writer):
+        """Insert an order in a transaction holding the write lock, as when committing."""
+        with writer.schema_editor(atomic=False) as editor:
+            editor.create_model(Supplier)
+            editor.create_model(Order)
+        cursor = writer.cursor()
+        cursor.execute("INSERT INTO purchase_supplier (name, email, version) "
+                       "VALUES ('s', 's@example.com', 1)")
+        cursor.execute('BEGIN EXCLUSIVE')
+        cursor.execute('INSERT INTO purchase_order (supplier_id, order_time, order_number, version) '
+                       'VALUES (1, %s, 1, 1)', [timezone.now()])
+        return cursor
+
+    def test_pragmas(self):
+        with self.settings(SQLITE={'PROFILE': 'production', 'PRAGMAS': {'cache_size': -1000}}):
+            wrapper = self.open()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -1000)
+
+        with self.settings(SQLITE={'PROFILE': 'unknown'}), self.assertRaises(ValueError):
+            self.open()
+
+    def test_readers_not_blocked_by_order_writes(self):
+        with self.settings(SQLITE={'PROFILE': 'production'}):
+            writer, reader = self.open(), self.open()
+        reader.inc_thread_sharing()
+        self.addCleanup(reader.dec_thread_sharing)
+        cursor = self.start_order_write(writer)
+
+        reader_thread = ThreadPoolExecutor(1)
+        self.addCleanup(reader_thread.shutdown)
+        # the last committed state, right away and from another thread
+        start = time.perf_counter()
+        self.assertEqual(reader_thread.submit(self.count_orders, reader).result(), 0)
+        self.assertLess(time.perf_counter() - start, 1)
+
+        cursor.execute('COMMIT')
+        self.assertEqual(reader_thread.submit(self.count_orders, reader).result(), 1)
+
+    def test_default_profile_blocks_readers(self):
+        with self.settings(SQLITE={'PROFILE': 'default'}):
+            writer, reader = self.open(), self.open(timeout=0.1)
+        cursor = self.start_order_write(writer)
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            self.count_orders(reader)
+        cursor.execute('COMMIT')
+        self.assertEqual(self.count_orders(reader), 1)
+
+    def test_refresh_replica(self):
+        with self.settings(SQLITE={'PROFILE': 'production'}):
+            writer = self.open()
+            replica = DatabaseWrapper(
+                {**connection.settings_dict, 'NAME': self.path + '.replica', 'OPTIONS': {}},
+                alias='replica')
+            self.addCleanup(replica.close)
+        cursor = self.start_order_write(writer)
+        cursor.execute('COMMIT')
+
+        self.assertGreater(routers.refresh(writer, replica), 0)
+        self.assertEqual(self.count_orders(replica), 1)
+        cursor.execute('INSERT INTO purchase_order (supplier_id, order_time, order_number, version) '
+                       'VALUES (1, %s, 2, 1)', [timezone.now()])
+        self.assertEqual(self.count_orders(replica), 1)
+        # the open replica connection sees the new copy
+        routers.refresh(writer, replica)
+        self.assertEqual(self.count_orders(replica), 2)
+
+
+@override_settings(REPLICA={'ENABLED': True, 'ALIAS': 'replica', 'STICKY_SECONDS': 15,
+                            'COOKIE': 'replica_pin'})
+class ReplicaRoutingTestCase(TransactionTestCase):
+    # the replica mirrors the test database through a connection of its own,
+    # which only sees committed data
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.supplier = Supplier.objects.create(name='Supplier', email='supplier@example.com')
+
+    def get(self, url):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(replica)
+
+    def test_reads_and_sticky_writes(self):
+        supplier_cache.local_representations.clear()
+        for url in (f'/purchase/suppliers/{self.supplier.id}/', '/purchase/suppliers/',
+                    '/purchase/orders/', '/purchase/line_items/'):
+            self.assertGreater(self.get(url)[1], 0, url)
+        # what is read from the replica, possibly stale, is not cached
+        self.assertGreater(self.get('/purchase/suppliers/')[1], 0)
+        self.assertFalse(supplier_cache.local_representations.entries)
+
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.post(
+                '/purchase/suppliers/', {'name': 'Other', 'email': 'other@example.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(replica), 0)
+        self.assertIn('replica_pin', response.cookies)
+
+        # the client reads its own writes until the pin expires
+        response, replica_queries = self.get('/purchase/suppliers/')
+        self.assertEqual(replica_queries, 0)
+        self.assertEqual(len(response.data['results']), 2)
+        self.client.cookies['replica_pin'] = str(time.time() - 1)
+        self.assertGreater(self.get('/purchase/orders/')[1], 0)
+
+        with self.settings(REPLICA={'ENABLED': False}):
+            self.assertEqual(self.get('/purchase/orders/')[1], 0)
+
+    def test_query_plan_audit(self):
+        results = {result['name']: result for result in query_plans.audit(['order.list', 'supplier.list'])}
+        for result in results.values():
+            self.assertEqual(result['status'], status.HTTP_200_OK)
+            self.assertTrue(result['queries'])
+            self.assertEqual({query['database'] for query in result['queries']}, {'replica'})
+
+    def test_router(self):
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Order))
+
+        request = self.client.get('/purchase/suppliers/').wsgi_request
+        state, token = routers.start_request(request)
+        try:
+            self.assertEqual(router.db_for_read(Order), 'replica')
+            self.assertIsNone(router.db_for_read(User))
+            supplier = Supplier.objects.get(pk=self.supplier.pk)
+            self.assertEqual(supplier._state.db, 'replica')
+            # writes go to default, as do the request's reads from then on
+            supplier.name = 'Renamed'
+            supplier.save()
+            self.assertEqual(supplier._state.db, 'default')
+            self.assertTrue(state.wrote)
+            self.assertIsNone(router.db_for_read(Order))
+        finally:
+            routers.current_state.reset(token)
+        self.assertFalse(router.allow_migrate('replica', 'purchase'))
+
+    def test_refresh_replica_command(self):
+        # the test replica mirrors the default database
+        with self.assertRaisesMessage(CommandError, 'must be a file of its own'):
+            call_command('refresh_replica', stdout=StringIO())
+
+
+class QueryPlanAuditTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.orders = self.create_orders(20)
+        other = Supplier.objects.create(name='Other Supplier', email='other@example.com')
+        self.create_orders(20, supplier=other)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_plans(self):
+        results = {result['name']: result for result in query_plans.audit()}
+        self.assertEqual(set(results), set(query_plans.AUDITED_REQUESTS))
+        for name in ('order.list', 'order.detail', 'order.filter_supplier', 'order.filter_order_time',
+                     'line_item.list', 'line_item.detail', 'supplier.list', 'supplier.detail'):
+            self.assertEqual(results[name]['status'], status.HTTP_200_OK, name)
+            self.assertTrue(results[name]['queries'], name)
+            for query in results[name]['queries']:
+                self.assertEqual(query['flags'], [], f"{name}: {query['plan']}")
+
+        plans = ['\n'.join(query['plan']) for query in results['order.filter_supplier']['queries']]
+        self.assertTrue(any('purchase_order_supplier_idx' in plan for plan in plans), plans)
+        plans = ['\n'.join(query['plan']) for query in results['order.detail']['queries']]
+        self.assertTrue(any('purchase_lineitem_order_idx' in plan for plan in plans), plans)
+
+    def test_plan_flags(self):
+        tables = {'purchase_order', 'purchase_lineitem_fts'}
+        self.assertEqual(query_plans.plan_flags([
+            'SCAN purchase_order',
+            '  SCAN purchase_lineitem_fts VIRTUAL TABLE INDEX 0:M1',
+            'SCAN purchase_order USING INDEX purchase_order_time_id_idx',
+            'SCAN sqlite_master',
+            'USE TEMP B-TREE FOR ORDER BY',
+        ], tables), ['full scan of purchase_order', 'temp B-tree for order by'])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('audit_queries', 'order.detail', 'line_item.', stdout=out)
+        output = out.getvalue()
+        self.assertIn('order.detail  GET /purchase/orders/', output)
+        self.assertIn('line_item.list', output)
+        self.assertNotIn('supplier.list', output)
+        self.assertIn('0 of', output)
+
+        out = StringIO()
+        with mock.patch.object(query_plans, 'plan_flags', return_value=['temp B-tree for order by']):
+            with self.assertRaisesMessage(CommandError, '4 of 4 queries flagged'):
+                call_command('audit_queries', 'order.detail', 'line_item.', fail_on_flags=True,
+                             stdout=out)
+        self.assertIn('! temp B-tree for order by', out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'No request matches'):
+            call_command('audit_queries', 'nothing', stdout=StringIO())
+
+    def test_requires_sqlite(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            with self.assertRaisesMessage(ValueError, 'only available on SQLite'):
+                query_plans.audit()
+            with self.assertRaisesMessage(CommandError, 'EXPLAIN QUERY PLAN'):
+                call_command('audit_queries', stdout=StringIO())
+
+
+class OrderArchiveTestCase(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.orders = self.create_orders(4)
+        for age, order in zip((400, 401), self.orders[:2]):
+            order.order_time = timezone.now() - timedelta(days=age)
+            order.save()
+        reporting.rebuild()
+
+    def rollups(self):
+        return list(SupplierDailyRollup.objects.order_by('day').values(
+            'supplier_id', 'day', 'order_count', 'total_quantity', 'total_amount', 'total_tax'))
+
+    def list_ids(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [order['id'] for order in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_archive_orders(self):
+        out = StringIO()
+        call_command('archive_orders', '--dry-run', stdout=out)
+        self.assertIn('2 orders', out.getvalue())
+        self.assertEqual(ArchivedOrder.objects.count(), 0)
+
+        rollups = self.rollups()
+        old = {order.id: (order.order_number, order.version) for order in
+               Order.objects.filter(id__in=[order.id for order in self.orders[:2]])}
+        out = StringIO()
+        call_command('archive_orders', '--batch-size', '1', stdout=out)
+        self.assertIn('Successfully archived 2 orders and 4 line items', out.getvalue())
+
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)),
+                         {order.id for order in self.orders[2:]})
+        self.assertEqual({order.id: (order.order_number, order.version)
+                          for order in ArchivedOrder.objects.all()}, old)
+        self.assertEqual(set(ArchivedLineItem.objects.values_list('purchase_order_id', flat=True)),
+                         set(old))
+        self.assertFalse(LineItem.objects.filter(purchase_order_id__in=old).exists())
+
+        # archived orders still count in the reports
+        self.assertEqual(self.rollups(), rollups)
+        reporting.rebuild()
+        self.assertEqual(self.rollups(), rollups)
+
+        # an order imported for an archived day shares its rollup cell
+        archived = ArchivedOrder.objects.get(id=self.orders[0].id)
+        imported = self.create_orders(1, supplier=archived.supplier)[0]
+        Order.objects.filter(id=imported.id).update(order_time=archived.order_time)
+        reporting.rebuild()
+        cell = SupplierDailyRollup.objects.get(
+            supplier_id=archived.supplier_id, day=reporting.day_of(archived.order_time))
+        self.assertEqual((cell.order_count, cell.total_quantity), (2, 6))
+        self.assertEqual(cell.total_amount, 2 * rollups[0]['total_amount'])
+        imported.delete()
+
+        # whole days only: today's orders stay
+        call_command('archive_orders', '--older-than', '0', stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_read_archived_orders(self):
+        url = reverse('order-list')
+        full = self.client.get(url).data
+        detail = self.client.get(reverse('order-detail', args=[self.orders[0].id]))
+        ids = self.list_ids(url + '?page_size=3')
+
+        archive.archive_orders(archive.cutoff_day())
+        recent = {order.id for order in self.orders[2:]}
+        self.assertEqual(self.list_ids(url), [order_id for order_id in ids if order_id in recent])
+        self.assertEqual(self.list_ids(url + '?page_size=3&include_archived=true'), ids)
+        second = self.client.get(self.client.get(
+            url + '?page_size=3&include_archived=true').data['next']).data
+        previous = self.client.get(second['previous']).data
+        self.assertEqual([order['id'] for order in previous['results']], ids[:3])
+
+        response = self.client.get(url, {'include_archived': 'true'})
+        self.assertEqual(response.data, full)
+        self.assertEqual(self.client.get(url, {'include_archived': 'true'},
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url, {'include_archived': 'true', 'item_name': 'Item 1',
+                                         'supplier': self.orders[0].supplier_id,
+                                         'fields': 'id,line_items'})
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(len(response.data['results'][-1]['line_items']), 2)
+        response = self.client.get(url, {'include_archived': 'maybe'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('include_archived', response.data)
+
+        # retrieved by id without asking
+        response = self.client.get(reverse('order-detail', args=[self.orders[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, detail.data)
+        self.assertEqual(response['ETag'], detail['ETag'])
+        self.assertEqual(self.client.get(reverse('order-detail', args=[self.orders[0].id]),
+                                         HTTP_IF_NONE_MATCH=detail['ETag']).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        # the supplier is part of the representation
+        supplier = self.orders[0].supplier
+        supplier.name = 'Renamed supplier'
+        supplier.save()
+        response = self.client.get(reverse('order-detail', args=[self.orders[0].id]),
+                                   HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['supplier']['name'], 'Renamed supplier')
+        renamed = response['ETag']
+        SupplierResolver().resolve([{'id': supplier.id, 'name': 'Bulk renamed',
+                                     'email': supplier.email}])
+        response = self.client.get(reverse('order-detail', args=[self.orders[0].id]),
+                                   HTTP_IF_NONE_MATCH=renamed)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['supplier']['name'], 'Bulk renamed')
+        # archived orders are read-only
+        response = self.client.delete(reverse('order-detail', args=[self.orders[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -2,14 +2,27 @@ from django.urls import include, path
 from rest_framework import routers
 
 from purchase.views import OrderViewSet, LineItemViewSet, SupplierViewSet
+from purchase.views import SupplierDailyRollupViewSet
+from purchase.async_views import AsyncOrderView, AsyncLineItemView, AsyncSupplierView
 
 router = routers.DefaultRouter()
 router.register(r'suppliers', SupplierViewSet)
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'line_items', LineItemViewSet)
+router.register(r'reports/supplier_daily', SupplierDailyRollupViewSet)
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
 urlpatterns = [
     path('', include(router.urls)),
 ]
+
+# Read-only async views serving the same responses, see purchase/async_views.py
+urlpatterns += [
+    path('async/suppliers/', AsyncSupplierView.as_view(), name='async-supplier-list'),
+    path('async/suppliers/<str:pk>/', AsyncSupplierView.as_view(), name='async-supplier-detail'),
+    path('async/orders/', AsyncOrderView.as_view(), name='async-order-list'),
+    path('async/orders/<str:pk>/', AsyncOrderView.as_view(), name='async-order-detail'),
+    path('async/line_items/', AsyncLineItemView.as_view(), name='async-lineitem-list'),
+    path('async/line_items/<str:pk>/', AsyncLineItemView.as_view(), name='async-lineitem-detail'),
+]
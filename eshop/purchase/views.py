@@ -1,17 +1,31 @@
 from django.contrib.auth.models import Group, User
-from rest_framework import permissions, viewsets
+from django.db.models import Sum
+from django.http import Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import BooleanField
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from purchase.serializers import GroupSerializer, UserSerializer
 from purchase.serializers import SupplierSerializer, OrderSerializer, LineItemSerializer
-from purchase.models import Supplier, Order, LineItem
-from drf_spectacular.utils import extend_schema, extend_schema_view
-from purchase.filters import OrderFilter
+from purchase.serializers import OrderBulkResultSerializer
+from purchase.serializers import SupplierDailyRollupSerializer, DailyTotalsSerializer
+from purchase.serializers import SupplierTotalsSerializer
+from purchase.models import Supplier, Order, LineItem, SupplierDailyRollup, ArchivedOrder
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
+from django_filters.utils import translate_validation
+from purchase.filters import OrderFilter, SupplierDailyRollupFilter
+from purchase import cache as supplier_cache, etags, export, metrics as request_metrics, reporting
+from purchase import representations
+from purchase.pagination import OrderCursorPagination, SupplierCursorPagination, LineItemCursorPagination
+from purchase.pagination import SupplierDailyRollupCursorPagination
 
 
 class UserViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
-    queryset = User.objects.all().order_by('-date_joined')
+    queryset = User.objects.prefetch_related('groups').order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -25,25 +39,225 @@ class GroupViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 
-class SupplierViewSet(viewsets.ModelViewSet):
+def fieldset_schema(fields, relations=(), list_parameters=()):
+    """Document `?fields=` and `?expand=` on the list and retrieve actions."""
+    parameters = [OpenApiParameter(
+        'fields', str, description=f'Comma separated fields to output, among: {", ".join(fields)}')]
+    if relations:
+        parameters.append(OpenApiParameter(
+            'expand', str, description=f'Comma separated relations to nest, among: '
+                                       f'{", ".join(relations)}. Others are output as ids.'))
+    return extend_schema_view(list=extend_schema(parameters=[*parameters, *list_parameters]),
+                              retrieve=extend_schema(parameters=parameters))
+
+
+class SupplierGenerationMixin:
+    """
+    Takes the supplier cache generation before the view reads anything, so
+    that the suppliers it reads are not cached if a write commits meanwhile,
+    see purchase/cache.py.
+    """
+    supplier_generation = None
+
+    def initial(self, request, *args, **kwargs):
+        self.supplier_generation = supplier_cache.generation()
+        super().initial(request, *args, **kwargs)
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'supplier_generation': self.supplier_generation}
+
+
+@fieldset_schema(representations.SUPPLIER_FIELDS)
+class SupplierViewSet(SupplierGenerationMixin, viewsets.ModelViewSet):
     """
     API endpoint that supplier to be viewed or edited.
     """
     queryset = Supplier.objects.all()
     serializer_class = SupplierSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SupplierCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        fieldset = representations.requested_fields(request, representations.SUPPLIER_FIELDS)
+
+        def build():
+            data = super(SupplierViewSet, self).list(request, *args, **kwargs).data
+            data['results'] = [fieldset.select(supplier) for supplier in data['results']]
+            return data
+        response = Response(supplier_cache.cached_list(request.build_absolute_uri(), build))
+        # see purchase/compression.py
+        response.cache_compressed = True
+        return response
 
+    def retrieve(self, request, *args, **kwargs):
+        fieldset = representations.requested_fields(request, representations.SUPPLIER_FIELDS)
+        supplier_id = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        data = supplier_cache.get_by_id(int(supplier_id)) if supplier_id.isdigit() else None
+        if data is None:
+            data = super().retrieve(request, *args, **kwargs).data
+        response = Response(fieldset.select(data))
+        response.cache_compressed = True
+        return response
 
-class OrderViewSet(viewsets.ModelViewSet):
+
+@fieldset_schema(representations.ORDER_FIELDS, representations.ORDER_RELATIONS, [OpenApiParameter(
+    'include_archived', bool, description='Also list the archived orders, see purchase/archive.py')])
+class OrderViewSet(SupplierGenerationMixin, viewsets.ModelViewSet):
     """
     API endpoint that order to be viewed or edited.
     """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
-    queryset = Order.objects.all()
+    queryset = Order.objects.for_serialization()
     filterset_class = OrderFilter
+    pagination_class = OrderCursorPagination
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        # Serialize the response from the optimized queryset (totals + prefetch)
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+
+    # maximum number of orders accepted by one bulk request
+    bulk_max_size = 10000
+
+    @extend_schema(request=OrderSerializer(many=True),
+                   responses={201: OrderBulkResultSerializer(many=True)})
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create many orders in one request and one transaction.
+
+        Either every order is created, or the response lists the errors of
+        each order (by position) and nothing is written.
+        """
+        serializer = self.get_serializer(
+            data=request.data, many=True, max_length=self.bulk_max_size)
+        serializer.is_valid(raise_exception=True)
+        orders = serializer.save()
+        return Response(OrderBulkResultSerializer(orders, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+    @extend_schema(parameters=[OpenApiParameter(
+        'export_format', enum=list(export.EXPORT_FORMATS), default='ndjson')])
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def export(self, request):
+        """
+        Stream every order matching the filters, with its line items and
+        totals, as NDJSON (one order per line) or CSV (one line item per row).
+        """
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in export.EXPORT_FORMATS:
+            raise ValidationError({'export_format': [
+                f'Choose one of: {", ".join(export.EXPORT_FORMATS)}.']})
+
+        queryset = self.filter_queryset(self.get_queryset())
+        # the rows are read after the response leaves the view, pin the
+        # database the router picks for this request
+        queryset = queryset.using(queryset.db)
+        response = StreamingHttpResponse(
+            export.export_lines(queryset, export_format),
+            content_type=export.CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+    def order_querysets(self, include_archived):
+        """The filtered orders, then the filtered archived orders if `include_archived`."""
+        querysets = [self.filter_queryset(Order.objects.all())]
+        if include_archived:
+            # DjangoFilterBackend only filters querysets of the filterset's model
+            filterset = self.filterset_class(
+                self.request.query_params, queryset=ArchivedOrder.objects.all(), request=self.request)
+            if not filterset.is_valid():
+                raise translate_validation(filterset.errors)
+            querysets.append(filterset.qs)
+        return querysets
+
+    def include_archived(self, request):
+        value = request.query_params.get('include_archived')
+        if value is None:
+            return False
+        try:
+            return BooleanField().to_internal_value(value)
+        except ValidationError as error:
+            raise ValidationError({'include_archived': error.detail})
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Answers `If-None-Match` with 304 after a single query on the
+        order's versions, see purchase/etags.py. Orders that are not found
+        are looked up in the archive.
+        """
+        order_id = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        if not order_id.isdigit():
+            raise Http404
+        fieldset = representations.requested_fields(
+            request, representations.ORDER_FIELDS, representations.ORDER_RELATIONS)
+        querysets = self.order_querysets(include_archived=True)
+        etag_columns = representations.etag_columns(fieldset)
+        expected = etags.if_none_match(request)
+        if expected is not None:
+            for queryset in querysets:
+                key = queryset.filter(pk=order_id).values_list(*etag_columns).first()
+                if key is not None:
+                    etag = etags.order_etag(request, key)
+                    if etags.matches(expected, etag):
+                        return Response(status=status.HTTP_304_NOT_MODIFIED,
+                                        headers={'ETag': etag})
+                    break
 
+        for queryset in querysets:
+            row = representations.order_rows(queryset, fieldset).filter(pk=order_id).first()
+            if row is not None:
+                data = representations.orders(
+                    [row], fieldset, line_item_models=[queryset.line_item_model()],
+                    supplier_generation=self.supplier_generation)[0]
+                key = tuple(row[column] for column in etag_columns)
+                return Response(data, headers={'ETag': etags.order_etag(request, key)})
+        raise Http404
+
+    def list(self, request, *args, **kwargs):
+        """
+        Answers `If-None-Match` with 304 after fetching only the ids and
+        versions of the page's orders. Pages are built from `values()` rows
+        rather than serialized instances, see purchase/representations.py.
+        With `?include_archived=true`, pages are merged from the orders and
+        the archived orders.
+        """
+        fieldset = representations.requested_fields(
+            request, representations.ORDER_FIELDS, representations.ORDER_RELATIONS)
+        querysets = self.order_querysets(self.include_archived(request))
+        etag_columns = representations.etag_columns(fieldset)
+        expected = etags.if_none_match(request)
+        if expected is not None:
+            paginator = self.pagination_class()
+            rows = paginator.paginate_querysets(
+                # order_time to merge the pages of orders and archived orders
+                [queryset.values(*etag_columns, 'order_time') for queryset in querysets],
+                request, view=self)
+            etag = etags.page_etag(
+                request, [tuple(row[column] for column in etag_columns) for row in rows],
+                paginator.has_next)
+            if etags.matches(expected, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        page = self.paginator.paginate_querysets(
+            [representations.order_rows(queryset, fieldset) for queryset in querysets],
+            request, view=self)
+        response = self.get_paginated_response(representations.orders(
+            page, fieldset,
+            line_item_models=[queryset.line_item_model() for queryset in querysets],
+            supplier_generation=self.supplier_generation))
+        response['ETag'] = etags.page_etag(
+            request, [tuple(row[column] for column in etag_columns) for row in page],
+            self.paginator.has_next)
+        return response
+
+
+@fieldset_schema(representations.LINE_ITEM_FIELDS)
 class LineItemViewSet(viewsets.ModelViewSet):
     """
     API endpoint that line item to be viewed or edited.
@@ -51,3 +265,65 @@ class LineItemViewSet(viewsets.ModelViewSet):
     queryset = LineItem.objects.all()
     serializer_class = LineItemSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = LineItemCursorPagination
+
+    # Read from `values()` rows, see purchase/representations.py
+
+    def retrieve(self, request, *args, **kwargs):
+        fieldset = representations.requested_fields(request, representations.LINE_ITEM_FIELDS)
+        line_item_id = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        row = (representations.line_item_rows(self.filter_queryset(self.get_queryset()))
+               .filter(pk=line_item_id).first() if line_item_id.isdigit() else None)
+        if row is None:
+            raise Http404
+        return Response(fieldset.select(representations.line_item(row)))
+
+    def list(self, request, *args, **kwargs):
+        fieldset = representations.requested_fields(request, representations.LINE_ITEM_FIELDS)
+        page = self.paginate_queryset(
+            representations.line_item_rows(self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(
+            [fieldset.select(representations.line_item(row)) for row in page])
+
+
+class SupplierDailyRollupViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint serving spend reports from the supplier daily rollups,
+    see purchase/reporting.py. Filter with `supplier`, `day_after` and
+    `day_before`.
+    """
+    queryset = SupplierDailyRollup.objects.all()
+    serializer_class = SupplierDailyRollupSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filterset_class = SupplierDailyRollupFilter
+    pagination_class = SupplierDailyRollupCursorPagination
+
+    def totals(self, *group_by):
+        return (self.filter_queryset(self.get_queryset())
+                .order_by(*group_by)
+                .values(*group_by)
+                .annotate(**{name: Sum(name) for name in reporting.AGGREGATES}))
+
+    @extend_schema(responses=DailyTotalsSerializer(many=True))
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def daily(self, request):
+        """Totals of every supplier per day."""
+        return Response(DailyTotalsSerializer(self.totals('day'), many=True).data)
+
+    @extend_schema(responses=SupplierTotalsSerializer(many=True))
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def suppliers(self, request):
+        """Totals of each supplier over the days."""
+        return Response(SupplierTotalsSerializer(
+            self.totals('supplier_id', 'supplier__name'), many=True).data)
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint: request and SQL metrics of every worker process.
+    Only served to METRICS['ALLOWED_IPS'] and to holders of METRICS['TOKEN'].
+    """
+    if not request_metrics.allows_scrape(request):
+        return HttpResponseForbidden()
+    return HttpResponse(request_metrics.render(*request_metrics.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')